@@ -1,14 +1,14 @@
-import pandas as pd
+import bisect
+import functools
+from collections import namedtuple
 import json
 import os
 import random
 import re
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Font, PatternFill, Border, Side
 
-# Use a fresh seed each run to get a new timetable
-random.seed()
-print("Generating Timetable...")
+# pandas and openpyxl are imported where they are used, so importing this
+# module (tests, worker processes) does not pay for them.
+
 days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
 excluded = ["07:30-09:00", "10:30-10:45", "13:15-14:00", "17:30-18:30"]
 # Tracks which course is using C004 in each slot (across all years/branches)
@@ -28,11 +28,11 @@ colors = [
     "E8BAFF","BAFFD6","FFF2BA","DAD7FF","BFFFE1","FFDAB8","E2FFBA","BAF7FF"
 ]
 
-thin = Border(left=Side(style='thin'), right=Side(style='thin'),
-              top=Side(style='thin'), bottom=Side(style='thin'))
-
-with open("data/time_slots.json") as f:
-    slots = json.load(f)["time_slots"]
+@functools.lru_cache(maxsize=None)
+def thin_border():
+    from openpyxl.styles import Border, Side
+    return Border(left=Side(style='thin'), right=Side(style='thin'),
+                  top=Side(style='thin'), bottom=Side(style='thin'))
 
 def normalize_time(t):
     h, m = t.split(":")
@@ -88,7 +88,7 @@ def split_faculty_names(name):
 def build_course_index():
     """Map Course_Code -> list of (Course_Title, Departments, Faculty)."""
     idx = {}
-    all_courses = coursesCSE + coursesECE + coursesDSAI + (coursesVII or [])
+    all_courses = DATA.all_courses
     for c in all_courses:
         code = s(c.get("Course_Code",""))
         title = s(c.get("Course_Title",""))
@@ -104,27 +104,22 @@ def build_room_map_from_tt(tt):
     Build a map: Course_Code -> set of rooms found in timetable cells.
     """
     room_map = {}
-    for d in days:
-        for s_ in slot_keys:
-            val = tt.at[d, s_]
-            if not isinstance(val, str) or val.strip() == "":
-                continue
-            code = extract_course_code(val)
-            if not code:
-                continue
-            m = re.search(r"\(([^)]+)\)", val)
-            if not m:
-                continue
-            room = m.group(1).strip()
-            if not room:
-                continue
-            room_map.setdefault(code, set()).add(room)
+    for code, counts in tt.code_values.items():
+        for vid in counts:
+            val = tt.values[vid]
+            if isinstance(val, Placement):
+                room = val.room_label()
+            else:
+                m = re.search(r"\(([^)]+)\)", val)
+                room = m.group(1).strip() if m else ""
+            if room:
+                room_map.setdefault(code, set()).add(room)
     return room_map
 
 def build_course_faculty_map():
     """Map Course_Code -> list of faculty names (split on '/')."""
     fmap = {}
-    all_courses = coursesCSE + coursesECE + coursesDSAI + (coursesVII or [])
+    all_courses = DATA.all_courses
     for c in all_courses:
         code = s(c.get("Course_Code",""))
         fac = s(c.get("Faculty",""))
@@ -133,241 +128,312 @@ def build_course_faculty_map():
         fmap[code] = split_faculty_names(fac)
     return fmap
 
-def _parse_blocks_from_ws(ws):
+def _cell_rooms(value):
+    """Rooms named in a cell value, e.g. "CS101 (Lab-L105)" -> ["L105"]."""
+    if isinstance(value, Placement):
+        return list(value.rooms)
+    rooms = []
+    for group in re.findall(r"\(([^)]+)\)", value):
+        for r in group.split(","):
+            r = r.strip()
+            if r.upper().startswith("LAB-"):
+                r = r[4:]
+            if r:
+                rooms.append(r)
+    return rooms
+
+def cell_faculty(value, course_faculty_map=None):
     """
-    Return list of blocks: dict with keys:
-    label, half (1 or 2), header_row, slots(list), day_rows(list of (row_idx, day))
+    Faculty teaching a cell: the Placement's own faculty, so sections of
+    one code taught by different people stay apart. Plain-text cells fall
+    back to course_faculty_map (Course_Code -> names).
     """
-    blocks = []
-    max_row = ws.max_row
-    for r in range(1, max_row + 1):
-        val = ws.cell(r, 1).value
-        if not isinstance(val, str):
-            continue
-        if "First Half" in val or "Second Half" in val:
-            label = val.strip()
-            half = 1 if "First Half" in label else 2
-            # find header row with "Day"
-            hr = r + 1
-            while hr <= max_row and str(ws.cell(hr, 1).value).strip() != "Day":
-                hr += 1
-            if hr > max_row:
-                continue
-            # slot headers from column 2 until empty
-            slots = []
-            c = 2
-            while True:
-                v = ws.cell(hr, c).value
-                if v is None or str(v).strip() == "":
-                    break
-                slots.append(str(v).strip())
-                c += 1
-            # day rows until blank day
-            day_rows = []
-            rr = hr + 1
-            while rr <= max_row:
-                day = ws.cell(rr, 1).value
-                if not isinstance(day, str) or day.strip() == "":
-                    break
-                day_rows.append((rr, day.strip()))
-                rr += 1
-            blocks.append({
-                "label": label,
-                "half": half,
-                "header_row": hr,
-                "slots": slots,
-                "day_rows": day_rows
-            })
-    return blocks
+    if isinstance(value, Placement):
+        return list(value.faculty)
+    return (course_faculty_map or {}).get(extract_course_code(value), [])
 
-def repair_faculty_clashes(wb, faculty_tt, course_faculty_map):
+def full_semester_codes():
+    """Codes taught across both halves (Semester_Half == "0")."""
+    return {s(c.get("Course_Code", "")) for c in DATA.all_courses
+            if s(c.get("Semester_Half", "")) == "0"}
+
+def repair_faculty_clashes(config, state, course_faculty_map, full_sem=None):
     """
-    Deterministic repair: for each half, if same faculty teaches different
-    courses in same day+slot across blocks, move later-sorted entries to any
-    free contiguous slot block in the same timetable block (prefer same day).
+    Deterministic repair on the scheduled grids, before anything is rendered:
+    if the same faculty teaches different courses in the same half+day+slot
+    across blocks, keep the first (by sheet, block label, course) and move
+    the others to the first free window of the same length in minutes (same
+    day first, from the grid's WindowCatalog). A run is a stretch of cells
+    holding one value, so every component keeps its minutes, and its
+    faculty are that value's (cell_faculty()), so sections of one code
+    taught by different people do not clash.
+
+    Runs that share a slot by design move together as one unit: copies of
+    the same course at the same day and slots in other blocks of the half
+    (combined courses, electives) and, for full-semester courses, the copy
+    in the other half. A window is free if it is empty and not forbidden in
+    every member's block and the faculty and rooms are free there. Faculty
+    usage is indexed by (half, day, slot, faculty), so the pass is linear in
+    the number of placed slots plus the window search for each unit moved.
     """
-    moved = 0
-    entries = []
-
-    # Build entries and faculty usage map
     from collections import defaultdict
-    fac_usage = defaultdict(list)  # (half, day, slot, faculty) -> list of entries
-    for ws in wb.worksheets:
-        blocks = _parse_blocks_from_ws(ws)
-        for blk in blocks:
-            slots = blk["slots"]
-            slot_idx = {s:i for i,s in enumerate(slots)}
-            for row_idx, day in blk["day_rows"]:
-                for s in slots:
-                    col = 2 + slot_idx[s]
-                    val = ws.cell(row_idx, col).value
-                    if not isinstance(val, str) or val.strip() == "":
-                        continue
-                    code = extract_course_code(val)
-                    if not code:
-                        continue
-                    facs = course_faculty_map.get(code, [])
-                    e = {
-                        "half": blk["half"],
-                        "day": day,
-                        "slot": s,
-                        "faculty_list": facs,
-                        "ws": ws,
-                        "block": blk,
-                        "row": row_idx,
-                        "col": col,
-                        "value": val,
-                        "code": code
-                    }
-                    entries.append(e)
-                    for fac in facs:
-                        fac_usage[(blk["half"], day, s, fac)].append(e)
-
-    # group by clash key
-    groups = defaultdict(list)
-    for e in entries:
-        for fac in e["faculty_list"]:
-            groups[(e["half"], e["day"], e["slot"], fac)].append(e)
-
-    def is_slot_free_for_fac(half, day, slot, fac_list):
-        for fac in fac_list:
-            if fac_usage.get((half, day, slot, fac)):
-                return False
-        return True
-
-    def is_merged(ws, row, col):
-        return ws.cell(row, col).coordinate in ws.merged_cells
-
-    def find_contiguous_block(ws, row, slots, slot_idx, code):
-        # find contiguous block of same course code in the row
-        idxs = []
-        for s in slots:
-            col = 2 + slot_idx[s]
-            if is_merged(ws, row, col):
-                return None
-            val = ws.cell(row, col).value
-            if isinstance(val, str) and extract_course_code(val) == code:
-                idxs.append(slot_idx[s])
-        if not idxs:
-            return None
-        idxs.sort()
-        # return the contiguous run containing the first idx
-        start = idxs[0]
-        end = idxs[0]
-        for i in idxs[1:]:
-            if i == end + 1:
-                end = i
-            else:
-                break
-        return list(range(start, end + 1))
+    if full_sem is None:
+        full_sem = full_semester_codes()
+    faculty_tt = state["faculty_tt"]
+    room_views = {half: RoomLayerView(state["room_busy"], half) for half in ROOM_LAYERS}
+    sheet_of = {g["label"]: sheet["sheet"] for sheet in config["sheets"] for g in sheet["groups"]}
+
+    runs = []
+    units = {}                     # (code, day, start, end, half or "both") -> unit
+    fac_usage = defaultdict(set)   # (half, day, slot index, faculty) -> run ids
+    for g, half, label in group_runs(config):
+        if label not in timetable_grids:
+            continue
+        tt = timetable_grids[label][0]
+        for d in tt.days:
+            row = tt.row(d)
+            i = 0
+            while i < len(row):
+                code = extract_course_code(row[i]) if row[i] else ""
+                j = i + 1
+                while code and j < len(row) and row[j] == row[i]:
+                    j += 1
+                facs = cell_faculty(row[i], course_faculty_map) if code else []
+                if facs:
+                    run = {"id": len(runs), "tt": tt, "half": half, "day": d,
+                           "start": i, "end": j, "code": code, "facs": facs,
+                           "room_busy": room_views[0 if code in full_sem else half]}
+                    runs.append(run)
+                    ukey = (code, d, i, j, "both" if code in full_sem else half)
+                    unit = units.setdefault(ukey, {"sort": (sheet_of[g["label"]], label, code), "runs": []})
+                    unit["runs"].append(run)
+                    run["unit"] = unit
+                    for si in range(i, j):
+                        for fac in facs:
+                            fac_usage[(half, d, si, fac)].add(run["id"])
+                i = j
+
+    def run_rooms(run):
+        tt = run["tt"]
+        rooms = set()
+        for si in range(run["start"], run["end"]):
+            rooms.update(_cell_rooms(tt.values[tt.cells[tt.day_idx[run["day"]]][si]]))
+        rooms.discard("C004")   # the combined-class hall is shared by design
+        return rooms
+
+    def window_free(run, d, slots, rooms):
+        tt = run["tt"]
+        mask = tt.mask_of(slots)
+        if mask is None or tt.occ[tt.day_idx[d]] & mask:
+            return False
+        for s_ in slots:
+            for fac in run["facs"]:
+                if fac_usage.get((run["half"], d, tt.slot_idx[s_], fac)):
+                    return False
+        return all(run["room_busy"].is_free(d, r, mask) for r in rooms)
+
+    def move(run, d, slots, rooms):
+        tt = run["tt"]
+        half, old_day = run["half"], run["day"]
+        old_slots = tt.slots[run["start"]:run["end"]]
+        value = tt.get(old_day, old_slots[0])
+        old_mask = tt.mask_of(old_slots)
+        for si, s_ in zip(range(run["start"], run["end"]), old_slots):
+            tt.set(old_day, s_, "")
+            for fac in run["facs"]:
+                fac_usage[(half, old_day, si, fac)].discard(run["id"])
+                faculty_tt.get(half, {}).get(fac, {}).get(old_day, {}).pop(s_, None)
+        for r in rooms:
+            run["room_busy"].release(old_day, r, old_mask)
+        for s_ in slots:
+            tt.set(d, s_, value)
+            for fac in run["facs"]:
+                fac_usage[(half, d, tt.slot_idx[s_], fac)].add(run["id"])
+                faculty_tt.setdefault(half, {}).setdefault(fac, {}).setdefault(d, {})[s_] = value
+        new_mask = tt.mask_of(slots)
+        for r in rooms:
+            run["room_busy"].occupy(d, r, new_mask)
+        fac_busy = state["faculty_busy"][half]
+        for fac in run["facs"]:
+            fac_busy.occupy(d, fac, new_mask)
+            for si, s_ in zip(range(run["start"], run["end"]), old_slots):
+                if not fac_usage.get((half, old_day, si, fac)):
+                    fac_busy.release(old_day, fac, tt.slot_bit[s_])
+        run["day"], run["start"], run["end"] = d, tt.slot_idx[slots[0]], tt.slot_idx[slots[-1]] + 1
+
+    def unit_target(unit):
+        # Rooms are read from the old cells and shared between copies of a
+        # unit, so each room is checked once per window.
+        lead = unit["runs"][0]
+        rooms = {r for run in unit["runs"] for r in run_rooms(run)}
+        windows = lead["tt"].windows
+        minutes = windows.prefix[lead["end"]] - windows.prefix[lead["start"]]
+        days_order = [lead["day"]] + [d for d in lead["tt"].days if d != lead["day"]]
+        for d in days_order:
+            for slots, _mask in windows.windows(minutes):
+                if all(window_free(run, d, slots, rooms if k == 0 else ())
+                       for k, run in enumerate(unit["runs"])):
+                    return d, slots
+        return None
 
-    for key, items in groups.items():
-        # only if different courses
-        codes = {i["code"] for i in items}
-        if len(codes) <= 1:
+    moved = 0
+    for key in list(fac_usage):
+        here = [runs[rid] for rid in fac_usage[key]]
+        if len({r["code"] for r in here}) <= 1:
             continue
-        # deterministic order: keep first, move others
-        items.sort(key=lambda x: (x["ws"].title, x["block"]["label"], x["code"]))
-        for it in items[1:]:
-            blk = it["block"]
-            ws = it["ws"]
-            slots = blk["slots"]
-            slot_idx = {s:i for i,s in enumerate(slots)}
-            # contiguous block to move
-            run = find_contiguous_block(ws, it["row"], slots, slot_idx, it["code"])
-            if not run:
+        here_units = []
+        for run in here:
+            if not any(u is run["unit"] for u in here_units):
+                here_units.append(run["unit"])
+        here_units.sort(key=lambda u: u["sort"])
+        for unit in here_units[1:]:
+            if not any(run["id"] in fac_usage[key] for run in unit["runs"]):
                 continue
-            run_len = len(run)
-            half = blk["half"]
-            fac_list = it["faculty_list"]
-
-            # helper to test a candidate start index on a given row
-            def can_place(row_idx, start_i):
-                target_slots = slots[start_i:start_i+run_len]
-                # slot availability + forbidden check
-                for s in target_slots:
-                    if s in FORBIDDEN_SLOTS:
-                        return False
-                    col = 2 + slot_idx[s]
-                    if is_merged(ws, row_idx, col):
-                        return False
-                    if ws.cell(row_idx, col).value not in (None, ""):
-                        return False
-                    if not is_slot_free_for_fac(half, day_name, s, fac_list):
-                        return False
-                return True
-
-            placed = False
-            # try same day first
-            day_name = it["day"]
-            for start_i in range(0, len(slots) - run_len + 1):
-                if can_place(it["row"], start_i):
-                    target_slots = slots[start_i:start_i+run_len]
-                    # move cells
-                    for idx in run:
-                        s = slots[idx]
-                        col = 2 + slot_idx[s]
-                        if is_merged(ws, it["row"], col):
-                            continue
-                        ws.cell(it["row"], col).value = ""
-                        for fac in fac_list:
-                            fac_usage[(half, day_name, s, fac)] = [
-                                e for e in fac_usage[(half, day_name, s, fac)] if e is not it
-                            ]
-                            if half in faculty_tt and fac in faculty_tt[half] and day_name in faculty_tt[half][fac]:
-                                faculty_tt[half][fac][day_name].pop(s, None)
-                    for s in target_slots:
-                        col = 2 + slot_idx[s]
-                        if is_merged(ws, it["row"], col):
-                            continue
-                        ws.cell(it["row"], col).value = it["value"]
-                        for fac in fac_list:
-                            fac_usage[(half, day_name, s, fac)].append(it)
-                            if half in faculty_tt:
-                                faculty_tt[half].setdefault(fac, {}).setdefault(day_name, {})[s] = it["value"]
-                    moved += 1
-                    placed = True
-                    break
-            if placed:
+            target = unit_target(unit)
+            if target is None:
                 continue
+            for run in unit["runs"]:
+                move(run, *target, run_rooms(run))
+                moved += 1
+    return moved
 
-            # try other days
-            for row_idx, day_name in blk["day_rows"]:
-                if day_name == it["day"]:
+def reassign_rooms(config, state, results=None, full_sem=None):
+    """
+    Post-pass on the scheduled grids, with every course held at its slots:
+    re-solve the rooms of the lecture, tutorial and lab components of
+    regular courses per (half, day, slot) window as one min-cost assignment
+    (match_rooms()) over rooms.csv capacities, so a component only keeps a
+    room too large for it, or one too small, when no better room is free.
+
+    A component keeps one room across all of its runs (both halves for a
+    full-semester course), so a room is only offered when it is free at
+    every run; room usage is counted from the cells of all grids, which
+    also hold the basket rooms. A window's new assignment is kept only if
+    it costs less (fewer rooms too small, then fewer empty seats).
+    Electives and combined courses keep their rooms. Grid cells, faculty_tt,
+    the room layers, legend_room_map and, given results, the legends follow.
+    Returns the number of components that changed room.
+    """
+    from collections import Counter
+    if full_sem is None:
+        full_sem = {code.strip().upper() for code in full_semester_codes()}
+    faculty_tt = state["faculty_tt"]
+    usage = Counter()       # (half, day, slot index, room) -> cells booking it
+    items = {}              # (group label or run label, value) -> component
+    for g, half, label in group_runs(config):
+        if label not in timetable_grids:
+            continue
+        tt = timetable_grids[label][0]
+        for d in tt.days:
+            for si, v in enumerate(tt.row(d)):
+                for r in (_cell_rooms(v) if v else ()):
+                    usage[(half, d, si, r)] += 1
+        prefix = g.get("room_prefix")
+        for code, counts in tt.code_values.items():
+            for vid in counts:
+                v = tt.values[vid]
+                if (not isinstance(v, Placement) or v.elective or v.combined or v.basket
+                        or len(v.rooms) != 1):
                     continue
-                for start_i in range(0, len(slots) - run_len + 1):
-                    if can_place(row_idx, start_i):
-                        target_slots = slots[start_i:start_i+run_len]
-                        # clear old
-                        for idx in run:
-                            s = slots[idx]
-                            col = 2 + slot_idx[s]
-                            if is_merged(ws, it["row"], col):
-                                continue
-                            ws.cell(it["row"], col).value = ""
-                            for fac in fac_list:
-                                fac_usage[(half, it["day"], s, fac)] = [
-                                    e for e in fac_usage[(half, it["day"], s, fac)] if e is not it
-                                ]
-                                if half in faculty_tt and fac in faculty_tt[half] and it["day"] in faculty_tt[half][fac]:
-                                    faculty_tt[half][fac][it["day"]].pop(s, None)
-                        # place new
-                        for s in target_slots:
-                            col = 2 + slot_idx[s]
-                            if is_merged(ws, row_idx, col):
-                                continue
-                            ws.cell(row_idx, col).value = it["value"]
-                            for fac in fac_list:
-                                fac_usage[(half, day_name, s, fac)].append(it)
-                                if half in faculty_tt:
-                                    faculty_tt[half].setdefault(fac, {}).setdefault(day_name, {})[s] = it["value"]
-                        moved += 1
-                        placed = True
+                runs = [(d, [tt.slot_idx[s_] for s_ in slots]) for d, slots, typ in
+                        tt.course_runs(code, by_typ=True) if typ == v.typ]
+                runs = [(half, tt, d, sis) for d, sis in runs if all(tt.row(d)[si] == v for si in sis)]
+                if not runs:
+                    continue
+                key = (g["label"] if code in full_sem else label, v)
+                if key in items:
+                    items[key]["runs"] += runs
+                    items[key]["labels"].append(label)
+                    continue
+                n = None
+                for c in DATA.course_groups[g["key"]]:
+                    if s(c.get("Course_Code", "")).upper() == code:
+                        n = to_int_or_none(c.get("total_students"))
                         break
-                if placed:
-                    break
-
-    return moved
+                if v.typ == "P":
+                    lab, cls, lab_pref = True, None, lab_prefix_for_class_prefix.get(prefix)
+                else:
+                    lab, cls, lab_pref = False, prefix, None
+                cands = list(room_candidates(lab=lab, prefix=cls, lab_prefix=lab_pref, min_capacity=n))
+                cands += [r for r in room_candidates(lab=lab, prefix=cls, lab_prefix=lab_pref, min_capacity=None)
+                          if r not in cands]
+                if v.rooms[0] not in cands:
+                    cands.append(v.rooms[0])
+                items[key] = {"id": len(items), "labels": [label], "value": v, "runs": runs,
+                              "layer": 0 if code in full_sem else half,
+                              "n": n, "cands": cands, "room": v.rooms[0]}
+    items = list(items.values())
+
+    def seat_cost(room, n):
+        cap = DATA.rooms.capacity_of(room)
+        if cap is None or n is None:
+            return (0, 0)
+        return (0, int(cap - n)) if cap >= n else (1, int(n - cap))
+
+    def book(item, room, k):
+        for half, _tt, d, sis in item["runs"]:
+            for si in sis:
+                usage[(half, d, si, room)] += k
+
+    def room_free(item, room):
+        return all(not usage[(half, d, si, room)] for half, _tt, d, sis in item["runs"] for si in sis)
+
+    windows = {}
+    for item in items:
+        for half, tt, d, sis in item["runs"]:
+            for si in sis:
+                here = windows.setdefault((half, tt.day_idx[d], si), [])
+                if item not in here:
+                    here.append(item)
+    for key in sorted(windows):
+        here = windows[key]
+        for item in here:
+            book(item, item["room"], -1)
+        allowed = {item["id"]: [r for r in item["cands"] if room_free(item, r)] for item in here}
+        got, _certificate = match_rooms([(item["id"], item["n"]) for item in here], allowed)
+        old = [seat_cost(item["room"], item["n"]) for item in here]
+        new = [seat_cost(got[item["id"]], item["n"]) for item in here if item["id"] in got]
+        keep_old = all(item["room"] in allowed[item["id"]] for item in here)
+        better = len(got) == len(here) and (
+            not keep_old or tuple(map(sum, zip(*new))) < tuple(map(sum, zip(*old))))
+        for item in here:
+            if better:
+                item["room"] = got[item["id"]]
+            book(item, item["room"], 1)
+
+    moved = [item for item in items if item["room"] != item["value"].rooms[0]]
+    layers = state["room_busy"]
+    changed = {}
+    for item in moved:
+        old = item["value"]
+        new = old._replace(rooms=(item["room"],))
+        for half, tt, d, sis in item["runs"]:
+            for si in sis:
+                s_ = tt.slots[si]
+                tt.set(d, s_, new)
+                for fac in old.faculty:
+                    cells = faculty_tt.get(half, {}).get(fac, {}).get(d, {})
+                    if cells.get(s_) == old:
+                        cells[s_] = new
+                bit = tt.slot_bit[s_]
+                if not usage[(half, d, si, old.rooms[0])]:
+                    layers[item["layer"]].release(d, old.rooms[0], bit)
+                layers[item["layer"]].occupy(d, item["room"], bit)
+        for label in item["labels"]:
+            changed.setdefault(label, set()).add(old.code.strip().upper())
+    for label, codes in changed.items():
+        legend_room_map[label] = build_room_map_from_tt(timetable_grids[label][0])
+        if results is None:
+            continue
+        for g, half, run_label in group_runs(config):
+            legends = results.get(g["label"], {}).get("legends")
+            if run_label != label or not legends:
+                continue
+            for row in legends[half - 1][1]:
+                code = str(row[0]).strip().upper()
+                if code in codes:
+                    row[6] = ", ".join(sorted(legend_room_map[label].get(code, set())))
+    return len(moved)
 
 def course_key(c):
     return (
@@ -390,6 +456,8 @@ def full_sem_key(c, year_tag):
     )
 
 def _classify_slot_val(code, val):
+    if isinstance(val, Placement):
+        return val.typ
     v = str(val)
     code_u = code.strip().upper()
     v_u = v.strip().upper()
@@ -408,50 +476,20 @@ def build_full_sem_sync_from_tt(tt, courses, year_tag, full_sem_sync):
             continue
         fs_key = full_sem_key(c, year_tag)
         by_typ = {"L": [], "T": [], "P": []}
-        for d in days:
-            cur_slots = []
-            cur_typ = None
-            for s_ in slot_keys:
-                val = tt.at[d, s_]
-                if isinstance(val, str) and val.strip().upper().startswith(code.upper()):
-                    typ = _classify_slot_val(code, val)
-                    if cur_typ is None:
-                        cur_typ = typ
-                        cur_slots = [s_]
-                    elif typ == cur_typ:
-                        cur_slots.append(s_)
-                    else:
-                        if cur_slots:
-                            by_typ[cur_typ].append((d, cur_slots))
-                        cur_typ = typ
-                        cur_slots = [s_]
-                else:
-                    if cur_slots:
-                        by_typ[cur_typ].append((d, cur_slots))
-                        cur_slots = []
-                        cur_typ = None
-            if cur_slots:
-                by_typ[cur_typ].append((d, cur_slots))
+        # the room of each run stays booked for the second half (room layer 0)
+        held = {"L": [], "T": [], "P": []}
+        for d, slots, typ in tt.course_runs(code.upper(), by_typ=True):
+            by_typ[typ].append((d, slots))
+            v = tt.row(d, slots[:1])[0]
+            rooms = v.rooms if isinstance(v, Placement) and not v.basket else ()
+            held[typ].append(rooms[0] if len(rooms) == 1 else None)
+        by_typ["rooms"] = held
         full_sem_sync[fs_key] = by_typ
 
 def collect_code_slot_blocks(tt, code):
-    blocks = []
     if not code:
-        return blocks
-    code_u = code.strip().upper()
-    for d in days:
-        cur_slots = []
-        for s_ in slot_keys:
-            val = tt.at[d, s_]
-            if isinstance(val, str) and val.strip().upper().startswith(code_u):
-                cur_slots.append(s_)
-            else:
-                if cur_slots:
-                    blocks.append((d, cur_slots))
-                    cur_slots = []
-        if cur_slots:
-            blocks.append((d, cur_slots))
-    return blocks
+        return []
+    return [(d, slots) for d, slots, _typ in tt.course_runs(code.strip().upper())]
 
 def normalize_elective_basket(year_tag, basket_key):
     """
@@ -463,22 +501,14 @@ def normalize_elective_basket(year_tag, basket_key):
 def apply_basket_rooms_to_tt(tt, year_tag):
     if year_tag is None:
         return
-    for d in days:
-        for s_ in slot_keys:
-            val = tt.at[d, s_]
-            if not isinstance(val, str) or not val:
+    for d in tt.days:
+        for s_, val in zip(tt.slots, tt.row(d)):
+            # basket placements made before the basket had rooms
+            if not isinstance(val, Placement) or not val.basket or val.rooms or val.typ == "P":
                 continue
-            if "(" in val:
-                continue
-            code_u = val.strip().upper()
-            if not code_u.startswith("ELECTIVE"):
-                continue
-            basket_num = _basket_code_parts(val)
-            if not basket_num:
-                continue
-            rooms = get_basket_room_list(year_tag, basket_num)
+            rooms = get_basket_room_list(year_tag, val.basket)
             if rooms:
-                tt.at[d, s_] = f"{val} ({', '.join(rooms)})"
+                tt.set(d, s_, val._replace(rooms=tuple(rooms)))
 
 def collect_unscheduled(courses, placed_list, group_label, year_tag=None, elective_sync=None):
     placed_keys = set(course_key(c) for c in placed_list if isinstance(c, dict))
@@ -508,20 +538,624 @@ def collect_unscheduled(courses, placed_list, group_label, year_tag=None, electi
             })
     return uns
 
-slots_norm = [
-    {
-        "key": f"{normalize_time(s['start'])}-{normalize_time(s['end'])}",
-        "start": normalize_time(s['start']),
-        "end": normalize_time(s['end']),
-        "dur": (t2m(s["end"]) - t2m(s["start"])) / 60.0
-    }
-    for s in slots
-]
-slots_norm.sort(key=lambda x: t2m(x["start"]))
-slot_keys = [s["key"] for s in slots_norm]
-slot_dur = {s["key"]: s["dur"] for s in slots_norm}
+def normalize_slots(slots):
+    """
+    time_slots.json entries -> [{key, start, end, minutes, dur}] sorted by
+    start; minutes is the exact length the scheduler works with, dur the
+    same in hours.
+    """
+    slots_norm = [
+        {
+            "key": f"{normalize_time(s['start'])}-{normalize_time(s['end'])}",
+            "start": normalize_time(s['start']),
+            "end": normalize_time(s['end']),
+            "minutes": t2m(s["end"]) - t2m(s["start"]),
+            "dur": (t2m(s["end"]) - t2m(s["start"])) / 60.0
+        }
+        for s in slots
+    ]
+    slots_norm.sort(key=lambda x: t2m(x["start"]))
+    return slots_norm
+
 FORBIDDEN_SLOTS = set(excluded) | ABSOLUTELY_FORBIDDEN_SLOTS
 
+#############################################
+# TIMETABLE GRID
+#############################################
+
+def duration_key(hours):
+    """A duration given in hours as whole minutes, the scheduler's time unit."""
+    return int(round(float(hours) * 60))
+
+class WindowCatalog:
+    """
+    Every run of consecutive slots, grouped by its total duration.
+    windows(minutes, ex) lists (slots, mask) pairs in start-slot order; runs
+    never cross a hard-forbidden slot, and with ex=False they also avoid the
+    excluded slots. A day's free windows are those whose mask does not
+    intersect the day's occupancy. prefix[i] is the length of the first i
+    slots in minutes, so fit() finds a slice of a given length by bisection.
+    All durations are integer minutes, so every comparison is exact.
+    """
+    def __init__(self, slot_names, minutes):
+        self.slots = list(slot_names)
+        self.prefix = [0]
+        for s_ in self.slots:
+            self.prefix.append(self.prefix[-1] + minutes[s_])
+        self._by_dur = {False: {}, True: {}}
+        for ex in (False, True):
+            banned = HARD_FORBIDDEN_SLOTS if ex else (FORBIDDEN_SLOTS | HARD_FORBIDDEN_SLOTS)
+            table = self._by_dur[ex]
+            n = len(self.slots)
+            for i in range(n):
+                total = 0
+                mask = 0
+                for j in range(i, n):
+                    s_ = self.slots[j]
+                    if s_ in banned:
+                        break
+                    total += minutes[s_]
+                    mask |= 1 << j
+                    table.setdefault(total, []).append((tuple(self.slots[i:j + 1]), mask))
+
+    def windows(self, minutes, ex=False):
+        return self._by_dur[bool(ex)].get(minutes, ())
+
+    def durations(self, ex=False):
+        return sorted(self._by_dur[bool(ex)])
+
+    def fit(self, start, end, need, exact=False):
+        """
+        (i, j) of the shortest slice slots[i:j] inside [start, end) lasting
+        at least need minutes (exactly, with exact=True); the earliest start
+        wins ties. None if nothing fits.
+        """
+        p = self.prefix
+        best = None
+        for i in range(start, end):
+            target = p[i] + need
+            if target > p[end]:
+                break
+            j = bisect.bisect_left(p, target, i + 1, end + 1)
+            total = p[j] - p[i]
+            if exact:
+                if total == need:
+                    return i, j
+                continue
+            if best is None or total < best[2]:
+                best = (i, j, total)
+        return best[:2] if best else None
+
+_window_catalogs = {}
+
+def window_catalog(slot_names):
+    key = tuple(slot_names)
+    cat = _window_catalogs.get(key)
+    if cat is None:
+        cat = WindowCatalog(key, DATA.slot_minutes)
+        _window_catalogs[key] = cat
+    return cat
+
+class _GridAt:
+    """`grid.at[day, slot]` accessor kept for callers written against DataFrames."""
+    def __init__(self, grid):
+        self._grid = grid
+
+    def __getitem__(self, key):
+        d, s_ = key
+        return self._grid.get(d, s_)
+
+    def __setitem__(self, key, value):
+        d, s_ = key
+        self._grid.set(d, s_, value)
+
+class Placement(namedtuple("Placement", "code typ rooms faculty elective combined hide_room basket")):
+    """
+    What a timetable cell holds once a course is placed there: course code,
+    component ("L", "T" or "P"), room ids, faculty names and flags. Grids
+    and faculty_tt keep these records; the display text ("CS101 TUT (C3)")
+    is only produced when sheets are written, by str().
+    """
+    __slots__ = ()
+
+    def room_label(self):
+        """What the cell shows in brackets after the course ("" for nothing)."""
+        if self.combined:
+            if self.typ == "P":
+                return "Lab"
+            return "" if self.hide_room else "C004"
+        if self.rooms:
+            txt = ", ".join(self.rooms)
+            return f"Lab-{txt}" if self.typ == "P" else txt
+        return "Lab" if self.typ == "P" else ""
+
+    def __str__(self):
+        head = f"{self.code} TUT" if self.typ == "T" else self.code
+        label = self.room_label()
+        return f"{head} ({label})" if label else head
+
+def make_placement(code, typ, room, elec, basket_num, hide_c004, year_tag, fac_list):
+    """The Placement record alloc_specific()/alloc() write for one booking."""
+    if basket_num and not is_combined_course(code):
+        rooms = tuple(get_basket_room_list(year_tag, basket_num))
+    else:
+        rooms = (room,) if room else ()
+    return Placement(code, typ, rooms, tuple(fac_list), bool(elec),
+                     is_combined_course(code), bool(hide_c004), basket_num or None)
+
+class TimetableGrid:
+    """
+    Day x slot timetable used by the allocator.
+    Cells hold ids into a small table of distinct cell values, and every day
+    keeps an occupancy bitmask (bit i set => slot i is taken), so free-slot
+    checks are integer operations instead of DataFrame lookups.
+    A per-course index (code -> per-day slot masks, code -> distinct cell
+    values) is kept up to date on every write, so finding a course's slots
+    does not scan the grid.
+    Use to_frame() only when a DataFrame is needed for output.
+    """
+    def __init__(self, day_names=None, slot_names=None):
+        self.days = list(days if day_names is None else day_names)
+        self.slots = list(DATA.slot_keys if slot_names is None else slot_names)
+        self.day_idx = {d: i for i, d in enumerate(self.days)}
+        self.slot_idx = {s_: i for i, s_ in enumerate(self.slots)}
+        self.slot_bit = {s_: 1 << i for i, s_ in enumerate(self.slots)}
+        self.full_mask = (1 << len(self.slots)) - 1
+        self.hard_mask = self.mask_of(s_ for s_ in self.slots if s_ in HARD_FORBIDDEN_SLOTS)
+        self.forbidden_mask = self.hard_mask | self.mask_of(s_ for s_ in self.slots if s_ in FORBIDDEN_SLOTS)
+        self.windows = window_catalog(self.slots)
+        self.values = [""]
+        self.value_ids = {"": 0}
+        self.value_codes = [""]   # value id -> extract_course_code(value)
+        self.cells = [[0] * len(self.slots) for _ in self.days]
+        self.occ = [0] * len(self.days)
+        self.code_days = {}       # code -> [slot mask per day]
+        self.code_values = {}     # code -> {value id: number of cells}
+        self._free_runs = [None] * len(self.days)   # (occ, runs) per day
+        self.at = _GridAt(self)
+
+    @property
+    def columns(self):
+        return self.slots
+
+    def __getstate__(self):
+        # the window catalog and accessor are rebuilt, not shipped to/from workers
+        state = dict(self.__dict__)
+        del state["windows"], state["at"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.windows = window_catalog(self.slots)
+        self.at = _GridAt(self)
+
+    def _value_id(self, value):
+        vid = self.value_ids.get(value)
+        if vid is None:
+            vid = len(self.values)
+            self.values.append(value)
+            self.value_ids[value] = vid
+            self.value_codes.append(extract_course_code(value))
+        return vid
+
+    def _write(self, di, si, vid):
+        old = self.cells[di][si]
+        if old == vid:
+            return
+        bit = 1 << si
+        code = self.value_codes[old]
+        if code:
+            self.code_days[code][di] &= ~bit
+            counts = self.code_values[code]
+            counts[old] -= 1
+            if not counts[old]:
+                del counts[old]
+        self.cells[di][si] = vid
+        code = self.value_codes[vid]
+        if code:
+            self.code_days.setdefault(code, [0] * len(self.days))[di] |= bit
+            counts = self.code_values.setdefault(code, {})
+            counts[vid] = counts.get(vid, 0) + 1
+
+    def mask_of(self, slots):
+        """Bitmask for slots; None if any slot is not part of this grid."""
+        m = 0
+        bits = self.slot_bit
+        for s_ in slots:
+            b = bits.get(s_)
+            if b is None:
+                return None
+            m |= b
+        return m
+
+    def get(self, d, s_):
+        return self.values[self.cells[self.day_idx[d]][self.slot_idx[s_]]]
+
+    def set(self, d, s_, value):
+        di = self.day_idx[d]
+        si = self.slot_idx[s_]
+        if value is None:
+            value = ""
+        self._write(di, si, self._value_id(value))
+        if value == "":
+            self.occ[di] &= ~(1 << si)
+        else:
+            self.occ[di] |= 1 << si
+
+    def place(self, d, slots, value):
+        """Write the same value into several slots of one day."""
+        di = self.day_idx[d]
+        vid = self._value_id(value)
+        for s_ in slots:
+            si = self.slot_idx[s_]
+            self._write(di, si, vid)
+            self.occ[di] |= 1 << si
+
+    def is_free(self, d, s_):
+        return not (self.occ[self.day_idx[d]] & self.slot_bit[s_])
+
+    def all_free(self, d, slots):
+        m = self.mask_of(slots)
+        return m is not None and not (self.occ[self.day_idx[d]] & m)
+
+    def row(self, d, slots=None):
+        vals = self.values
+        cells = self.cells[self.day_idx[d]]
+        if slots is None:
+            return [vals[v] for v in cells]
+        return [vals[cells[self.slot_idx[s_]]] for s_ in slots]
+
+    def free_runs(self, d):
+        """
+        Maximal runs (start, end) of free, non-forbidden slot indexes on day d.
+        Kept per day and rebuilt only after the day's occupancy changed.
+        """
+        di = self.day_idx[d]
+        occ = self.occ[di]
+        cached = self._free_runs[di]
+        if cached is not None and cached[0] == occ:
+            return cached[1]
+        # 🚫 Hard-forbid excluded slots
+        blocked = occ | self.forbidden_mask
+        runs = []
+        start = None
+        for i in range(len(self.slots)):
+            if blocked >> i & 1:
+                if start is not None:
+                    runs.append((start, i))
+                    start = None
+            elif start is None:
+                start = i
+        if start is not None:
+            runs.append((start, len(self.slots)))
+        self._free_runs[di] = (occ, runs)
+        return runs
+
+    def course_slots(self, code, d):
+        """Slots of day d holding code (as extract_course_code() gives it)."""
+        mask = self.code_days.get(code, ())
+        m = mask[self.day_idx[d]] if mask else 0
+        return [s_ for i, s_ in enumerate(self.slots) if m >> i & 1]
+
+    def course_runs(self, code, by_typ=False):
+        """
+        [(day, slots, typ)] for every contiguous run of code's cells, from
+        the index. With by_typ a run also ends where the component changes;
+        otherwise typ is None.
+        """
+        runs = []
+        masks = self.code_days.get(code)
+        if not masks:
+            return runs
+        for di, d in enumerate(self.days):
+            m = masks[di]
+            cur, cur_typ = [], None
+            for i, s_ in enumerate(self.slots):
+                if not m >> i & 1:
+                    if cur:
+                        runs.append((d, cur, cur_typ))
+                        cur, cur_typ = [], None
+                    continue
+                typ = _classify_slot_val(code, self.values[self.cells[di][i]]) if by_typ else None
+                if cur and typ != cur_typ:
+                    runs.append((d, cur, cur_typ))
+                    cur = []
+                cur.append(s_)
+                cur_typ = typ
+            if cur:
+                runs.append((d, cur, cur_typ))
+        return runs
+
+    def to_frame(self, slots=None):
+        import pandas as pd
+        cols = self.slots if slots is None else list(slots)
+        return pd.DataFrame([self.row(d, cols) for d in self.days], index=self.days, columns=cols)
+
+def slots_mask(slots):
+    bits = DATA.slot_bit
+    m = 0
+    for s_ in slots:
+        m |= bits[s_]
+    return m
+
+class OccupancyIndex:
+    """
+    Busy slots of named resources (rooms, faculty, (basket, year) keys) as one
+    slot bitmask per (day, resource); bit i is slot_keys[i].
+    Conflict checks are a single AND against a mask from slots_mask().
+    An attached OccupancyTensor (tensor_feed) sees every occupy/release.
+    """
+    def __init__(self):
+        self._by_day = {d: {} for d in days}
+        self.tensor_feed = None
+
+    def mask(self, day, key):
+        return self._by_day.get(day, {}).get(key, 0)
+
+    def is_free(self, day, key, mask):
+        return not (self._by_day.get(day, {}).get(key, 0) & mask)
+
+    def occupy(self, day, key, mask):
+        row = self._by_day.setdefault(day, {})
+        row[key] = row.get(key, 0) | mask
+        if self.tensor_feed is not None:
+            self.tensor_feed(day, key, mask, True)
+
+    def release(self, day, key, mask):
+        row = self._by_day.get(day, {})
+        left = row.get(key, 0) & ~mask
+        if left:
+            row[key] = left
+        else:
+            row.pop(key, None)
+        if self.tensor_feed is not None:
+            self.tensor_feed(day, key, mask, False)
+
+    def claim(self, day, key, mask):
+        """occupy() and return the bits of mask that were not booked before."""
+        new = mask & ~self._by_day.get(day, {}).get(key, 0)
+        if new:
+            self.occupy(day, key, new)
+        return new
+
+    def free_keys(self, day, keys, mask):
+        """Subset of keys (order kept) with nothing booked in mask on day."""
+        row = self._by_day.get(day, {})
+        return [k for k in keys if not (row.get(k, 0) & mask)]
+
+    def first_free(self, day, keys, mask):
+        row = self._by_day.get(day, {})
+        for k in keys:
+            if not (row.get(k, 0) & mask):
+                return k
+        return None
+
+    def keys_on(self, day):
+        return list(self._by_day.get(day, {}))
+
+    def slots_of(self, day, key):
+        m = self.mask(day, key)
+        return [s_ for i, s_ in enumerate(DATA.slot_keys) if m >> i & 1]
+
+    def copy(self):
+        other = OccupancyIndex()
+        other._by_day = {d: dict(row) for d, row in self._by_day.items()}
+        return other
+
+    def added_since(self, before):
+        """(day, key, mask) for every bit set here but not in before, an earlier copy."""
+        out = []
+        for d, row in self._by_day.items():
+            old = before._by_day.get(d, {})
+            for key, m in row.items():
+                new = m & ~old.get(key, 0)
+                if new:
+                    out.append((d, key, new))
+        return out
+
+# state["room_busy"] layers: 0 holds full-semester bookings (both halves),
+# 1 and 2 the bookings of courses taught in that half only
+ROOM_LAYERS = (0, 1, 2)
+
+def new_room_layers():
+    return {layer: OccupancyIndex() for layer in ROOM_LAYERS}
+
+class RoomLayerView:
+    """
+    The room bookings a placement in one semester half has to respect, over
+    room layers from new_room_layers(). The half-h view (1 or 2) sees layers
+    0 and h and books into h; the half-0 view, for full-semester courses,
+    sees every layer and books into 0. It answers the OccupancyIndex calls
+    the allocators make; copy() merges the layers it sees.
+    """
+    def __init__(self, layers, half):
+        self.half = half
+        self.own = layers[half]
+        self.seen = [layers[layer] for layer in (ROOM_LAYERS if half == 0 else (0, half))]
+        feed = self.own.tensor_feed
+        self.tensor_feed = None if feed is None else _TensorFeed(
+            feed.tensor, "room", (1, 2) if half == 0 else (half,))
+
+    def mask(self, day, key):
+        m = 0
+        for layer in self.seen:
+            m |= layer.mask(day, key)
+        return m
+
+    def is_free(self, day, key, mask):
+        return not (self.mask(day, key) & mask)
+
+    def first_free(self, day, keys, mask):
+        rows = [layer._by_day.get(day, {}) for layer in self.seen]
+        for k in keys:
+            if not any(row.get(k, 0) & mask for row in rows):
+                return k
+        return None
+
+    def occupy(self, day, key, mask):
+        self.own.occupy(day, key, mask)
+
+    def release(self, day, key, mask):
+        self.own.release(day, key, mask)
+
+    def claim(self, day, key, mask):
+        return self.own.claim(day, key, mask)
+
+    def copy(self):
+        merged = OccupancyIndex()
+        for layer in self.seen:
+            for d, row in layer._by_day.items():
+                for key, m in row.items():
+                    merged.occupy(d, key, m)
+        return merged
+
+class _TensorFeed:
+    """
+    Listener mirroring one OccupancyIndex into its own plane of an
+    OccupancyTensor; the plane counts in the given halves. A feed without
+    a plane only answers queries.
+    """
+    def __init__(self, tensor, kind, halves, plane=None):
+        self.tensor = tensor
+        self.kind = kind
+        self.halves = halves
+        self.plane = plane
+
+    def __call__(self, day, key, mask, busy):
+        self.tensor.mark(self.plane, day, (self.kind, key), mask, busy)
+
+    def first_free(self, day, keys, slots):
+        half = self.halves[0] if len(self.halves) == 1 else 0
+        return self.tensor.first_free(half, day, keys, slots, kind=self.kind)
+
+class OccupancyTensor:
+    """
+    Room and faculty bookings of one run as a NumPy boolean array
+    busy[plane, day, slot, resource], kept in sync by listeners on the run's
+    OccupancyIndexes (attach()). Every index has its own plane, which counts
+    in the halves it was attached with, so a release only clears the bits
+    of the index that held them. Resource columns are ("room", id) and
+    ("faculty", name) keys, added as they are first booked. Full-semester
+    room bookings (room layer 0) show in both halves. Queries take half 1
+    or 2, or 0 for "busy in either half", and are vectorized over resources.
+    """
+    def __init__(self, slot_names=None, rooms=()):
+        import numpy as np
+        self.slots = list(DATA.slot_keys if slot_names is None else slot_names)
+        self.slot_idx = {s_: i for i, s_ in enumerate(self.slots)}
+        self.day_idx = {d: i for i, d in enumerate(days)}
+        self.keys = []
+        self.col = {}
+        self._bits = {}
+        self.planes = []    # plane -> halves it counts in
+        self.busy = np.zeros((0, len(days), len(self.slots), max(len(rooms), 16)), dtype=bool)
+        for r in rooms:
+            self.column(("room", r))
+
+    def attach(self, index, kind, halves):
+        """Mirror index, an OccupancyIndex of rooms or faculty, into a new plane counting in halves (1, 2)."""
+        import numpy as np
+        plane = len(self.planes)
+        self.planes.append(tuple(halves))
+        self.busy = np.concatenate([self.busy, np.zeros((1,) + self.busy.shape[1:], dtype=bool)])
+        index.tensor_feed = _TensorFeed(self, kind, tuple(halves), plane)
+
+    def column(self, key):
+        import numpy as np
+        c = self.col.get(key)
+        if c is None:
+            c = len(self.keys)
+            if c == self.busy.shape[3]:
+                self.busy = np.concatenate([self.busy, np.zeros_like(self.busy)], axis=3)
+            self.keys.append(key)
+            self.col[key] = c
+        return c
+
+    def slot_list(self, mask):
+        bits = self._bits.get(mask)
+        if bits is None:
+            bits = self._bits[mask] = [i for i in range(len(self.slots)) if mask >> i & 1]
+        return bits
+
+    def mark(self, plane, day, key, mask, value):
+        c = self.column(key)
+        self.busy[plane, self.day_idx[day], self.slot_list(mask), c] = value
+
+    def names(self, kind):
+        return [name for k, name in self.keys if k == kind]
+
+    def _layers(self, half):
+        if half == 0:
+            return self.busy
+        return self.busy[[p for p, halves in enumerate(self.planes) if half in halves]]
+
+    def _taken(self, half, day, slots):
+        """Per column: booked in any of slots on day."""
+        sl = [self.slot_idx[s_] for s_ in slots]
+        return self._layers(half)[:, self.day_idx[day], sl].any(axis=(0, 1))
+
+    def _free_of(self, taken, kind, names):
+        import numpy as np
+        cols = np.fromiter((self.col.get((kind, n), -1) for n in names), dtype=np.intp, count=len(names))
+        # columns never booked (-1) are free
+        return ~np.append(taken, False)[cols]
+
+    def free_resources(self, half, day, slots, kind="room", names=None):
+        """names (default: every known resource of kind) free in all of slots on day, order kept."""
+        if names is None:
+            names = self.names(kind)
+        names = list(names)
+        if not names:
+            return []
+        free = self._free_of(self._taken(half, day, slots), kind, names)
+        return [n for n, ok in zip(names, free) if ok]
+
+    def first_free(self, half, day, names, slots, kind="room"):
+        """First of names free in all of slots on day, or None."""
+        names = list(names)
+        if not names:
+            return None
+        free = self._free_of(self._taken(half, day, slots), kind, names)
+        i = int(free.argmax())
+        return names[i] if free[i] else None
+
+    def idle(self, half, day, kind="faculty"):
+        """Known resources of kind with nothing booked on day."""
+        load = self._layers(half)[:, self.day_idx[day]].any(axis=(0, 1))
+        return [name for (k, name), c in self.col.items() if k == kind and not load[c]]
+
+    def utilization(self, half, kind="room", slots=None):
+        """{name: share of the week's (day, slot) cells booked}, over slots (default: all)."""
+        sl = [self.slot_idx[s_] for s_ in (self.slots if slots is None else slots)]
+        share = self._layers(half).any(axis=0)[:, sl].mean(axis=(0, 1))
+        return {name: float(share[c]) for (k, name), c in self.col.items() if k == kind}
+
+    def first_fit(self, half, name, minutes, kind="room", ex=False):
+        """First (day, slots) window lasting minutes in which name is free, or None."""
+        import numpy as np
+        windows = window_catalog(self.slots).windows(minutes, ex)
+        if not windows:
+            return None
+        member = np.zeros((len(windows), len(self.slots)), dtype=bool)
+        for w, (_slots, mask) in enumerate(windows):
+            member[w, self.slot_list(mask)] = True
+        c = self.col.get((kind, name))
+        if c is None:
+            return days[0], list(windows[0][0])
+        clash = self._layers(half)[:, :, :, c].any(axis=0).astype(np.int32) @ member.T.astype(np.int32)
+        free = np.argwhere(clash == 0)   # rows in (day, window) order
+        if not len(free):
+            return None
+        di, w = free[0]
+        return days[di], list(windows[w][0])
+
+def basket_clash(basket_used, basket_key, year_tag, day, mask):
+    """True if another year already uses basket_key in any of the masked slots."""
+    for key in basket_used.keys_on(day):
+        if key[0] == basket_key and key[1] != year_tag and not basket_used.is_free(day, key, mask):
+            return True
+    return False
+
 #############################################
 # NEW EXCEL INPUT LOADER (YOUR FORMAT)
 #############################################
@@ -534,6 +1168,7 @@ REQUIRED_COLUMNS = [
 ]
 
 def load_and_validate(file):
+    import pandas as pd
     df = pd.read_csv(file)
     # check columns
     # if Section column missing -> auto create
@@ -601,6 +1236,7 @@ def load_and_validate(file):
     return df.to_dict(orient="records")
 
 def load_and_validate_sem7(file):
+    import pandas as pd
     df = pd.read_csv(file)
 
     # Normalize column names from Course7.xlsx/CSV format
@@ -669,12 +1305,6 @@ def load_and_validate_sem7(file):
     return df.to_dict(orient="records")
 
 
-# LOAD COURSE DETAILS
-coursesCSE  = load_and_validate("data/CSE_courses.csv")
-coursesECE  = load_and_validate("data/ECE_courses.csv")
-coursesDSAI = load_and_validate("data/DSAI_courses.csv")
-
-
 ##########################################
 #              SPLITING DATA             #
 ##########################################
@@ -704,52 +1334,310 @@ def filter_courses(data, dept, sem, section=None):
 
     return res
 
-# CSE
-coursesCSEA_I = filter_courses(coursesCSE,"CSE",1,"A")
-coursesCSEB_I = filter_courses(coursesCSE,"CSE",1,"B")
-
-# sem3
-coursesCSEA_III = filter_courses(coursesCSE,"CSE",3,"A")
-coursesCSEB_III = filter_courses(coursesCSE,"CSE",3,"B")
-
-# sem5
-coursesCSEA_V = filter_courses(coursesCSE,"CSE",5,"A")
-# CSEB sem5
-coursesCSEB_V = filter_courses(coursesCSE,"CSE",5,"B")
-# sem7 (if exists in CSE)
-coursesCSEA_VII = filter_courses(coursesCSE,"CSE",7,"A")
-# DSAI
-coursesDSAI_I = filter_courses(coursesDSAI,"DSAI",1)
-coursesDSAI_III = filter_courses(coursesDSAI,"DSAI",3)
-coursesDSAI_V   = filter_courses(coursesDSAI,"DSAI",5)
-
-# ECE
-coursesECE_I = filter_courses(coursesECE,"ECE",1)
-coursesECE_III = filter_courses(coursesECE,"ECE",3)
-coursesECE_V   = filter_courses(coursesECE,"ECE",5)
-
-# dummy for engine
-coursesAI = coursesCSEA_I
-coursesBI = coursesCSEB_I
-
-coursesA  = coursesCSEA_III
-coursesB  = coursesCSEB_III
-
-coursesV  = coursesCSEA_V
-coursesVII = []
-if os.path.exists("data/Course7.csv"):
-    coursesVII = load_and_validate_sem7("data/Course7.csv")
-elif 'coursesCSEA_VII' in globals():
-    coursesVII = coursesCSEA_VII
-
-rooms = pd.read_csv("data/rooms.csv")
-rooms["Room_ID"] = rooms["Room_ID"].astype(str).str.strip()
-cls = rooms[rooms["Room_ID"].str.startswith('C')].copy()
-labs = rooms[rooms["Room_ID"].str.startswith('L')].copy()
+class RoomCatalog:
+    """
+    Rooms from rooms.csv indexed once for the allocator.
+    Classrooms (C...) and labs (L...) are kept sorted by capacity and indexed
+    by Room_ID prefix (C1..C4, L1..L4, ...) and by Type, so candidate queries
+    are a bisect plus a memoized tuple and capacity lookups are dict hits.
+    Candidate tuples keep rooms.csv order, which is the order rooms are tried in.
+    """
+    def __init__(self, records):
+        self.order = []
+        self.capacity = {}
+        self.room_type = {}
+        self._pos = {}
+        self._by_prefix = {}
+        self._by_type = {}
+        self._memo = {}
+        for rec in records:
+            rid = str(rec.get("Room_ID", "")).strip()
+            if not rid:
+                continue
+            try:
+                cap = float(rec.get("Capacity"))
+                if cap != cap:
+                    cap = None
+            except (TypeError, ValueError):
+                cap = None
+            self._pos[rid] = len(self.order)
+            self.order.append(rid)
+            self.capacity[rid.upper()] = cap
+            rtype = s(rec.get("Type", ""))
+            self.room_type[rid] = rtype
+            self._by_type.setdefault(rtype.upper(), []).append(rid)
+
+    @classmethod
+    def from_csv(cls, path):
+        import pandas as pd
+        return cls(pd.read_csv(path).to_dict(orient="records"))
+
+    def capacity_of(self, room_id):
+        return self.capacity.get(str(room_id).strip().upper())
+
+    def meets_capacity(self, room_id, min_capacity):
+        if min_capacity is None or room_id is None:
+            return True
+        try:
+            min_capacity = float(min_capacity)
+        except (TypeError, ValueError):
+            return True
+        rid = str(room_id).strip().upper()
+        if not rid:
+            return True
+        cap = self.capacity.get(rid)
+        if cap is None:
+            return True
+        return cap >= min_capacity
+
+    def rooms_of_type(self, room_type):
+        return tuple(self._by_type.get(str(room_type).strip().upper(), ()))
+
+    def _prefix_index(self, kind, prefix):
+        """Rooms of one kind ('C' or 'L') whose id starts with prefix, as parallel capacity/id lists sorted by capacity."""
+        key = (kind, prefix)
+        idx = self._by_prefix.get(key)
+        if idx is None:
+            rows = sorted(
+                ((self.capacity[rid.upper()] or 0.0), self._pos[rid], rid)
+                for rid in self.order
+                if rid.startswith(kind) and rid.upper().startswith(prefix)
+            )
+            idx = ([r[0] for r in rows], [r[2] for r in rows])
+            self._by_prefix[key] = idx
+        return idx
+
+    def _at_least(self, kind, prefix, min_capacity):
+        caps, ids = self._prefix_index(kind, prefix)
+        lo = 0 if min_capacity is None else bisect.bisect_left(caps, min_capacity)
+        return sorted(ids[lo:], key=self._pos.__getitem__)
+
+    def candidates(self, lab=False, prefix=None, lab_prefix=None, min_capacity=None):
+        if min_capacity is not None:
+            try:
+                min_capacity = float(min_capacity)
+            except (TypeError, ValueError):
+                min_capacity = None
+        key = (bool(lab), (prefix or "").upper(), (lab_prefix or "").upper(), min_capacity)
+        hit = self._memo.get(key)
+        if hit is not None:
+            return hit
+        kind = "L" if lab else "C"
+        cand = self._at_least(kind, "", min_capacity)
+        if prefix:
+            c = self._at_least(kind, prefix.upper(), min_capacity)
+            if c:
+                cand = c
+        if lab and lab_prefix:
+            c = [rid for rid in cand if rid.upper().startswith(lab_prefix.upper())]
+            if c:
+                cand = c
+        hit = tuple(cand)
+        self._memo[key] = hit
+        return hit
+
+
+#############################################
+# INPUT DATA
+#############################################
+
+# older module-level names for some of the course lists of data/groups.json
+COURSE_GROUP_ALIASES = {
+    "AI": "CSEA_I", "BI": "CSEB_I",
+    "A": "CSEA_III", "B": "CSEB_III",
+    "V": "CSEA_V",
+}
+
+def load_group_config(path):
+    """
+    Read the group config (see data/groups.json): the departments whose
+    <DEPT>_courses.csv files are loaded, and the output sheets, each listing
+    the groups (department/semester/section) scheduled onto it.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    labels = set()
+    for g in iter_groups(config):
+        missing = [k for k in ("key", "department", "semester", "label", "seeds", "elective_sync") if k not in g]
+        if missing:
+            raise Exception(f"{path}: group {g.get('key', g.get('label', '?'))} missing {missing}")
+        if g["label"] in labels:
+            raise Exception(f"{path}: duplicate group label {g['label']}")
+        labels.add(g["label"])
+    return config
+
+def iter_groups(config):
+    for sheet in config["sheets"]:
+        yield from sheet["groups"]
+
+HALF_NAMES = {1: "First Half", 2: "Second Half"}
+
+# Per-run dictionaries that groups naming the same domain share: electives
+# and combined courses are synced to the slots the first group picked, and
+# full-semester courses placed in the first half are replayed in the second.
+SYNC_KINDS = ("elective_sync", "combined_sync", "full_sem_sync")
+
+def group_runs(config):
+    """
+    One entry per generate() call, in config order: (group, half, label).
+    """
+    return [
+        (g, half, f"{g['label']} {HALF_NAMES[half]}")
+        for g in iter_groups(config)
+        for half in (1, 2)
+    ]
+
+def group_dependencies(config):
+    """
+    Run label -> labels of earlier runs it must follow because they share a
+    sync domain. Runs with no path between them read and write disjoint sync
+    state and may be scheduled concurrently; rooms and faculty are shared by
+    every run and are not edges here.
+    """
+    deps = {}
+    writers = {}
+    for g, _half, label in group_runs(config):
+        deps[label] = set()
+        for kind in SYNC_KINDS:
+            name = g.get(kind)
+            if name is None:
+                continue
+            domain = (kind, name)
+            deps[label] |= writers.get(domain, set())
+            writers.setdefault(domain, set()).add(label)
+    return deps
+
+def dependency_waves(deps):
+    """Split runs into waves that only depend on earlier waves, keeping config order inside a wave."""
+    level = {}
+    for label in deps:
+        level[label] = 1 + max((level[d] for d in deps[label]), default=-1)
+    waves = []
+    for label, lv in level.items():
+        while len(waves) <= lv:
+            waves.append([])
+        waves[lv].append(label)
+    return waves
+
+class Dataset:
+    """
+    Input files under data_dir (time slots, group config, department courses,
+    rooms), each read and parsed on first use and then kept.
+    """
+    def __init__(self, data_dir="data"):
+        self.data_dir = data_dir
+
+    def path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    @functools.cached_property
+    def slots_norm(self):
+        with open(self.path("time_slots.json")) as f:
+            return normalize_slots(json.load(f)["time_slots"])
+
+    @functools.cached_property
+    def slot_keys(self):
+        return [x["key"] for x in self.slots_norm]
+
+    @functools.cached_property
+    def slot_dur(self):
+        return {x["key"]: x["dur"] for x in self.slots_norm}
+
+    @functools.cached_property
+    def slot_minutes(self):
+        return {x["key"]: x["minutes"] for x in self.slots_norm}
+
+    @functools.cached_property
+    def slot_bit(self):
+        return {s_: 1 << i for i, s_ in enumerate(self.slot_keys)}
+
+    @functools.cached_property
+    def rooms(self):
+        return RoomCatalog.from_csv(self.path("rooms.csv"))
+
+    @functools.cached_property
+    def group_config(self):
+        return load_group_config(self.path("groups.json"))
+
+    @functools.cached_property
+    def courses(self):
+        """Department -> course records."""
+        return {
+            dept: load_and_validate(self.path(f"{dept}_courses.csv"))
+            for dept in self.group_config["departments"]
+        }
+
+    def _own_file(self, group):
+        """Path of the group's own course file, if it names one that exists."""
+        name = group.get("courses_file")
+        if name and os.path.exists(self.path(name)):
+            return self.path(name)
+        return None
+
+    @functools.cached_property
+    def course_groups(self):
+        """Group key -> course records (its own file, else filtered from its department)."""
+        groups = {}
+        for g in iter_groups(self.group_config):
+            own = self._own_file(g)
+            if own:
+                groups[g["key"]] = load_and_validate_sem7(own)
+            else:
+                groups[g["key"]] = filter_courses(self.courses[g["department"]], g["department"],
+                                                  g["semester"], g.get("section"))
+        for alias, name in COURSE_GROUP_ALIASES.items():
+            if name in groups:
+                groups[alias] = groups[name]
+        return groups
+
+    @functools.cached_property
+    def all_courses(self):
+        res = []
+        for dept in self.group_config["departments"]:
+            res += self.courses[dept]
+        for g in iter_groups(self.group_config):
+            if g.get("courses_file"):
+                res += self.course_groups[g["key"]]
+        return res
+
+    @functools.cached_property
+    def combined_course_codes(self):
+        return {
+            s(x.get("Course_Code","")).strip().upper()
+            for dept in self.group_config["departments"]
+            for x in self.courses[dept]
+            if is_combined_flag(x)
+        }
+
+DATA = Dataset()
+
+# Module attributes that used to be loaded at import time, now served from DATA.
+_DATA_ATTRS = {
+    "slots_norm": "slots_norm",
+    "slot_keys": "slot_keys",
+    "slot_dur": "slot_dur",
+    "slot_minutes": "slot_minutes",
+    "SLOT_BIT": "slot_bit",
+    "ROOMS": "rooms",
+    "COMBINED_COURSE_CODES": "combined_course_codes",
+}
+
+def __getattr__(name):
+    if name in _DATA_ATTRS:
+        return getattr(DATA, _DATA_ATTRS[name])
+    if name == "thin":
+        return thin_border()
+    if name.startswith("courses"):
+        key = name[len("courses"):]
+        if key in DATA.courses:
+            return DATA.courses[key]
+        if key in DATA.course_groups:
+            return DATA.course_groups[key]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def s(v):
     if v is None: return ""
-    if isinstance(v, float) and pd.isna(v): return ""
+    if isinstance(v, float) and v != v: return ""
     return str(v).strip()
 
 def is_combined_flag(c):
@@ -758,17 +1646,11 @@ def is_combined_flag(c):
     except Exception:
         return False
 
-COMBINED_COURSE_CODES = {
-    s(c.get("Course_Code","")).strip().upper()
-    for c in (coursesCSE + coursesECE + coursesDSAI)
-    if is_combined_flag(c)
-}
-
 def to_int_or_none(v):
     try:
         if v is None:
             return None
-        if isinstance(v, float) and pd.isna(v):
+        if isinstance(v, float) and v != v:
             return None
         iv = int(float(str(v).strip()))
         if iv <= 0:
@@ -802,7 +1684,7 @@ def valid(c):
     return err
 def is_combined_course(code):
     try:
-        return str(code).strip().upper() in COMBINED_COURSE_CODES
+        return str(code).strip().upper() in DATA.combined_course_codes
     except Exception:
         return False
 lab_prefix_for_class_prefix = {
@@ -813,54 +1695,10 @@ lab_prefix_for_class_prefix = {
 }
 
 def room_meets_capacity(room_id, min_capacity):
-    if min_capacity is None:
-        return True
-    try:
-        min_capacity = float(min_capacity)
-    except Exception:
-        return True
-    if room_id is None:
-        return True
-    rid = str(room_id).strip()
-    if not rid:
-        return True
-    try:
-        row = rooms[rooms["Room_ID"].astype(str).str.strip().str.upper() == rid.upper()]
-        if row.empty:
-            return True
-        cap = pd.to_numeric(row.iloc[0].get("Capacity"), errors="coerce")
-        if pd.isna(cap):
-            return True
-        return float(cap) >= min_capacity
-    except Exception:
-        return True
+    return DATA.rooms.meets_capacity(room_id, min_capacity)
 
 def room_candidates(lab=False, prefix=None, lab_prefix=None, min_capacity=None):
-    df = labs if lab else cls
-    if df.empty:
-        return []
-    cand = df.copy()
-    if min_capacity is not None:
-        try:
-            cand = cand[pd.to_numeric(cand["Capacity"], errors="coerce").fillna(0) >= float(min_capacity)]
-        except Exception:
-            pass
-    if prefix:
-        c = cand[cand['Room_ID'].str.upper().str.startswith(prefix.upper())]
-        if not c.empty:
-            cand = c
-        else:
-            cand = df.copy()
-            if min_capacity is not None:
-                try:
-                    cand = cand[pd.to_numeric(cand["Capacity"], errors="coerce").fillna(0) >= float(min_capacity)]
-                except Exception:
-                    pass
-    if lab and lab_prefix:
-        c = cand[cand['Room_ID'].str.upper().str.startswith(lab_prefix.upper())]
-        if not c.empty:
-            cand = c
-    return cand["Room_ID"].tolist()
+    return DATA.rooms.candidates(lab=lab, prefix=prefix, lab_prefix=lab_prefix, min_capacity=min_capacity)
 
 def pick_room_with_capacity_fallback(lab, day, slots_to_use, room_busy, class_prefix=None, lab_prefix=None, min_capacity=None, rr_state_key=None, rr_state=None):
     candidates = room_candidates(lab=lab, prefix=class_prefix, lab_prefix=lab_prefix, min_capacity=min_capacity)
@@ -877,72 +1715,147 @@ def pick_room_for_slots(candidates, day, slots_to_use, room_busy, rr_state_key=N
     if rr_state is not None and rr_state_key is not None and len(candidates) > 0:
         idx = rr_state.get(rr_state_key, 0) % len(candidates)
         ordered = candidates[idx:] + candidates[:idx]
-    for cand in ordered:
-        used = room_busy.get(day, {}).get(cand, set())
-        if not (set(slots_to_use) & used):
-            if rr_state is not None and rr_state_key is not None and len(candidates) > 0:
-                rr_state[rr_state_key] = (rr_state.get(rr_state_key, 0) + 1) % len(candidates)
-            return cand
-    return None
+    feed = getattr(room_busy, "tensor_feed", None)
+    if feed is not None:
+        cand = feed.first_free(day, ordered, slots_to_use)
+    else:
+        cand = room_busy.first_free(day, ordered, slots_mask(slots_to_use))
+    if cand is not None and rr_state is not None and rr_state_key is not None:
+        rr_state[rr_state_key] = (rr_state.get(rr_state_key, 0) + 1) % len(candidates)
+    return cand
 
 def free(tt, d, ex=False):
     fb, b = [], []
-    for s_ in slot_keys:
-        if s_ in HARD_FORBIDDEN_SLOTS:
+    blocked = tt.occ[tt.day_idx[d]] | (tt.hard_mask if ex else tt.forbidden_mask)
+    for i, s_ in enumerate(tt.slots):
+        if blocked >> i & 1:
             if b:
                 fb.append(b); b = []
             continue
-        if not ex and s_ in FORBIDDEN_SLOTS:
-            if b:
-                fb.append(b); b = []
-            continue
-        if tt.at[d, s_] == "":
-            b.append(s_)
-        else:
-            if b:
-                fb.append(b); b = []
+        b.append(s_)
     if b: fb.append(b)
     return fb
 
 def exact_free_blocks(tt, d, duration, ex=False):
     """
-    Return contiguous blocks of free slots on day d whose total duration == duration.
+    Return contiguous blocks of free slots on day d whose total duration
+    (in hours) == duration.
     """
-    blocks = []
-    n = len(slot_keys)
-    for i in range(n):
-        total = 0.0
-        cur = []
-        for j in range(i, n):
-            s_ = slot_keys[j]
-            if s_ in HARD_FORBIDDEN_SLOTS:
-                break
-            if not ex and s_ in FORBIDDEN_SLOTS:
-                break
-            if tt.at[d, s_] != "":
-                break
-            cur.append(s_)
-            total += slot_dur[s_]
-            if abs(total - duration) < 1e-9:
-                blocks.append(cur.copy())
-                break
-            if total > duration + 1e-9:
-                break
-    return blocks
+    return [list(w) for w, _m in free_windows(tt, d, duration_key(duration), ex)]
+
+def free_windows(tt, d, minutes, ex=False):
+    """(slots, mask) for every free window on day d lasting exactly minutes."""
+    occ = tt.occ[tt.day_idx[d]]
+    return [(w, m) for w, m in tt.windows.windows(minutes, ex) if not m & occ]
+
+_ABSENT = object()
+
+class UndoLog:
+    """
+    Journal of the writes alloc_specific() and alloc() make (grid cells,
+    occupancy bits, rm, labsd, course_usage, faculty_tt), of sync entries
+    and of the releases that unplace a course, so a run of them can be
+    taken back:
+
+        mark = log.checkpoint()
+        ...                       # alloc(..., undo=log)
+        log.rollback(mark)        # or log.commit(mark) to keep them
+
+    Each entry stores what its write replaced, so rolling back costs
+    O(writes since mark). Writes go through the log methods below.
+    """
+    def __init__(self):
+        self.entries = []
+
+    def _note(self, *entry):
+        self.entries.append(entry)
+
+    def checkpoint(self):
+        return len(self.entries)
+
+    def commit(self, mark):
+        """Keep the writes since mark; they can no longer be rolled back."""
+        del self.entries[mark:]
+
+    def rollback(self, mark):
+        entries = self.entries
+        while len(entries) > mark:
+            kind, target, *args = entries.pop()
+            if kind == "cell":
+                target.set(*args)
+            elif kind == "occ":
+                target.release(*args)
+            elif kind == "free":
+                target.occupy(*args)
+            elif kind == "item":
+                key, old = args
+                if old is _ABSENT:
+                    del target[key]
+                else:
+                    target[key] = old
+            else:
+                target.discard(args[0])
+
+    def set_cell(self, tt, day, slot, value):
+        self._note("cell", tt, day, slot, tt.get(day, slot))
+        tt.set(day, slot, value)
+
+    def occupy(self, index, day, key, mask):
+        new = index.claim(day, key, mask)
+        if new:
+            self._note("occ", index, day, key, new)
+
+    def release(self, index, day, key, mask):
+        held = index.mask(day, key) & mask
+        if held:
+            index.release(day, key, held)
+            self._note("free", index, day, key, held)
+
+    def setitem(self, mapping, key, value):
+        self._note("item", mapping, key, mapping.get(key, _ABSENT))
+        mapping[key] = value
+
+    def delitem(self, mapping, key):
+        if key in mapping:
+            self._note("item", mapping, key, mapping.pop(key))
+
+    def child(self, mapping, key):
+        """mapping[key], created as an empty dict if missing."""
+        if key not in mapping:
+            self.setitem(mapping, key, {})
+        return mapping[key]
+
+    def add(self, items, item):
+        if item not in items:
+            self._note("add", items, item)
+            items.add(item)
+
+class _Unlogged(UndoLog):
+    """The same writes without a journal, for callers that pass no undo log."""
+    def _note(self, *entry):
+        pass
+
+_UNLOGGED = _Unlogged()
+
+def record_faculty_slot(log, faculty_tt, half, fac, day, slot, value):
+    log.setitem(log.child(log.child(log.child(faculty_tt, half), fac), day), slot, value)
 
 def alloc_specific(tt, busy, rm, room_busy, day, slots_to_use, f, code, typ, elec, labsd, course_usage,
                    class_prefix=None, rr_state=None, hide_c004=False, skip_usage_check=False, ex=False, year_tag=None,
                    basket_used=None, basket_key=None, faculty_tt=None, semester_half=None,
-                   faculty_busy_global=None, student_count=None, allow_extra_same_day=False):
+                   faculty_busy_global=None, student_count=None, allow_extra_same_day=False,
+                   held_room=None, undo=None):
+    # held_room: a room already booked for these slots (the first-half run of
+    # a full-semester course); it is used as is and not booked again.
+    # undo: an UndoLog that records every write, for rolling them back.
+    log = _UNLOGGED if undo is None else undo
     basket_num = _basket_code_parts(code) if elec else None
-    for s_ in slots_to_use:
-        if s_ in HARD_FORBIDDEN_SLOTS:
-            return False
-        if s_ not in slot_keys or tt.at[day, s_] != "":
-            return False
+    use_mask = tt.mask_of(slots_to_use)
+    if use_mask is None or use_mask & (tt.hard_mask | tt.occ[tt.day_idx[day]]):
+        return False
 
     if code not in course_usage[day]:
-        course_usage[day][code] = {"L":0,"T":0,"P":0}
+        log.setitem(course_usage[day], code, {"L":0,"T":0,"P":0})
 
     usage = course_usage[day][code]
 
@@ -963,14 +1876,15 @@ def alloc_specific(tt, busy, rm, room_busy, day, slots_to_use, f, code, typ, ele
     r = None
     if basket_num:
         r = None
+    elif held_room is not None:
+        r = held_room
     elif not elec:
         key = (code, typ)
         if key in rm:
             candidate = rm[key]
             # if candidate is C004 we still need to check cross-branch occupancy below
             if candidate != "C004":
-                used = room_busy.get(day, {}).get(candidate, set())
-                if set(slots_to_use) & used:
+                if not room_busy.is_free(day, candidate, use_mask):
                     return False
             if room_meets_capacity(candidate, student_count):
                 r = candidate
@@ -984,7 +1898,7 @@ def alloc_specific(tt, busy, rm, room_busy, day, slots_to_use, f, code, typ, ele
                 r = pick_room_with_capacity_fallback(False, day, slots_to_use, room_busy, class_prefix=class_prefix, lab_prefix=None, min_capacity=student_count, rr_state_key=class_prefix, rr_state=None)
             if r is None:
                 return False
-            rm[key] = r
+            log.setitem(rm, key, r)
         # Allow over-capacity rooms as a last-resort fallback
 
     else:
@@ -1000,100 +1914,55 @@ def alloc_specific(tt, busy, rm, room_busy, day, slots_to_use, f, code, typ, ele
 
     # Prevent cross-year basket collision (allow same-year sharing)
     if elec and basket_used is not None and basket_key and year_tag is not None:
-        by_year = basket_used.setdefault(basket_key, {})
-        for other_year, used in by_year.items():
-            if other_year == year_tag:
-                continue
-            for s_ in slots_to_use:
-                if (day, s_) in used:
-                    return False
+        if basket_clash(basket_used, basket_key, year_tag, day, use_mask):
+            return False
 
     # Global faculty clash check
     fac_list = split_faculty_names(f) if f else []
     if fac_list and faculty_busy_global is not None:
         for fac in fac_list:
-            if set(slots_to_use) & faculty_busy_global.get(day, {}).get(fac, set()):
+            if not faculty_busy_global.is_free(day, fac, use_mask):
                 return False
 
     # Commit the allocation to tt
+    v = make_placement(code, typ, r, elec, basket_num, hide_c004, year_tag, fac_list)
     for s_ in slots_to_use:
-        if is_combined_course(code):
-            if hide_c004:
-                if typ == "P":
-                    v = f"{code} (Lab)"
-                elif typ == "T":
-                    v = f"{code} TUT"
-                else:
-                    v = f"{code}"
-            else:
-                if typ == "P":
-                    v = f"{code} (Lab)"
-                elif typ == "T":
-                    v = f"{code} TUT (C004)"
-                else:
-                    v = f"{code} (C004)"
-        else:
-            if basket_num:
-                rooms = get_basket_room_list(year_tag, basket_num)
-                room_txt = ", ".join(rooms)
-                if typ == "T":
-                    v = f"{code} TUT ({room_txt})" if room_txt else f"{code} TUT"
-                elif typ == "P":
-                    v = f"{code} (Lab-{room_txt})" if room_txt else f"{code} (Lab)"
-                else:
-                    v = f"{code} ({room_txt})" if room_txt else code
-            elif r:
-                if elec and typ == "P":
-                    v = f"{code} (Lab-{r})"
-                elif typ == "T":
-                    v = f"{code} TUT ({r})"
-                elif typ == "P":
-                    v = f"{code} (Lab-{r})"
-                else:
-                    v = f"{code} ({r})"
-            else:
-                if elec and typ == "P":
-                    v = f"{code}(Lab)"
-                elif typ == "T":
-                    v = f"{code} TUT"
-                else:
-                    v = code
-        tt.at[day, s_] = v
+        log.set_cell(tt, day, s_, v)
         if faculty_tt is not None and fac_list:
             if semester_half in (1, 2):
                 for fac in fac_list:
-                    faculty_tt.setdefault(semester_half, {}).setdefault(fac, {}).setdefault(day, {})[s_] = v
+                    record_faculty_slot(log, faculty_tt, semester_half, fac, day, s_, v)
 
     if fac_list:
         for fac in fac_list:
-            busy[day].setdefault(fac, set()).update(slots_to_use)
+            log.occupy(busy, day, fac, use_mask)
             if faculty_busy_global is not None:
-                faculty_busy_global.setdefault(day, {}).setdefault(fac, set()).update(slots_to_use)
-    if r:
-        room_busy.setdefault(day, {}).setdefault(r, set()).update(slots_to_use)
+                log.occupy(faculty_busy_global, day, fac, use_mask)
+    if r and held_room is None:
+        log.occupy(room_busy, day, r, use_mask)
     if typ == "P":
-        labsd.add(day)
-    course_usage[day][code][typ] += 1
+        log.add(labsd, day)
+    usage = course_usage[day][code]
+    log.setitem(usage, typ, usage[typ] + 1)
 
 
     if elec and basket_used is not None and basket_key and year_tag is not None:
-        by_year = basket_used.setdefault(basket_key, {})
-        used = by_year.setdefault(year_tag, set())
-        for s_ in slots_to_use:
-            used.add((day, s_))
+        log.occupy(basket_used, day, (basket_key, year_tag), use_mask)
 
     return True
 
 def alloc(tt, busy, rm, room_busy, d, f, code, h, typ="L", elec=False, labsd=None, ex=False,
           preferred_slots=None, course_usage=None, class_prefix=None, rr_state=None, hide_c004=False,year_tag=None,
           basket_used=None, basket_key=None, faculty_tt=None, semester_half=None,
-          faculty_busy_global=None, student_count=None, allow_extra_same_day=False):
+          faculty_busy_global=None, student_count=None, allow_extra_same_day=False, undo=None):
+    # h: length of the block to place, in minutes; undo: see alloc_specific()
+    log = _UNLOGGED if undo is None else undo
     if labsd is None:
         labsd = set()
     if course_usage is None:
         course_usage = {dd:{} for dd in days}
     if code not in course_usage[d]:
-        course_usage[d][code] = {"L":0,"T":0,"P":0}
+        log.setitem(course_usage[d], code, {"L":0,"T":0,"P":0})
 
     usage = course_usage[d][code]
 
@@ -1107,21 +1976,19 @@ def alloc(tt, busy, rm, room_busy, d, f, code, h, typ="L", elec=False, labsd=Non
     if preferred_slots:
         pref_day, pref_slots = preferred_slots
         if pref_day == d:
-            total = sum(slot_dur[s] for s in pref_slots)
-            if abs(total - h) < 1e-9:
-                if alloc_specific(tt, busy, rm, room_busy, pref_day, pref_slots, f, code, typ, elec, labsd, course_usage, class_prefix=class_prefix, rr_state=None, hide_c004=hide_c004, year_tag=year_tag, basket_used=basket_used, basket_key=basket_key, faculty_tt=faculty_tt, semester_half=semester_half, faculty_busy_global=faculty_busy_global, student_count=student_count, allow_extra_same_day=allow_extra_same_day):
+            total = sum(DATA.slot_minutes[s] for s in pref_slots)
+            if total == h:
+                if alloc_specific(tt, busy, rm, room_busy, pref_day, pref_slots, f, code, typ, elec, labsd, course_usage, class_prefix=class_prefix, rr_state=None, hide_c004=hide_c004, year_tag=year_tag, basket_used=basket_used, basket_key=basket_key, faculty_tt=faculty_tt, semester_half=semester_half, faculty_busy_global=faculty_busy_global, student_count=student_count, allow_extra_same_day=allow_extra_same_day, undo=undo):
                     return True
 
     # For L/T/P, only use exact contiguous blocks (no splitting)
-    for use in exact_free_blocks(tt, d, h, ex):
-        if any(s_ in HARD_FORBIDDEN_SLOTS for s_ in use): continue
-        if not ex and any(s_ in FORBIDDEN_SLOTS for s_ in use): continue
-        fac_list = split_faculty_names(f) if f else []
+    fac_list = split_faculty_names(f) if f else []
+    for use, use_mask in free_windows(tt, d, h, ex):
         if fac_list:
-            if any(fac in busy[d] and (set(use) & busy[d][fac]) for fac in fac_list):
+            if any(not busy.is_free(d, fac, use_mask) for fac in fac_list):
                 continue
             if faculty_busy_global is not None:
-                if any(set(use) & faculty_busy_global.get(d, {}).get(fac, set()) for fac in fac_list):
+                if any(not faculty_busy_global.is_free(d, fac, use_mask) for fac in fac_list):
                     continue
 
         basket_num = _basket_code_parts(code) if elec else None
@@ -1132,8 +1999,7 @@ def alloc(tt, busy, rm, room_busy, d, f, code, h, typ="L", elec=False, labsd=Non
             if key in rm:
                 r = rm[key]
                 if r != "C004":
-                    used = room_busy.get(d, {}).get(r, set())
-                    if set(use) & used:
+                    if not room_busy.is_free(d, r, use_mask):
                         continue
                 if not room_meets_capacity(r, student_count):
                     continue
@@ -1148,7 +2014,7 @@ def alloc(tt, busy, rm, room_busy, d, f, code, h, typ="L", elec=False, labsd=Non
 
                 if r is None:
                     continue
-                rm[(code, typ)] = r
+                log.setitem(rm, (code, typ), r)
         else:
             if typ == "P":
                 lab_pref = lab_prefix_for_class_prefix.get(class_prefix, None)
@@ -1165,166 +2031,188 @@ def alloc(tt, busy, rm, room_busy, d, f, code, h, typ="L", elec=False, labsd=Non
 
         # Prevent cross-year basket collision (allow same-year sharing)
         if elec and basket_used is not None and basket_key and year_tag is not None:
-            by_year = basket_used.setdefault(basket_key, {})
-            conflict = False
-            for other_year, used in by_year.items():
-                if other_year == year_tag:
-                    continue
-                if any((d, s_) in used for s_ in use):
-                    conflict = True
-                    break
-            if conflict:
+            if basket_clash(basket_used, basket_key, year_tag, d, use_mask):
                 continue
 
         # commit allocation to cells
+        v = make_placement(code, typ, r, elec, basket_num, hide_c004, year_tag, fac_list)
         for s_ in use:
-            if is_combined_course(code):
-                if hide_c004:
-                    if typ == "P":
-                        v = f"{code}(Lab)"
-                    elif typ == "T":
-                        v = f"{code} TUT"
-                    else:
-                        v = f"{code}"
-                else:
-                    if typ == "P":
-                        v = f"{code} (Lab)"
-                    elif typ == "T":
-                        v = f"{code} TUT (C004)"
-                    else:
-                        v = f"{code} (C004)"
-            else:
-                if basket_num:
-                    rooms = get_basket_room_list(year_tag, basket_num)
-                    room_txt = ", ".join(rooms)
-                    if typ == "T":
-                        v = f"{code} TUT ({room_txt})" if room_txt else f"{code} TUT"
-                    elif typ == "P":
-                        v = f"{code} (Lab-{room_txt})" if room_txt else f"{code} (Lab)"
-                    else:
-                        v = f"{code} ({room_txt})" if room_txt else code
-                elif r:
-                    if elec and typ == "P":
-                        v = f"{code} (Lab-{r})"
-                    elif typ == "T":
-                        v = f"{code} TUT ({r})"
-                    elif typ == "P":
-                        v = f"{code} (Lab-{r})"
-                    else:
-                        v = f"{code} ({r})"
-                else:
-                    if elec and typ == "P":
-                        v = f"{code}(Lab)"
-                    elif typ == "T":
-                        v = f"{code} TUT"
-                    else:
-                        v = code
-            tt.at[d, s_] = v
+            log.set_cell(tt, d, s_, v)
             if faculty_tt is not None and fac_list:
                 if semester_half in (1, 2):
                     for fac in fac_list:
-                        faculty_tt.setdefault(semester_half, {}).setdefault(fac, {}).setdefault(d, {})[s_] = v
+                        record_faculty_slot(log, faculty_tt, semester_half, fac, d, s_, v)
 
         if fac_list:
             for fac in fac_list:
-                busy[d].setdefault(fac, set()).update(use)
+                log.occupy(busy, d, fac, use_mask)
                 if faculty_busy_global is not None:
-                    faculty_busy_global.setdefault(d, {}).setdefault(fac, set()).update(use)
+                    log.occupy(faculty_busy_global, d, fac, use_mask)
         if r:
-            room_busy.setdefault(d, {}).setdefault(r, set()).update(use)
+            log.occupy(room_busy, d, r, use_mask)
         if typ == "P":
-            labsd.add(d)
-        course_usage[d][code][typ] += 1
+            log.add(labsd, d)
+        usage = course_usage[d][code]
+        log.setitem(usage, typ, usage[typ] + 1)
 
 
         if elec and basket_used is not None and basket_key and year_tag is not None:
-            by_year = basket_used.setdefault(basket_key, {})
-            used = by_year.setdefault(year_tag, set())
-            for s_ in use:
-                used.add((d, s_))
+            log.occupy(basket_used, d, (basket_key, year_tag), use_mask)
 
         return True
 
     return False
 
 
-def get_all_valid_free_slots(tt):
-    valid = []
-    for d in days:
-        for s_ in slot_keys:
-            if s_ in HARD_FORBIDDEN_SLOTS: continue
-            if s_ in FORBIDDEN_SLOTS: continue
-            if tt.at[d, s_] == "": valid.append((d, s_))
-    return valid
-
-
-def extract_contiguous_blocks(slot_list):
-    # Group truly contiguous slots (by slot_keys order) per day
-    by_day = {}
-    slot_idx = {s:i for i,s in enumerate(slot_keys)}
-    for d, s_ in slot_list:
-        if s_ not in slot_idx:
-            continue
-        by_day.setdefault(d, []).append(slot_idx[s_])
+#############################################
+# BACKTRACKING ENGINE
+#############################################
 
+ENGINES = ("greedy", "backtrack", "cpsat")
+# placements the backtracking engine may undo per course list before it
+# settles for the first window that fits
+BACKTRACK_BUDGET = 2000
+# rip-up and reroute (generate()'s post-pass for unscheduled courses): how
+# many placed courses one neighbourhood unplaces, and the placements its
+# search may undo
+REROUTE_NEIGHBOURHOOD = 3
+REROUTE_BUDGET = 200
+# deterministic time the "cpsat" engine (OR-Tools CP-SAT) may spend on one
+# course list: the solver's own work measure, close to seconds on a
+# typical machine but independent of load
+CPSAT_TIME_LIMIT = 10.0
+
+def component_blocks(typ, minutes):
+    """Block lengths (minutes) one L/T/P component is split into: the greedy engine's first choice."""
     blocks = []
-    for d in days:
-        if d not in by_day:
-            continue
-        idxs = sorted(set(by_day[d]))
-        cur = [idxs[0]]
-        for i in idxs[1:]:
-            if i == cur[-1] + 1:
-                cur.append(i)
+    h = minutes
+    while h > 0:
+        if typ == "L":
+            if h == 120:
+                a = 90
+            elif h == 60:
+                a = 60
+            elif h >= 90:
+                a = 90
+            elif h >= 60:
+                a = 60
             else:
-                blocks.append((d, [slot_keys[j] for j in cur]))
-                cur = [i]
-        if cur:
-            blocks.append((d, [slot_keys[j] for j in cur]))
+                a = 30
+        elif typ == "P":
+            a = 120 if h >= 120 else 90 if h >= 90 else 60
+        else:
+            a = 60
+        blocks.append(a)
+        h -= a
     return blocks
 
+class BacktrackSearch:
+    """
+    Depth-first placement of chunks (fixed-length blocks of a course
+    component) on one timetable, most constrained chunk first (MRV).
+
+    Each chunk's domain, the windows it can still take, is kept per day. A
+    placement only books resources on its own day, so afterwards only that
+    day's windows of the other chunks are rechecked (forward checking). A
+    placement that leaves another chunk without any window is undone and
+    the next window tried; a chunk with no window left sends the search
+    back to the previous choice. Once `budget` placements have been undone
+    the search stops backtracking and keeps the first window that fits.
+
+    windows_on(chunk, day, among=None) lists the windows (slots, mask) the
+    chunk can take now, best first, checking only those in among when given
+    (a placement only ever removes windows, so the current domain is
+    rechecked; an undone placement restores the saved domains).
+    place(chunk, day, slots) books one through undo
+    and returns False if it does not fit after all; days_of(chunk) orders
+    the days to try. run() returns None once every chunk is placed, else
+    the first chunk that ran out of windows (the caller rolls back).
+    """
+    def __init__(self, chunks, windows_on, place, days_of, undo, budget=BACKTRACK_BUDGET):
+        self.order = {k: i for i, k in enumerate(chunks)}
+        self.windows_on = windows_on
+        self.place = place
+        self.days_of = days_of
+        self.undo = undo
+        self.budget = budget
+        self.domains = {}
+        self.sizes = {}
+        self.unassigned = set(chunks)
+        self.culprit = None
+
+    def shrink(self, day):
+        """Recheck day's windows of the unplaced chunks; returns the old lists."""
+        saved = {}
+        for k in self.unassigned:
+            current = self.domains[k][day]
+            if current:
+                saved[k] = current
+                now = self.domains[k][day] = self.windows_on(k, day, current)
+                self.sizes[k] -= len(current) - len(now)
+        return saved
+
+    def restore(self, day, saved):
+        for k, windows in saved.items():
+            self.sizes[k] += len(windows) - len(self.domains[k][day])
+            self.domains[k][day] = windows
+
+    def run(self):
+        for k in self.unassigned:
+            self.domains[k] = {d: self.windows_on(k, d) for d in days}
+            self.sizes[k] = sum(len(w) for w in self.domains[k].values())
+        return None if self._search() else self.culprit
+
+    def _search(self):
+        if not self.unassigned:
+            return True
+        sizes = self.sizes
+        k = min(self.unassigned, key=lambda k: (sizes[k], self.order[k]))
+        if not sizes[k]:
+            if self.culprit is None:
+                self.culprit = k
+            return False
+        for day in self.days_of(k):
+            for slots, _mask in list(self.domains[k][day]):
+                mark = self.undo.checkpoint()
+                if not self.place(k, day, slots):
+                    self.undo.rollback(mark)
+                    continue
+                self.unassigned.discard(k)
+                saved = self.shrink(day)
+                if self.budget <= 0 or all(sizes[o] for o in self.unassigned):
+                    if self._search():
+                        return True
+                    if self.budget <= 0:
+                        return False
+                self.undo.rollback(mark)
+                self.unassigned.add(k)
+                self.restore(day, saved)
+                self.budget -= 1
+        if self.culprit is None:
+            self.culprit = k
+        return False
+
 def try_allocate_chunk_from_block(
     tt, busy, rm, room_busy, labsd, course_usage,
-    code, faculty, typ, need, day, slots,
+    code, faculty, typ, need, day, run,
     class_prefix=None, rr_state=None, hide_c004=False,
-    allow_excluded=False, basket_used=None, basket_key=None,
+    basket_used=None, basket_key=None,
     faculty_tt=None, semester_half=None, faculty_busy_global=None,
     student_count=None, exact=False
 ):
-    n = len(slots)
-
-    best_sub = None
-    best_i = best_j = None
-    best_total = None
-
+    """
+    Place one chunk of need minutes inside run, a (start, end) slot range
+    from tt.free_runs(day): the shortest fitting slice (exact length with
+    exact=True), earliest first. Returns (remaining run slots, used slots)
+    or (None, None).
+    """
     # 1️⃣ Find best contiguous slice
-    for i in range(n):
-        accum = 0.0
-        sub = []          # ✅ MUST be here
-
-        for j in range(i, n):
-            s_key = slots[j]
-
-            # 🚫 Hard-forbid excluded slots
-            if s_key in HARD_FORBIDDEN_SLOTS:
-                break
-            if s_key in FORBIDDEN_SLOTS and not allow_excluded:
-                break
-
-            sub.append(s_key)
-            accum += slot_dur[s_key]
-
-            if accum + 1e-9 >= need:
-                if exact and abs(accum - need) > 1e-9:
-                    break
-                if all(tt.at[day, s_] == "" for s_ in sub):
-                    if best_sub is None or accum < best_total - 1e-9:
-                        best_sub = list(sub)
-                        best_i, best_j, best_total = i, j, accum
-                break
-
-    if best_sub is None:
+    start, end = run
+    fit = tt.windows.fit(start, end, need, exact=exact)
+    if fit is None:
         return None, None
+    best_i, best_j = fit
+    best_sub = tt.slots[best_i:best_j]
 
     # 2️⃣ Allocate chosen slice
     ok = alloc_specific(
@@ -1346,7 +2234,7 @@ def try_allocate_chunk_from_block(
     if not ok:
         return None, None
 
-    new_slots = slots[:best_i] + slots[best_j + 1:]
+    new_slots = tt.slots[start:best_i] + tt.slots[best_j:end]
     return new_slots, best_sub
 
 def assign_combined_precise_durations(
@@ -1355,7 +2243,7 @@ def assign_combined_precise_durations(
     combined_sync=None, year_tag=None, semester_half=None, faculty_tt=None,
     faculty_busy_global=None
 ):
-    ALLOWED_LECTURE_CHUNKS = [1.5, 1.0]
+    ALLOWED_LECTURE_CHUNKS = [90, 60]   # minutes
     if not combined_core:
         return []
 
@@ -1376,43 +2264,44 @@ def assign_combined_precise_durations(
 
         ch = []
 
-        rem = float(L)
-        if abs(rem - 2.0) < 1e-9:
+        # chunk lengths in minutes
+        rem = L * 60
+        if rem == 120:
             # Priority order for L=2
-            for a in (1.5, 0.5):
+            for a in (90, 30):
                 ch.append((a, "L"))
-        elif abs(rem - 1.0) < 1e-9:
-            ch.append((1.0, "L"))
+        elif rem == 60:
+            ch.append((60, "L"))
         else:
-            while rem > 1e-9:
-                if rem >= 1.5 and (abs(rem - 1.5) < 1e-9 or rem - 1.5 >= 0.5 - 1e-9):
-                    ch.append((1.5, "L"))
-                    rem -= 1.5
-                elif rem >= 1.0 and (abs(rem - 1.0) < 1e-9 or rem - 1.0 >= 0.5 - 1e-9):
-                    ch.append((1.0, "L"))
-                    rem -= 1.0
-                elif rem >= 0.5 - 1e-9:
-                    ch.append((0.5, "L"))
-                    rem -= 0.5
+            while rem > 0:
+                if rem >= 90 and (rem == 90 or rem - 90 >= 30):
+                    ch.append((90, "L"))
+                    rem -= 90
+                elif rem >= 60 and (rem == 60 or rem - 60 >= 30):
+                    ch.append((60, "L"))
+                    rem -= 60
+                elif rem >= 30:
+                    ch.append((30, "L"))
+                    rem -= 30
                 else:
                     break
 
-        rem = float(T)
-        while rem > 1e-9:
-            ch.append((1.0, "T"))
-            rem -= 1.0
-
-        rem = float(P)
-        while rem > 1e-9:
-            if rem >= 2.0:
-                ch.append((2.0, "P"))
-                rem -= 2.0
-            elif rem >= 1.5:
-                ch.append((1.5, "P"))
-                rem -= 1.5
+        rem = T * 60
+        while rem > 0:
+            ch.append((60, "T"))
+            rem -= 60
+
+        rem = P * 60
+        while rem > 0:
+            if rem >= 120:
+                ch.append((120, "P"))
+                rem -= 120
+            elif rem >= 90:
+                ch.append((90, "P"))
+                rem -= 90
             else:
-                ch.append((1.0, "P"))
-                rem -= 1.0
+                ch.append((60, "P"))
+                rem -= 60
 
         chunks_map[code] = sorted(ch, key=lambda x: -x[0])
         combined_list.append((code, c))
@@ -1463,16 +2352,13 @@ def assign_combined_precise_durations(
 
             # ===== NORMAL BLOCK SEARCH =====
             if not allocated:
-                valid_slots = get_all_valid_free_slots(tt)
-                valid_blocks = extract_contiguous_blocks(valid_slots)
-
-                for day, slots in valid_blocks:
-                    if day in days_used:
-                        continue
+                valid_blocks = [(day, run) for day in tt.days if day not in days_used
+                                for run in tt.free_runs(day)]
 
+                for day, run in valid_blocks:
                     _, used_slots = try_allocate_chunk_from_block(
                         tt, busy, rm, room_busy, labsd, course_usage,
-                        code, faculty, typ, need, day, slots,
+                        code, faculty, typ, need, day, run,
                         class_prefix="C0",
                         rr_state=None,
                         hide_c004=hide_c004,
@@ -1504,8 +2390,12 @@ def assign_combined_precise_durations(
 color_avail = colors.copy()
 color_map = {}
 legend_room_map = {}
+timetable_grids = {}
 basket_course_room_map = {}
 basket_room_list_map = {}
+# (year, basket) -> blocks whose courses could not all get a room, each
+# with a match_rooms() certificate (see match_basket_blocks())
+basket_room_shortfalls = {}
 basket_room_busy = None
 ELECTIVE_SYNC_BY_YEAR = {}
 GLOBAL_ROOM_BUSY = None
@@ -1516,7 +2406,23 @@ def reset_color_palette():
     color_avail = colors.copy()
     color_map = {}
 
+def reset_run_state():
+    """Forget everything a previous timetable run left in module state."""
+    global legend_room_map, timetable_grids, basket_course_room_map, basket_room_list_map
+    global basket_room_shortfalls, basket_room_busy, ELECTIVE_SYNC_BY_YEAR, GLOBAL_ROOM_BUSY
+    reset_color_palette()
+    legend_room_map = {}
+    timetable_grids = {}
+    basket_course_room_map = {}
+    basket_room_list_map = {}
+    basket_room_shortfalls = {}
+    basket_room_busy = None
+    ELECTIVE_SYNC_BY_YEAR = {}
+    GLOBAL_ROOM_BUSY = None
+
 def extract_course_code(cell_value):
+    if isinstance(cell_value, Placement):
+        return cell_value.code.strip().upper()
     if cell_value is None:
         return ""
     val = str(cell_value).strip()
@@ -1536,10 +2442,301 @@ def get_color_for_course(course_code):
         else: color_map[k] = "CCCCCC"
     return color_map[k]
 
+#############################################
+# QUALITY ANNEALING
+#############################################
+
+# The optional "quality" section of groups.json. anneal_moves is the number
+# of moves proposed per group and half (0 turns the pass off); weights are
+# per hour: of free time between a group's classes on a day (gap), of
+# faculty teaching back to back beyond max_run_minutes (faculty_run), and of
+# the square of a group's teaching hours on a day (day_load). room_reassign
+# turns on the room post-pass reassign_rooms().
+QUALITY_DEFAULTS = {
+    "anneal_moves": 0,
+    "room_reassign": True,
+    "max_run_minutes": 180,
+    "temperature": [2.0, 0.05],
+    "weights": {"gap": 1.0, "faculty_run": 1.0, "day_load": 0.25},
+}
+# share of proposals that swap two blocks instead of moving one
+ANNEAL_SWAP_SHARE = 0.3
+
+def quality_settings(section=None):
+    """QUALITY_DEFAULTS overridden by a config "quality" section."""
+    section = section or {}
+    unknown = sorted(set(section) - set(QUALITY_DEFAULTS))
+    unknown += sorted(set(section.get("weights", {})) - set(QUALITY_DEFAULTS["weights"]))
+    if unknown:
+        raise Exception(f"quality: unknown settings {unknown}")
+    q = dict(QUALITY_DEFAULTS, **section)
+    q["weights"] = dict(QUALITY_DEFAULTS["weights"], **section.get("weights", {}))
+    return q
+
+class BlockAnnealer:
+    """
+    Simulated annealing over the placed blocks of one timetable. A block is
+    one run of a course's cells: a dict with day, slots, mask (its bits in
+    the day row), minutes, key (course code as the grid indexes it), facs
+    and rooms.
+
+    A move shifts a block to another free window of the same length; a swap
+    exchanges two blocks of the same length. Both are checked and scored on
+    the bitmask rows they touch only (the group's day rows and the rows of
+    the faculty and rooms involved), and each row's cost is memoised per
+    mask, so a proposal costs a few dictionary lookups. The annealer keeps
+    its own rows; run() leaves every block at the best layout it saw and
+    the caller moves the real bookings.
+
+    faculty_mask(day, fac) and room_mask(day, room) give the initial rows,
+    including bookings of other groups. A block only moves to a day holding
+    no other block of its course, so the once-per-day rules still hold.
+    """
+    def __init__(self, tt, blocks, faculty_mask, room_mask, quality):
+        self.tt = tt
+        self.blocks = blocks
+        self.weights = quality["weights"]
+        self.max_run = quality["max_run_minutes"]
+        self.temperature = quality["temperature"]
+        self.minutes = [DATA.slot_minutes[s_] for s_ in tt.slots]
+        ends = {x["key"]: (x["start"], x["end"]) for x in DATA.slots_norm}
+        # joined[i]: slot i + 1 starts when slot i ends
+        self.joined = [ends[a][1] == ends[b][0] for a, b in zip(tt.slots, tt.slots[1:])] + [False]
+        self.occ = {d: tt.occ[tt.day_idx[d]] for d in tt.days}
+        self.fac, self.room, self.code = {}, {}, {}
+        for b in blocks:
+            for d in tt.days:
+                for f in b["facs"]:
+                    self.fac[(f, d)] = faculty_mask(d, f)
+                for r in b["rooms"]:
+                    self.room[(r, d)] = room_mask(d, r)
+                masks = tt.code_days.get(b["key"])
+                self.code[(b["key"], d)] = masks[tt.day_idx[d]] if masks else 0
+        self.by_minutes = {}
+        for b in blocks:
+            self.by_minutes.setdefault(b["minutes"], []).append(b)
+        self.windows = {m: list(tt.windows.windows(m, False)) for m in self.by_minutes}
+        self._day_costs = {}
+        self._run_costs = {}
+
+    def _minutes_of(self, m):
+        total = 0
+        i = 0
+        while m:
+            if m & 1:
+                total += self.minutes[i]
+            m >>= 1
+            i += 1
+        return total
+
+    def day_cost(self, m):
+        """gap and day_load cost of one group day row."""
+        cost = self._day_costs.get(m)
+        if cost is None:
+            cost = 0.0
+            if m:
+                lo = (m & -m).bit_length() - 1
+                span = (1 << m.bit_length()) - (1 << lo)
+                gaps = span & ~m & ~self.tt.forbidden_mask
+                cost = (self.weights["gap"] * self._minutes_of(gaps) / 60
+                        + self.weights["day_load"] * (self._minutes_of(m) / 60) ** 2)
+            self._day_costs[m] = cost
+        return cost
+
+    def run_cost(self, m):
+        """faculty_run cost of one faculty day row."""
+        cost = self._run_costs.get(m)
+        if cost is None:
+            excess = 0
+            run = 0
+            for i, length in enumerate(self.minutes):
+                if m >> i & 1:
+                    run += length
+                    if not (self.joined[i] and m >> (i + 1) & 1):
+                        excess += max(0, run - self.max_run)
+                        run = 0
+            cost = self._run_costs[m] = self.weights["faculty_run"] * excess / 60
+        return cost
+
+    def cost(self):
+        return (sum(self.day_cost(m) for m in self.occ.values())
+                + sum(self.run_cost(m) for m in self.fac.values()))
+
+    def propose(self, rng):
+        """[(block, day, slots, mask)] for a random move or swap; None if it is a no-op."""
+        b = self.blocks[rng.randrange(len(self.blocks))]
+        if rng.random() < ANNEAL_SWAP_SHARE:
+            same = self.by_minutes[b["minutes"]]
+            o = same[rng.randrange(len(same))]
+            # a swap must not carry a block into a slot the engine only uses as a last resort
+            if o["key"] == b["key"] or (b["mask"] | o["mask"]) & self.tt.forbidden_mask:
+                return None
+            return [(b, o["day"], o["slots"], o["mask"]), (o, b["day"], b["slots"], b["mask"])]
+        wins = self.windows[b["minutes"]]
+        if not wins:
+            return None
+        d = self.tt.days[rng.randrange(len(self.tt.days))]
+        slots, m = wins[rng.randrange(len(wins))]
+        if d == b["day"] and m == b["mask"]:
+            return None
+        return [(b, d, slots, m)]
+
+    def evaluate(self, changes):
+        """(cost delta, new rows) of applying changes; None if they clash."""
+        rows = {"occ": {}, "fac": {}, "room": {}, "code": {}}
+
+        def get(kind, key):
+            new = rows[kind]
+            return new[key] if key in new else getattr(self, kind).get(key, 0)
+
+        def touched(b, d):
+            yield "occ", d
+            for f in b["facs"]:
+                yield "fac", (f, d)
+            for r in b["rooms"]:
+                yield "room", (r, d)
+
+        for b, _d, _slots, _m in changes:
+            for kind, key in touched(b, b["day"]):
+                rows[kind][key] = get(kind, key) & ~b["mask"]
+            key = (b["key"], b["day"])
+            rows["code"][key] = get("code", key) & ~b["mask"]
+        for b, d, _slots, m in changes:
+            for kind, key in touched(b, d):
+                cur = get(kind, key)
+                if cur & m:
+                    return None
+                rows[kind][key] = cur | m
+            key = (b["key"], d)
+            cur = get("code", key)
+            if cur and d != b["day"]:
+                return None
+            rows["code"][key] = cur | m
+        delta = sum(self.day_cost(m) - self.day_cost(self.occ[d]) for d, m in rows["occ"].items())
+        delta += sum(self.run_cost(m) - self.run_cost(self.fac[k]) for k, m in rows["fac"].items())
+        return delta, rows
+
+    def run(self, moves, rng):
+        """Anneal for moves proposals; returns (start cost, best cost)."""
+        import math
+        t0, t1 = self.temperature
+        start = cost = best = self.cost()
+        best_at = [(b["day"], b["slots"], b["mask"]) for b in self.blocks]
+        for i in range(moves):
+            changes = self.propose(rng)
+            if changes is None:
+                continue
+            found = self.evaluate(changes)
+            if found is None:
+                continue
+            delta, rows = found
+            if delta > 0 and rng.random() >= math.exp(-delta / (t0 * (t1 / t0) ** (i / moves))):
+                continue
+            for kind, new in rows.items():
+                getattr(self, kind).update(new)
+            for b, d, slots, m in changes:
+                b["day"], b["slots"], b["mask"] = d, slots, m
+            cost += delta
+            if cost < best - 1e-9:
+                best = cost
+                best_at = [(b["day"], b["slots"], b["mask"]) for b in self.blocks]
+        # the rows are not rolled back with the blocks; run() is the last use
+        for b, (d, slots, m) in zip(self.blocks, best_at):
+            b["day"], b["slots"], b["mask"] = d, slots, m
+        return start, best
+
+#############################################
+# SHEET RENDERING
+#############################################
+
+class SheetModel:
+    """
+    One output sheet held as plain rows plus per-cell styles and merges, so
+    merging, colouring and column widths are worked out before anything is
+    handed to openpyxl. Styles are small attribute dicts: font ("bold",
+    "bold12", "bold13"), alignment ("center", "wrap"), border (True) and
+    fill (an RGB string).
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.rows = []
+        self.styles = {}     # row -> {col -> {attr: value}}
+        self.merges = []     # (row, first col, last col)
+        self.widths = {}     # col -> width
+
+    def append(self, values):
+        """Add a row; returns its 1-based row number."""
+        self.rows.append(list(values))
+        return len(self.rows)
+
+    def style(self, row, col, **attrs):
+        self.styles.setdefault(row, {}).setdefault(col, {}).update(attrs)
+
+    @property
+    def max_row(self):
+        # like openpyxl: appended empty rows hold no cells
+        for r in range(len(self.rows), 0, -1):
+            if self.rows[r - 1]:
+                return r
+        return 1
+
+    @property
+    def max_column(self):
+        return max((len(row) for row in self.rows), default=0) or 1
+
+def _style_object(attr, value):
+    from openpyxl.styles import Alignment, Font, PatternFill
+    if attr == "font":
+        return Font(bold=True, size={"bold12": 12, "bold13": 13}.get(value))
+    if attr == "alignment":
+        return Alignment(horizontal="center", vertical="center", wrap_text=(value == "wrap") or None)
+    if attr == "border":
+        return thin_border()
+    return PatternFill(start_color=value, end_color=value, fill_type="solid")
+
+def write_sheet(wb, model, style_cache, first=False):
+    """
+    Emit a finished SheetModel into wb. Works with write-only workbooks,
+    which stream rows to disk; each distinct style is built once per
+    workbook (style_cache) and copied onto its cells.
+    """
+    from openpyxl.cell import Cell
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.cell_range import CellRange
+    ws = _new_sheet(wb, model.title, first=first)
+    for col, width in sorted(model.widths.items()):
+        ws.column_dimensions[get_column_letter(col)].width = width
+    for r, values in enumerate(model.rows, 1):
+        row_styles = model.styles.get(r)
+        if not row_styles:
+            ws.append(values)
+            continue
+        out = list(values) + [None] * (max(row_styles) - len(values))
+        for c, attrs in row_styles.items():
+            key = tuple(sorted(attrs.items()))
+            arr = style_cache.get(key)
+            if arr is None:
+                proto = Cell(ws, row=1, column=1)
+                for attr, value in key:
+                    setattr(proto, attr, _style_object(attr, value))
+                arr = style_cache[key] = proto._style
+            out[c - 1] = Cell(ws, row=r, column=c, value=out[c - 1], style_array=arr)
+        ws.append(out)
+    for r, c1, c2 in model.merges:
+        ws.merged_cells.add(CellRange(min_col=c1, min_row=r, max_col=c2, max_row=r))
+    return ws
+
 def merge_and_color(ws, courses):
+    """
+    Style a SheetModel: bold centred header, merged runs of identical
+    entries in each timetable row, course colours, thin borders and
+    auto column widths. Legend tables are only bordered.
+    """
     sc = 2
     mc = ws.max_column
     mr = ws.max_row
+    rows = [row + [None] * (mc - len(row)) for row in ws.rows[:mr]]
 
     valid_course_codes = {
         s(x.get("Course_Code", "")).replace("T", "").strip().upper()
@@ -1552,20 +2749,12 @@ def merge_and_color(ws, courses):
     legend_rows = set()
     r = 1
     while r <= mr:
-        v = ws.cell(r, 1).value
+        v = rows[r - 1][0]
         if isinstance(v, str) and v.strip().startswith("Legend -"):
-            # include title row and subsequent legend table rows
+            # include title row and subsequent legend table rows,
+            # stopping at a completely blank row
             rr = r
-            while rr <= mr:
-                # stop at a completely blank row
-                any_val = False
-                for c in range(1, mc + 1):
-                    cell_v = ws.cell(rr, c).value
-                    if cell_v not in (None, ""):
-                        any_val = True
-                        break
-                if not any_val:
-                    break
+            while rr <= mr and any(x not in (None, "") for x in rows[rr - 1]):
                 legend_rows.add(rr)
                 rr += 1
             r = rr
@@ -1574,54 +2763,32 @@ def merge_and_color(ws, courses):
 
     # Header styling
     for col in range(2, mc + 1):
-        cell = ws.cell(2, col)
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.border = thin
+        ws.style(2, col, font="bold", alignment="center", border=True)
 
     # Merge contiguous identical entries in each row
     for r in range(3, mr + 1):
+        row = rows[r - 1]
         if r in legend_rows:
             for c in range(sc, mc + 1):
-                ws.cell(r, c).border = thin
+                ws.style(r, c, border=True)
             continue
         c = sc
         while c <= mc:
-            raw = ws.cell(r, c).value
+            raw = row[c - 1]
             if raw is None or str(raw).strip() == "":
-                ws.cell(r, c).border = thin
+                ws.style(r, c, border=True)
                 c += 1
                 continue
 
             val = str(raw).strip()
-            merge_cols = [c]
-
-            # extend to all immediately-adjacent cells with same text
-            next_col = c + 1
-            while next_col <= mc:
-                next_raw = ws.cell(r, next_col).value
-                next_val = str(next_raw).strip() if next_raw is not None else ""
-                if next_val == val:
-                    merge_cols.append(next_col)
-                    next_col += 1
-                else:
-                    break
-
-            # actually merge the block if it spans >1 column
-            if len(merge_cols) > 1:
-                ws.merge_cells(
-                    start_row=r,
-                    start_column=merge_cols[0],
-                    end_row=r,
-                    end_column=merge_cols[-1]
-                )
-
-            # styling + colour
-            cell = ws.cell(r, merge_cols[0])
-            cell.alignment = Alignment(horizontal="center",
-                                       vertical="center",
-                                       wrap_text=True)
-            cell.font = Font(bold=True)
+            end = c
+            while end < mc and row[end] is not None and str(row[end]).strip() == val:
+                end += 1
+            if end > c:
+                ws.merges.append((r, c, end))
+                # merged-over cells keep only their style
+                for cc_ in range(c + 1, end + 1):
+                    ws.rows[r - 1][cc_ - 1] = None
 
             raw_course_name = extract_course_code(val)
             fill_color = (
@@ -1630,35 +2797,20 @@ def merge_and_color(ws, courses):
                     or raw_course_name.startswith("ELECTIVE"))
                 else None
             )
-
-            for cc_ in merge_cols:
-                cell_ref = ws.cell(r, cc_)
-                cell_ref.border = thin
-                cell_ref.alignment = Alignment(
-                    horizontal="center",
-                    vertical="center",
-                    wrap_text=True
-                )
-                cell_ref.font = Font(bold=True)
-                if fill_color:
-                    cell_ref.fill = PatternFill(
-                        start_color=fill_color,
-                        end_color=fill_color,
-                        fill_type="solid"
-                    )
-
-            c = merge_cols[-1] + 1
+            attrs = {"border": True, "alignment": "wrap", "font": "bold"}
+            if fill_color:
+                attrs["fill"] = fill_color
+            for cc_ in range(c, end + 1):
+                ws.style(r, cc_, **attrs)
+            c = end + 1
 
     # auto column widths
-    for col in ws.columns:
+    for col in range(1, mc + 1):
         maxl = 0
-        cl = col[0].column_letter
-        for cell in col:
-            v = cell.value
-            if v is None:
-                continue
-            maxl = max(maxl, len(str(v)))
-        ws.column_dimensions[cl].width = min(maxl + 2 if maxl else 8, 60)
+        for row in ws.rows[:mr]:
+            if col <= len(row) and row[col - 1] is not None:
+                maxl = max(maxl, len(str(row[col - 1])))
+        ws.widths[col] = min(maxl + 2 if maxl else 8, 60)
 
 def combined_label(c):
     if not is_combined_flag(c):
@@ -1703,14 +2855,10 @@ def _ensure_basket_room_busy():
     if basket_room_busy is not None:
         return
     if GLOBAL_ROOM_BUSY is None:
-        basket_room_busy = {d: {} for d in days}
+        basket_room_busy = OccupancyIndex()
         return
-    # deep copy: day -> room -> set(slots)
-    basket_room_busy = {}
-    for d in days:
-        basket_room_busy[d] = {}
-        for room, used in GLOBAL_ROOM_BUSY.get(d, {}).items():
-            basket_room_busy[d][room] = set(used)
+    # snapshot of the room bitmasks (ints), later basket bookings stay local
+    basket_room_busy = GLOBAL_ROOM_BUSY.copy()
 
 def _basket_code_parts(code):
     try:
@@ -1728,6 +2876,175 @@ def get_basket_room_list(year_tag, basket):
         return []
     return basket_room_list_map.get((int(year_tag), str(basket)), [])
 
+def min_cost_assignment(cost):
+    """
+    Hungarian algorithm: cost is an n x m matrix (n <= m); returns, for
+    each row, the column it gets so that the total cost is minimal and no
+    column is used twice. O(n^2 m).
+    """
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    inf = float("inf")
+    u, v = [0] * (n + 1), [0] * (m + 1)
+    row_of = [0] * (m + 1)       # column j (1-based) -> row (1-based), 0 if free
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        row_of[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0, delta, j1 = row_of[j0], inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j], way[j] = cur, j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[row_of[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if not row_of[j0]:
+                break
+        while j0:
+            j1 = way[j0]
+            row_of[j0] = row_of[j1]
+            j0 = j1
+    assign = [None] * n
+    for j in range(1, m + 1):
+        if row_of[j]:
+            assign[row_of[j] - 1] = j - 1
+    return assign
+
+def match_rooms(items, allowed, tier=None):
+    """
+    Give each item (code, student_count) of items a distinct room from
+    allowed[code]: as many items as possible, then rooms of the best tiers,
+    then as few empty (or missing) seats as possible. tier(code, room) ranks
+    a room for an item, 0 best; by default a room smaller than the item's
+    student count is tier 1. Solved exactly as one assignment problem
+    (min_cost_assignment()), so the result does not depend on item order.
+
+    Returns ({code: room}, certificate). When some item gets no room the
+    certificate is (codes, rooms): a set of items and every room any of
+    them may use, with fewer rooms than items, so no assignment can serve
+    them all (Hall's condition fails). Otherwise it is None.
+    """
+    rooms = []
+    col = {}
+    for code, _n in items:
+        for r in allowed[code]:
+            if r not in col:
+                col[r] = len(rooms)
+                rooms.append(r)
+
+    def waste(r, n):
+        cap = DATA.rooms.capacity_of(r)
+        return 0 if cap is None or n is None else int(cap - n)
+
+    if tier is None:
+        sizes = dict(items)
+        tier = lambda code, r: 0 if waste(r, sizes[code]) >= 0 else 1
+    # a tier step costs more than any total of seats, and leaving an item
+    # without a room more than any set of rooms
+    seats = max([abs(waste(r, n)) for code, n in items for r in allowed[code]] or [0]) + 1
+    step = (len(items) + 1) * seats
+    worst = max([tier(code, r) for code, _n in items for r in allowed[code]] or [0])
+    unassigned = (len(items) + 1) * ((worst + 1) * step)
+    cost = []
+    for code, n in items:
+        row = [unassigned + 1] * (len(rooms) + len(items))
+        for r in allowed[code]:
+            row[col[r]] = tier(code, r) * step + abs(waste(r, n))
+        for k in range(len(items)):
+            row[len(rooms) + k] = unassigned
+        cost.append(row)
+    got = {}
+    for (code, _n), j in zip(items, min_cost_assignment(cost)):
+        if j is not None and j < len(rooms):
+            got[code] = rooms[j]
+    if len(got) == len(items):
+        return got, None
+    # alternating search from the items left out: the items it reaches
+    # can only use the rooms it reaches, all of them taken by those items
+    holder = {r: code for code, r in got.items()}
+    codes = [code for code, _n in items if code not in got]
+    seen_codes, seen_rooms = set(codes), []
+    while codes:
+        code = codes.pop()
+        for r in allowed[code]:
+            if r not in seen_rooms:
+                seen_rooms.append(r)
+                if holder[r] not in seen_codes:
+                    seen_codes.add(holder[r])
+                    codes.append(holder[r])
+    order = [code for code, _n in items]
+    return got, (sorted(seen_codes, key=order.index), sorted(seen_rooms, key=col.get))
+
+def _basket_room_free(day, room, mask):
+    # basket_room_busy is a snapshot; rooms booked since are in GLOBAL_ROOM_BUSY
+    if not basket_room_busy.is_free(day, room, mask):
+        return False
+    return GLOBAL_ROOM_BUSY is None or GLOBAL_ROOM_BUSY.is_free(day, room, mask)
+
+def match_basket_blocks(year_tag, basket, items, blocks):
+    """
+    Book rooms for basket courses items [(code, student_count, class_prefix)]
+    in every block (day, slots) of the basket, with match_rooms(): first
+    one room per course free in all blocks, then, for the courses left,
+    block by block. Records basket_course_room_map and returns, in booking
+    order, the rooms used. A block where some course still gets no room is
+    recorded in basket_room_shortfalls with the certificate match_rooms()
+    gives.
+    """
+    year = int(year_tag)
+    # tiers: rooms large enough (room_candidates() leaves the prefix when it
+    # has none), the prefix's smaller rooms, then any other classroom
+    cands, tiers = {}, {}
+    for code, n, class_prefix in items:
+        big = room_candidates(lab=False, prefix=class_prefix, lab_prefix=None, min_capacity=n)
+        small = room_candidates(lab=False, prefix=class_prefix, lab_prefix=None, min_capacity=None)
+        others = room_candidates(lab=False, prefix=None, lab_prefix=None, min_capacity=None)
+        cands[code] = []
+        for rank, rooms in enumerate((big, small, others)):
+            for r in rooms:
+                if (code, r) not in tiers:
+                    tiers[(code, r)] = rank
+                    cands[code].append(r)
+    items = [(code, n) for code, n, _p in items]
+    blocks = [(bd, bslots, slots_mask(bslots)) for bd, bslots in blocks]
+    used = []
+    for part in [blocks] + [[b] for b in blocks]:
+        if not items:
+            break
+        allowed = {
+            code: [r for r in cands[code] if all(_basket_room_free(bd, r, m) for bd, _s, m in part)]
+            for code, _n in items
+        }
+        got, certificate = match_rooms(items, allowed, lambda code, r: tiers[(code, r)])
+        for code, room in got.items():
+            for bd, _s, m in part:
+                basket_room_busy.occupy(bd, room, m)
+            rooms_for_course = basket_course_room_map.setdefault((year, basket, code), [])
+            if room not in rooms_for_course:
+                rooms_for_course.append(room)
+            used.append(room)
+        if len(part) > 1:
+            items = [it for it in items if it[0] not in got]
+        elif certificate:
+            courses, rooms = certificate
+            entry = {"day": part[0][0], "slots": list(part[0][1]), "courses": courses, "rooms": rooms}
+            found = basket_room_shortfalls.setdefault((year, basket), [])
+            if entry not in found:
+                found.append(entry)
+    return used
+
 def assign_basket_rooms_for_group(year_tag, basket, course_group):
     if year_tag is None:
         return
@@ -1752,63 +3069,23 @@ def assign_basket_rooms_for_group(year_tag, basket, course_group):
         return
 
     _ensure_basket_room_busy()
-    # Prepare course list with metadata
-    course_items = []
+    # courses an earlier section of the year already booked keep their rooms
+    year = int(year_tag)
+    items, seen = [], set()
     for c in course_group:
         code = s(c.get("Course_Code","")).strip().upper()
-        if not code:
+        if not code or code in seen or basket_course_room_map.get((year, basket, code)):
             continue
+        seen.add(code)
         student_count = to_int_or_none(c.get("total_students"))
         class_prefix = legend_class_prefix(c.get("Departments",""), year_tag)
-        course_items.append((code, student_count, class_prefix))
-
-    rooms_list = []
-    # Assign rooms per block independently (no cross-block coupling)
-    for bd, bslots in blocks:
-        # track rooms used in this block
-        used_rooms = set(basket_room_busy.get(bd, {}).keys())
-        # assign harder courses first (higher student count)
-        sorted_items = sorted(course_items, key=lambda x: (-(x[1] or 0), x[0]))
-        for code, student_count, class_prefix in sorted_items:
-            map_key = (int(year_tag), basket, code)
-            # build candidates for this course
-            candidates = room_candidates(lab=False, prefix=class_prefix, lab_prefix=None, min_capacity=student_count)
-            room = None
-            for cand in candidates:
-                if cand in used_rooms:
-                    continue
-                used = basket_room_busy.get(bd, {}).get(cand, set())
-                if set(bslots) & used:
-                    continue
-                room = cand
-                break
-            if room is None and student_count is not None:
-                candidates = room_candidates(lab=False, prefix=class_prefix, lab_prefix=None, min_capacity=None)
-                for cand in candidates:
-                    if cand in used_rooms:
-                        continue
-                    used = basket_room_busy.get(bd, {}).get(cand, set())
-                    if set(bslots) & used:
-                        continue
-                    room = cand
-                    break
-            if room is None:
-                # no room available for this course in this block
-                continue
-            used_rooms.add(room)
-            basket_room_busy.setdefault(bd, {}).setdefault(room, set()).update(bslots)
-            rooms_list.append(room)
-            # store per-course rooms
-            rooms_for_course = basket_course_room_map.get(map_key, [])
-            if room not in rooms_for_course:
-                rooms_for_course.append(room)
-            basket_course_room_map[map_key] = rooms_for_course
-    # normalize basket room list
-    uniq = []
-    for r in rooms_list:
+        items.append((code, student_count, class_prefix))
+
+    uniq = list(basket_room_list_map.get((year, basket), []))
+    for r in match_basket_blocks(year_tag, basket, items, blocks):
         if r not in uniq:
             uniq.append(r)
-    basket_room_list_map[(int(year_tag), basket)] = uniq
+    basket_room_list_map[(year, basket)] = uniq
 
 def assign_basket_course_room(c):
     if not is_combined_flag(c):
@@ -1850,54 +3127,34 @@ def assign_basket_course_room(c):
     _ensure_basket_room_busy()
     student_count = to_int_or_none(c.get("total_students"))
     class_prefix = legend_class_prefix(c.get("Departments",""), year_tag)
-    candidates = room_candidates(lab=False, prefix=class_prefix, lab_prefix=None, min_capacity=student_count)
-    rooms_for_course = []
-    for bd, bslots in blocks:
-        room = None
-        for cand in candidates:
-            used = basket_room_busy.get(bd, {}).get(cand, set())
-            if set(bslots) & used:
-                continue
-            room = cand
-            break
-        if room is None and student_count is not None:
-            candidates = room_candidates(lab=False, prefix=class_prefix, lab_prefix=None, min_capacity=None)
-            for cand in candidates:
-                used = basket_room_busy.get(bd, {}).get(cand, set())
-                if set(bslots) & used:
-                    continue
-                room = cand
-                break
-        if room is None:
-            rooms_for_course = []
-            break
-        rooms_for_course.append(room)
-        basket_room_busy.setdefault(bd, {}).setdefault(room, set()).update(bslots)
-    if not rooms_for_course:
-        return ""
-    uniq_rooms = []
-    for r in rooms_for_course:
-        if r not in uniq_rooms:
-            uniq_rooms.append(r)
-    basket_course_room_map[map_key] = uniq_rooms
-    return ", ".join(uniq_rooms)
+    match_basket_blocks(year_tag, basket, [(code, student_count, class_prefix)], blocks)
+    return ", ".join(basket_course_room_map.get(map_key, []))
 
 def add_csv_legend_block(ws, course_list, legend_title, half=None, room_map_key=None):
+    rows = legend_rows(course_list, half=half, room_map_key=room_map_key)
+    write_legend_block(ws, legend_title, rows)
+
+def write_legend_block(ws, legend_title, rows):
+    if ws is None:
+        return
     ws.append([])
     ws.append([])
-    ws.append([f"Legend - {legend_title}"])
-
-    title_cell = ws.cell(row=ws.max_row, column=1)
-    title_cell.font = Font(bold=True, size=13)
+    r = ws.append([f"Legend - {legend_title}"])
+    ws.style(r, 1, font="bold13")
 
     headers = ["Course Code","Course Title","L-T-P-S-C","Faculty","Elective?","Combined?","Room(s)"]
-    ws.append(headers)
-
+    r = ws.append(headers)
     for i in range(1,8):
-        c = ws.cell(ws.max_row,i)
-        c.font = Font(bold=True)
-        c.border = thin
+        ws.style(r, i, font="bold", border=True)
+
+    for row in rows:
+        ws.append(row)
+
+    ws.append([])
 
+def legend_rows(course_list, half=None, room_map_key=None):
+    """Legend table rows for one timetable block (also books basket rooms)."""
+    rows = []
     seen = set()
     rmap = legend_room_map.get(room_map_key, {}) if room_map_key is not None else {}
     scheduled_codes = set(rmap.keys())
@@ -1945,7 +3202,7 @@ def add_csv_legend_block(ws, course_list, legend_title, half=None, room_map_key=
             if not room_str and is_combined_flag(c):
                 room_str = "C004"
 
-        ws.append([
+        rows.append([
             code,
             c.get("Course_Title",""),
             c.get("L-T-P-S-C",""),
@@ -1954,8 +3211,7 @@ def add_csv_legend_block(ws, course_list, legend_title, half=None, room_map_key=
             combined_label(c),
             room_str
         ])
-
-    ws.append([])
+    return rows
 
 def _safe_sheet_name(name, used):
     raw = str(name)
@@ -1978,103 +3234,169 @@ def _safe_sheet_name(name, used):
             return cand
         i += 1
 
-def write_faculty_workbook(faculty_map, filename, course_index=None):
-    wb = Workbook()
-    used = set()
-    first = True
-    reset_color_palette()
+def pin_xlsx_timestamps(path):
+    """
+    Rewrite a saved .xlsx with fixed zip entry times and document dates,
+    so the same inputs and seed give byte-identical files.
+    """
+    import zipfile
+    with zipfile.ZipFile(path) as zin:
+        entries = [(info.filename, zin.read(info)) for info in zin.infolist()]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zout:
+        for name, data in entries:
+            if name == "docProps/core.xml":
+                data = re.sub(rb"(<dcterms:(?:created|modified)[^>]*>)[^<]*",
+                              rb"\g<1>2000-01-01T00:00:00Z", data)
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zout.writestr(info, data)
+
+def save_workbook(sheets, filename, empty_title=None):
+    """
+    Write SheetModels to filename through a write-only workbook. Takes only
+    plain data, so it can run in a worker process.
+    """
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    style_cache = {}
+    for model in sheets:
+        write_sheet(wb, model, style_cache)
+    if not sheets:
+        wb.create_sheet(empty_title or "Sheet")
+    wb.save(filename)
+    pin_xlsx_timestamps(filename)
+    return filename
+
+def faculty_sheet(title, fac_map, faculty, course_index, slot_keys):
+    """SheetModel of one faculty's week (fac_map: day -> slot -> entry) plus its course legend."""
+    ws = SheetModel(title)
+    ws.append(["Day"] + slot_keys)
+    for d in days:
+        r = ws.append([d] + [str(fac_map.get(d, {}).get(s_, "")) for s_ in slot_keys])
+        # Color-code courses per cell (same course => same color)
+        for c, val in enumerate(ws.rows[r - 1][1:], 2):
+            code = extract_course_code(val)
+            if not code:
+                continue
+            fill_color = get_color_for_course(code)
+            if fill_color:
+                ws.style(r, c, fill=fill_color)
+
+    # Legend section
+    ws.append([])
+    r = ws.append(["Legend"])
+    ws.style(r, 1, font="bold13")
+    r = ws.append(["Course Code", "Course Title", "Branch"])
+    for i in range(1, 4):
+        ws.style(r, i, font="bold", border=True)
+
+    # Collect only courses actually scheduled for this faculty
+    used_codes = set()
+    for d in days:
+        for s_ in slot_keys:
+            code = extract_course_code(fac_map.get(d, {}).get(s_, ""))
+            if code and code.upper() not in {"MINOR", "MINOR SLOTS"}:
+                used_codes.add(code)
+
+    rows = []
+    for code in sorted(used_codes):
+        entries = course_index.get(code, [])
+        # filter to rows matching this faculty if possible
+        filtered = [e for e in entries if s(e[2]) == s(faculty)]
+        pick = filtered if filtered else entries
+        for title_, dept, _fac in pick:
+            rows.append((code, title_, dept))
+
+    for code, title_, dept in sorted(set(rows), key=lambda x: (x[0], x[1], x[2])):
+        ws.append([code, title_, dept])
+    return ws
+
+def write_faculty_workbook(faculty_map, filename, course_index=None, slot_keys=None):
+    """One sheet per faculty (faculty_map: faculty -> day -> slot -> entry)."""
     if course_index is None:
         course_index = {}
-    for faculty in sorted(faculty_map.keys()):
-        short_faculty = shorten_faculty_name(faculty)
-        sheet_name = _safe_sheet_name(short_faculty, used)
-        if first:
-            ws = wb.active
-            ws.title = sheet_name
-            first = False
-        else:
-            ws = wb.create_sheet(sheet_name)
-
-        ws.append(["Day"] + slot_keys)
-        for d in days:
-            row = [d]
-            for s_ in slot_keys:
-                cell_val = faculty_map.get(faculty, {}).get(d, {}).get(s_, "")
-                row.append(cell_val)
-            ws.append(row)
+    if slot_keys is None:
+        slot_keys = DATA.slot_keys
+    used = set()
+    reset_color_palette()
+    sheets = [faculty_sheet(_safe_sheet_name(shorten_faculty_name(faculty), used),
+                            faculty_map.get(faculty, {}), faculty, course_index, slot_keys)
+              for faculty in sorted(faculty_map.keys())]
+    return save_workbook(sheets, filename, empty_title="No Faculty")
 
-        # Color-code courses per cell (same course => same color)
-        for r in range(2, ws.max_row + 1):
-            for c in range(2, ws.max_column + 1):
-                cell = ws.cell(r, c)
-                code = extract_course_code(cell.value)
-                if not code:
-                    continue
-                fill_color = get_color_for_course(code)
-                if fill_color:
-                    cell.fill = PatternFill(
-                        start_color=fill_color,
-                        end_color=fill_color,
-                        fill_type="solid"
-                    )
+def write_faculty_file(faculty, halves, filename, course_index, slot_keys):
+    """One faculty's own workbook: a sheet per semester half."""
+    reset_color_palette()
+    sheets = [faculty_sheet(HALF_NAMES[half], halves.get(half, {}), faculty, course_index, slot_keys)
+              for half in (1, 2)]
+    return save_workbook(sheets, filename)
 
-        # Legend section
-        ws.append([])
-        ws.append(["Legend"])
-        legend_title = ws.cell(row=ws.max_row, column=1)
-        legend_title.font = Font(bold=True, size=13)
-        ws.append(["Course Code", "Course Title", "Branch"])
-        for i in range(1, 4):
-            c = ws.cell(ws.max_row, i)
-            c.font = Font(bold=True)
-            c.border = thin
-
-        # Collect only courses actually scheduled for this faculty
-        used_codes = set()
-        for d in days:
-            for s_ in slot_keys:
-                val = faculty_map.get(faculty, {}).get(d, {}).get(s_, "")
-                code = extract_course_code(val)
-                if code and code.upper() not in {"MINOR", "MINOR SLOTS"}:
-                    used_codes.add(code)
-
-        rows = []
-        for code in sorted(used_codes):
-            entries = course_index.get(code, [])
-            # filter to rows matching this faculty if possible
-            filtered = [e for e in entries if s(e[2]) == s(faculty)]
-            pick = filtered if filtered else entries
-            for title, dept, _fac in pick:
-                rows.append((code, title, dept))
-
-        for code, title, dept in sorted(set(rows), key=lambda x: (x[0], x[1], x[2])):
-            ws.append([code, title, dept])
-    if first:
-        wb.active.title = "No Faculty"
-    wb.save(filename)
+def faculty_export_tasks(faculty_tt, course_index, slot_keys, faculty_dir=None):
+    """
+    (function, args) pairs writing the two faculty workbooks and, with
+    faculty_dir, one file per faculty. Run them with run_exports().
+    """
+    tasks = [
+        (write_faculty_workbook, (faculty_tt.get(1, {}), "Faculty_Timetable_First_Half.xlsx",
+                                  course_index, slot_keys)),
+        (write_faculty_workbook, (faculty_tt.get(2, {}), "Faculty_Timetable_Second_Half.xlsx",
+                                  course_index, slot_keys)),
+    ]
+    if faculty_dir:
+        os.makedirs(faculty_dir, exist_ok=True)
+        used = set()
+        for faculty in sorted(set(faculty_tt.get(1, {})) | set(faculty_tt.get(2, {}))):
+            name = _safe_sheet_name(shorten_faculty_name(faculty), used)
+            halves = {half: faculty_tt.get(half, {}).get(faculty, {}) for half in (1, 2)}
+            tasks.append((write_faculty_file, (faculty, halves, os.path.join(faculty_dir, f"{name}.xlsx"),
+                                               course_index, slot_keys)))
+    return tasks
+
+def run_exports(tasks, jobs=None):
+    """Run (function, args) export tasks, in parallel worker processes when jobs > 1."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(tasks)))
+    if jobs == 1:
+        return [fn(*args) for fn, args in tasks]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        futures = [ex.submit(fn, *args) for fn, args in tasks]
+        return [f.result() for f in futures]
+
+def write_group_block(ws, label, tt, display_slot_keys):
+    ws.append([""])
+    r = ws.append([label])
+    ws.style(r, 1, font="bold12")
+    ws.append(["Day"] + display_slot_keys)
+    for d in days:
+        ws.append([d] + [str(v) for v in tt.row(d, display_slot_keys)])
+    ws.append([""])
 
-def generate(courses, ws, label, seed, elective_sync,
+def generate(courses, ws, label, rng, elective_sync,
              room_prefix=None, elective_room_map=None,
              room_busy_global=None, hide_c004=False,
              year_tag=None, combined_sync=None,semester_half=None,
              basket_used_global=None, faculty_tt=None,
              full_sem_sync=None,
              faculty_busy_global=None,
-             display_slot_keys=None):
+             display_slot_keys=None,
+             engine="greedy", quality=None):
+    # rng: the random.Random of this call (run_generators()); all randomness
+    # of a group comes from it, so a seed reproduces the same timetable
+    # regardless of what else ran before.
+    # quality: quality_settings() of the run; its annealing pass is optional
     if elective_room_map is None:
         elective_room_map = {}
     if valid(courses): return []
     
-    ws.append([""]); ws.append([label])
-    ws.cell(row=ws.max_row, column=1).font = Font(bold=True, size=12)
+    tt = TimetableGrid()
+    busy = OccupancyIndex()
     
-    tt = pd.DataFrame("", index=days, columns=slot_keys)
-    busy = {d:{} for d in days}
-    
-    if room_busy_global is not None:
-        room_busy = room_busy_global
-    else:
-        room_busy = {d:{} for d in days}
+    # room layers per semester half; full-semester courses book both halves
+    room_layers = room_busy_global if room_busy_global is not None else new_room_layers()
+    room_busy = RoomLayerView(room_layers, semester_half if semester_half in (1, 2) else 0)
+    full_room_busy = RoomLayerView(room_layers, 0)
 
     rm = {}
     labsd = set()
@@ -2134,8 +3456,8 @@ def generate(courses, ws, label, seed, elective_sync,
         code = s(c.get("Course_Code",""))
         rm[(code,"L")] = "C004"; rm[(code,"T")] = "C004"; rm[(code,"P")] = "C004"
 
-    # Track hours successfully pre-placed for full-semester courses
-    preplaced_hours = {}
+    # Track minutes successfully pre-placed for full-semester courses
+    preplaced_minutes = {}
 
     # Pre-place full-semester courses for second half using first-half slots
     if semester_half == 2 and full_sem_sync is not None and year_tag is not None:
@@ -2152,10 +3474,12 @@ def generate(courses, ws, label, seed, elective_sync,
             basket_key = f"B{basket}" if (is_elec_flag and basket and basket != "0") else None
             fs_key = full_sem_key(c, year_tag)
             sync_for_course = full_sem_sync.get(fs_key, {})
+            held = sync_for_course.get("rooms", {})
             for typ in ("L", "T", "P"):
-                for sync_day, sync_slots in sync_for_course.get(typ, []):
+                runs = sync_for_course.get(typ, [])
+                for (sync_day, sync_slots), held_room in zip(runs, held.get(typ, [None] * len(runs))):
                     ok = alloc_specific(
-                        tt, busy, rm, room_busy,
+                        tt, busy, rm, full_room_busy,
                         sync_day, sync_slots,
                         f,
                         code, typ, is_elec_flag, labsd, course_usage,
@@ -2169,13 +3493,39 @@ def generate(courses, ws, label, seed, elective_sync,
                         semester_half=semester_half,
                         faculty_busy_global=faculty_busy_global,
                         skip_usage_check=True,
-                        student_count=student_count
+                        student_count=student_count,
+                        held_room=held_room
                     )
                     if ok:
-                        preplaced_hours.setdefault(fs_key, {}).setdefault(typ, 0.0)
-                        preplaced_hours[fs_key][typ] += sum(slot_dur[s] for s in sync_slots)
-
-    def place_course_list(course_list, start_idx_ref):
+                        preplaced_minutes.setdefault(fs_key, {}).setdefault(typ, 0)
+                        preplaced_minutes[fs_key][typ] += sum(DATA.slot_minutes[s] for s in sync_slots)
+
+    def note_elective_sync(code, sync_name, a, undo):
+        """Publish where an elective went, so other sections mirror it."""
+        code_u = str(code).strip().upper()
+        if code_u.startswith("ELECTIVE BASKET") or code_u == "ELECTIVE":
+            undo.setitem(elective_sync, sync_name, collect_code_slot_blocks(tt, code))
+        elif sync_name not in elective_sync:
+            for dcheck in days:
+                slots_used = tt.course_slots(code_u, dcheck)
+                if slots_used:
+                    accum = []; acc_dur = 0
+                    for s_ in slots_used:
+                        accum.append(s_); acc_dur += DATA.slot_minutes[s_]
+                        if acc_dur >= a:
+                            undo.setitem(elective_sync, sync_name, {"day": dcheck, "slots": accum.copy()})
+                            break
+                    if sync_name in elective_sync: break
+
+    def place_course_list(course_list, start_idx_ref, undo=None):
+        # Each course is one transaction: if any of its L/T/P hours cannot
+        # be placed, everything it booked is rolled back and it is left out
+        # of the placed list (so it is reported as unscheduled). With undo
+        # given, the kept courses stay in that log so the caller can take
+        # the whole run back.
+        keep_log = undo is not None
+        if undo is None:
+            undo = UndoLog()
         placed_list = []
         for c in course_list:
             f = s(c.get("Faculty",""))
@@ -2186,28 +3536,32 @@ def generate(courses, ws, label, seed, elective_sync,
             student_count = to_int_or_none(c.get("total_students"))
             L, T, P, S, Cc = ltp(c.get("L-T-P-S-C","0-0-0-0-0"))
             is_full_sem = s(c.get("Semester_Half","")) == "0"
+            rooms = full_room_busy if is_full_sem else room_busy
             fs_key = full_sem_key(c, year_tag)
             typ_counts = {"L":0,"T":0,"P":0}
+            mark = undo.checkpoint()
+            complete = True
             # Track lecture split mode for exact 2.0 hours (priority order handled by attempts)
             if "_L2_mode" not in c:
                 c["_L2_mode"] = "1.5+0.5"
 
-            for h, typ in [(L,"L"), (T,"T"), (P,"P")]:
-                # If full-sem course was pre-placed, reduce remaining hours
+            # h (remaining) and a (block to place) are in minutes
+            for h, typ in [(L * 60, "L"), (T * 60, "T"), (P * 60, "P")]:
+                # If full-sem course was pre-placed, reduce remaining time
                 if is_full_sem and semester_half == 2 and full_sem_sync is not None:
-                    pre_h = preplaced_hours.get(fs_key, {}).get(typ, 0.0)
-                    h = max(0.0, h - pre_h)
-                    if h <= 1e-9:
+                    pre_m = preplaced_minutes.get(fs_key, {}).get(typ, 0)
+                    h = max(0, h - pre_m)
+                    if h <= 0:
                         continue
                 attempts = 0
                 no_progress = 0
-                while h > 1e-9 and attempts < 60 and no_progress < 8:
+                while h > 0 and attempts < 60 and no_progress < 8:
                     # Enforce strict durations per type:
                     # - Lecture (L) => L=2 uses priority order: 1.5+0.5, 1+1, 1+0.5+0.5, 0.5x4, 2.0
                     # - Tutorial (T) => always 1.0 hour
                     # - Practical/Lab (P) => prefer 2.0, else 1.5, else 1.0 (only if remaining h is smaller)
                     if typ == "L":
-                        if abs(h - 2.0) < 1e-9:
+                        if h == 120:
                             # Advance to next split mode only if earlier modes failed repeatedly
                             if attempts == 10:
                                 c["_L2_mode"] = "1+1"
@@ -2220,41 +3574,41 @@ def generate(courses, ws, label, seed, elective_sync,
 
                             mode = c.get("_L2_mode", "1.5+0.5")
                             if mode == "1.5+0.5":
-                                a = 1.5 if h >= 1.5 - 1e-9 else 0.5
+                                a = 90 if h >= 90 else 30
                             elif mode == "1+1":
-                                a = 1.0
+                                a = 60
                             elif mode == "1+0.5+0.5":
-                                a = 1.0 if h >= 1.0 - 1e-9 else 0.5
+                                a = 60 if h >= 60 else 30
                             elif mode == "0.5x4":
-                                a = 0.5
+                                a = 30
                             else:
-                                a = 2.0
-                        elif abs(h - 1.0) < 1e-9:
-                            a = 1.0
-                        elif h >= 1.5 - 1e-9:
-                            a = 1.5
-                        elif h >= 1.0 - 1e-9:
-                            a = 1.0
+                                a = 120
+                        elif h == 60:
+                            a = 60
+                        elif h >= 90:
+                            a = 90
+                        elif h >= 60:
+                            a = 60
                         else:
-                            a = 0.5
+                            a = 30
                     elif typ == "T":
-                        a = 1.0
+                        a = 60
                     elif typ == "P":
-                        # For labs prefer 2.0 blocks; if remaining hours < 2, allow smaller lab chunk
-                        if h >= 2.0 - 1e-9:
-                            a = 2.0
-                        elif h >= 1.5 - 1e-9:
-                            a = 1.5
+                        # For labs prefer 2h blocks; if less than 2h remains, allow a smaller lab chunk
+                        if h >= 120:
+                            a = 120
+                        elif h >= 90:
+                            a = 90
                         else:
-                            a = 1.0
+                            a = 60
                     else:
-                        a = 1.0
+                        a = 60
                     placed = False
                     sync_name = c.get("_sync_name", None)
 
                     if is_elec_flag and sync_name and sync_name in elective_room_map:
                         for ttkey in [("L"), ("T"), ("P")]:
-                            rm[(code, ttkey)] = elective_room_map[sync_name]
+                            undo.setitem(rm, (code, ttkey), elective_room_map[sync_name])
 
                     if sync_name and sync_name in elective_sync:
                         pref = elective_sync[sync_name]
@@ -2263,7 +3617,7 @@ def generate(courses, ws, label, seed, elective_sync,
                             any_ok = False
                             for pd, pslots in pref:
                                 ok = alloc_specific(
-                                    tt, busy, rm, room_busy,
+                                    tt, busy, rm, rooms,
                                     pd, pslots,
                                     f, code, typ, is_elec_flag, labsd, course_usage,
                                     class_prefix=room_prefix,
@@ -2276,14 +3630,15 @@ def generate(courses, ws, label, seed, elective_sync,
                                     semester_half=semester_half,
                                     faculty_busy_global=faculty_busy_global,
                                     student_count=student_count,
-                                    skip_usage_check=True
+                                    skip_usage_check=True,
+                                    undo=undo
                                 )
                                 if ok:
                                     any_ok = True
-                                    h -= sum(slot_dur[s] for s in pslots)
+                                    h -= sum(DATA.slot_minutes[s] for s in pslots)
                             placed = any_ok
                         else:
-                            if alloc(tt, busy, rm, room_busy, pref["day"], f, code, a, typ, is_elec_flag, labsd, False, preferred_slots=(pref["day"], pref["slots"]), course_usage=course_usage, class_prefix=room_prefix, rr_state=None,hide_c004=hide_c004,year_tag=year_tag, basket_used=basket_used_global, basket_key=basket_key, faculty_tt=faculty_tt, semester_half=semester_half, faculty_busy_global=faculty_busy_global, student_count=student_count, allow_extra_same_day=(typ == "L" and a <= 1.0 + 1e-9)):
+                            if alloc(tt, busy, rm, rooms, pref["day"], f, code, a, typ, is_elec_flag, labsd, False, preferred_slots=(pref["day"], pref["slots"]), course_usage=course_usage, class_prefix=room_prefix, rr_state=None,hide_c004=hide_c004,year_tag=year_tag, basket_used=basket_used_global, basket_key=basket_key, faculty_tt=faculty_tt, semester_half=semester_half, faculty_busy_global=faculty_busy_global, student_count=student_count, allow_extra_same_day=(typ == "L" and a <= 60), undo=undo):
                                 h -= a; placed = True
 
                     if not placed:
@@ -2295,7 +3650,7 @@ def generate(courses, ws, label, seed, elective_sync,
                                 d_order = days[start_idx:] + days[:start_idx]
                                 start_idx_ref[0] = (start_idx_ref[0] + 1) % len(days)
                             for d in d_order:
-                                if alloc(tt, busy, rm, room_busy, d, f, code, a, typ, is_elec_flag, labsd, False, course_usage=course_usage, class_prefix=room_prefix, rr_state=None,hide_c004=hide_c004,year_tag=year_tag, basket_used=basket_used_global, basket_key=basket_key, faculty_tt=faculty_tt, semester_half=semester_half, faculty_busy_global=faculty_busy_global, student_count=student_count, allow_extra_same_day=(typ == "L" and a <= 1.0 + 1e-9)):
+                                if alloc(tt, busy, rm, rooms, d, f, code, a, typ, is_elec_flag, labsd, False, course_usage=course_usage, class_prefix=room_prefix, rr_state=None,hide_c004=hide_c004,year_tag=year_tag, basket_used=basket_used_global, basket_key=basket_key, faculty_tt=faculty_tt, semester_half=semester_half, faculty_busy_global=faculty_busy_global, student_count=student_count, allow_extra_same_day=(typ == "L" and a <= 60), undo=undo):
                                     h -= a; placed = True
                                     typ_counts[typ] = typ_counts.get(typ, 0) + 1
                                     break
@@ -2303,7 +3658,7 @@ def generate(courses, ws, label, seed, elective_sync,
                                 break
                     if not placed:
                         for d in days:
-                            if alloc(tt, busy, rm, room_busy, d, f, code, a, typ, is_elec_flag, labsd, True, course_usage=course_usage, class_prefix=room_prefix, rr_state=None,hide_c004=hide_c004,year_tag=year_tag, basket_used=basket_used_global, basket_key=basket_key, faculty_tt=faculty_tt, semester_half=semester_half, faculty_busy_global=faculty_busy_global, student_count=student_count, allow_extra_same_day=(typ == "L" and a <= 1.0 + 1e-9)):
+                            if alloc(tt, busy, rm, rooms, d, f, code, a, typ, is_elec_flag, labsd, True, course_usage=course_usage, class_prefix=room_prefix, rr_state=None,hide_c004=hide_c004,year_tag=year_tag, basket_used=basket_used_global, basket_key=basket_key, faculty_tt=faculty_tt, semester_half=semester_half, faculty_busy_global=faculty_busy_global, student_count=student_count, allow_extra_same_day=(typ == "L" and a <= 60), undo=undo):
                                 h -= a; placed = True
                                 typ_counts[typ] = typ_counts.get(typ, 0) + 1
                                 break
@@ -2313,29 +3668,448 @@ def generate(courses, ws, label, seed, elective_sync,
                     else:
                         no_progress += 1
                     if placed and sync_name:
-                        code_u = str(code).strip().upper()
-                        if code_u.startswith("ELECTIVE BASKET") or code_u == "ELECTIVE":
-                            elective_sync[sync_name] = collect_code_slot_blocks(tt, code)
-                        elif sync_name not in elective_sync:
-                            for dcheck in days:
-                                slots_used = [s_ for s_ in slot_keys if tt.at[dcheck, s_].startswith(code)]
-                                if slots_used:
-                                    accum = []; acc_dur = 0.0
-                                    for s_ in slots_used:
-                                        accum.append(s_); acc_dur += slot_dur[s_]
-                                        if acc_dur + 1e-9 >= a:
-                                            elective_sync[sync_name] = {"day": dcheck, "slots": accum.copy()}
-                                            break
-                                    if sync_name in elective_sync: break
+                        note_elective_sync(code, sync_name, a, undo)
 
                     attempts += 1
-            placed_list.append(c)
+                if h > 0:
+                    complete = False
+                    break
+            if complete:
+                if not keep_log:
+                    undo.commit(mark)
+                placed_list.append(c)
+            else:
+                undo.rollback(mark)
         return placed_list
 
-    start_idx_ref = [seed % len(days)]
+    def course_chunks(c, start_idx_ref):
+        """The blocks (chunks) of c the backtracking search places, as dicts."""
+        code = s(c.get("Course_Code","UNKNOWN"))
+        is_elec_flag = (code.startswith("Elective") or s(c.get("Elective","")) == "1")
+        basket = s(c.get("ElectiveBasket","0"))
+        is_full_sem = s(c.get("Semester_Half","")) == "0"
+        if is_elec_flag:
+            day_order = days[:]
+        else:
+            start_idx = start_idx_ref[0]
+            day_order = days[start_idx:] + days[:start_idx]
+            start_idx_ref[0] = (start_idx + 1) % len(days)
+        f = s(c.get("Faculty",""))
+        L, T, P, S, Cc = ltp(c.get("L-T-P-S-C","0-0-0-0-0"))
+        chunks = []
+        for h, typ in [(L * 60, "L"), (T * 60, "T"), (P * 60, "P")]:
+            if is_full_sem and semester_half == 2 and full_sem_sync is not None:
+                h -= preplaced_minutes.get(full_sem_key(c, year_tag), {}).get(typ, 0)
+            for a in component_blocks(typ, h):
+                chunks.append({
+                    "course": c, "code": code, "typ": typ, "a": a, "f": f,
+                    "facs": split_faculty_names(f) if f else [],
+                    "elec": is_elec_flag,
+                    "basket_num": _basket_code_parts(code) if is_elec_flag else None,
+                    "basket_key": f"B{basket}" if (is_elec_flag and basket and basket != "0") else None,
+                    "student_count": to_int_or_none(c.get("total_students")),
+                    "rooms": full_room_busy if is_full_sem else room_busy,
+                    "days": day_order,
+                })
+        return chunks
+
+    def room_masks(ch, d):
+        """Busy masks on d of the rooms ch could take; None if it needs no room."""
+        if ch["basket_num"]:
+            return None
+        key = (ch["code"], ch["typ"])
+        if not ch["elec"] and key in rm:
+            r = rm[key]
+            return None if r == "C004" else [ch["rooms"].mask(d, r)]
+        if "cands" not in ch:
+            lab = ch["typ"] == "P"
+            prefix = None if lab else room_prefix
+            lab_pref = lab_prefix_for_class_prefix.get(room_prefix, None) if lab else None
+            # alloc_specific() falls back to rooms of any capacity
+            ch["cands"] = room_candidates(lab=lab, prefix=prefix, lab_prefix=lab_pref, min_capacity=None)
+        masks = set()
+        for r in ch["cands"]:
+            m = ch["rooms"].mask(d, r)
+            if not m:
+                return None   # a room free all day fits every window
+            masks.add(m)
+        return list(masks)
+
+    window_lists = {}
+    def windows_of(a):
+        # plain windows first, then those that also use excluded slots
+        if a not in window_lists:
+            plain = list(tt.windows.windows(a, False))
+            seen = set(plain)
+            window_lists[a] = plain + [w for w in tt.windows.windows(a, True) if w not in seen]
+        return window_lists[a]
+
+    def chunk_windows(ch, d, among=None):
+        usage = course_usage[d].get(ch["code"])
+        if usage:
+            if ch["typ"] == "P":
+                if usage["P"] >= 1 and not ch["elec"]:
+                    return []
+            elif usage["L"] + usage["T"] >= 1 and not (ch["typ"] == "L" and ch["a"] <= 60):
+                return []
+        blocked = tt.occ[tt.day_idx[d]] | tt.hard_mask
+        for fac in ch["facs"]:
+            blocked |= busy.mask(d, fac)
+            if faculty_busy_global is not None:
+                blocked |= faculty_busy_global.mask(d, fac)
+        rooms = room_masks(ch, d)
+        check_basket = (ch["elec"] and basket_used_global is not None and ch["basket_key"]
+                        and year_tag is not None)
+        found = []
+        for slots, mask in (windows_of(ch["a"]) if among is None else among):
+            if mask & blocked:
+                continue
+            if check_basket and basket_clash(basket_used_global, ch["basket_key"], year_tag, d, mask):
+                continue
+            if rooms is None or any(not (m & mask) for m in rooms):
+                found.append((slots, mask))
+        return found
+
+    def place_chunk(ch, d, slots, undo):
+        return alloc_specific(
+            tt, busy, rm, ch["rooms"], d, list(slots), ch["f"], ch["code"], ch["typ"], ch["elec"],
+            labsd, course_usage, class_prefix=room_prefix, rr_state=None, hide_c004=hide_c004,
+            year_tag=year_tag, basket_used=basket_used_global, basket_key=ch["basket_key"],
+            faculty_tt=faculty_tt, semester_half=semester_half,
+            faculty_busy_global=faculty_busy_global, student_count=ch["student_count"],
+            allow_extra_same_day=(ch["typ"] == "L" and ch["a"] <= 60), undo=undo)
+
+    def chunk_search(chunks, live, undo, budget):
+        return BacktrackSearch(
+            live, lambda k, d, among=None: chunk_windows(chunks[k], d, among),
+            lambda k, d, slots: place_chunk(chunks[k], d, slots, undo),
+            lambda k: chunks[k]["days"], undo, budget)
+
+    def place_course_list_backtrack(course_list, start_idx_ref):
+        # The "backtrack" engine. Courses that mirror a synced elective keep
+        # the greedy path; the others are split into blocks (chunks) that a
+        # BacktrackSearch places together, most constrained first. A chunk
+        # that runs out of windows drops its course and the search restarts
+        # without it; dropped courses get one greedy try at the end.
+        pinned = [c for c in course_list if c.get("_sync_name") in elective_sync]
+        placed_ids = {id(c) for c in place_course_list(pinned, start_idx_ref)}
+        searched = [c for c in course_list if c.get("_sync_name") not in elective_sync]
+        chunks = []
+        for c in searched:
+            chunks.extend(course_chunks(c, start_idx_ref))
+
+        undo = UndoLog()
+        mark = undo.checkpoint()
+        dropped = set()
+        budget = BACKTRACK_BUDGET
+        while True:
+            live = [k for k, ch in enumerate(chunks) if id(ch["course"]) not in dropped]
+            search = chunk_search(chunks, live, undo, budget)
+            culprit = search.run()
+            budget = search.budget
+            if culprit is None:
+                break
+            undo.rollback(mark)
+            dropped.add(id(chunks[culprit]["course"]))
+        for ch in chunks:
+            c = ch["course"]
+            if id(c) not in dropped and id(c) not in placed_ids:
+                placed_ids.add(id(c))
+                if c.get("_sync_name"):
+                    note_elective_sync(ch["code"], c["_sync_name"], ch["a"], undo)
+        # courses without any hours to place count as placed, as in the greedy engine
+        placed_ids.update(id(c) for c in searched if id(c) not in dropped)
+        retry = [c for c in course_list if id(c) in dropped]
+        placed_ids.update(id(c) for c in place_course_list(retry, start_idx_ref))
+        return [c for c in course_list if id(c) in placed_ids]
+
+    def place_course_list_cpsat(course_list, start_idx_ref):
+        # The "cpsat" engine. As in the backtrack engine, courses that mirror
+        # a synced elective keep the greedy path and the others are split
+        # into chunks. Each chunk gets a 0/1 variable per window it can take
+        # now (chunk_windows() already leaves out windows clashing with other
+        # groups' faculty, rooms and basket slots), and a course is placed
+        # with all its chunks or not at all. The model maximizes the courses
+        # placed. A greedy run, rolled back, gives the solver its first
+        # solution as hints. Courses the solver leaves out, or whose
+        # solution does not book after all, get one greedy try at the end.
+        from ortools.sat.python import cp_model
+        pinned = [c for c in course_list if c.get("_sync_name") in elective_sync]
+        placed_ids = {id(c) for c in place_course_list(pinned, start_idx_ref)}
+        searched = [c for c in course_list if c.get("_sync_name") not in elective_sync]
+        chunks = []
+        for c in searched:
+            chunks.extend(course_chunks(c, start_idx_ref))
+
+        # the greedy run also advances each course's lecture split
+        # (c["_L2_mode"]), which the undo log does not journal
+        modes = [(c, c.get("_L2_mode")) for c in searched]
+        warm = UndoLog()
+        greedy_ids = {id(c) for c in place_course_list(searched, [start_idx_ref[0]], undo=warm)}
+        hint_runs, hint_rooms = set(), {}
+        for c in searched:
+            if id(c) not in greedy_ids:
+                continue
+            code = s(c.get("Course_Code","UNKNOWN"))
+            for d, slots, typ in tt.course_runs(code.strip().upper(), by_typ=True):
+                hint_runs.add((code, typ, d, tuple(slots)))
+            for typ in ("L", "T", "P"):
+                if (code, typ) in rm:
+                    hint_rooms[(code, typ)] = rm[(code, typ)]
+        warm.rollback(0)
+        for c, mode in modes:
+            if mode is None:
+                c.pop("_L2_mode", None)
+            else:
+                c["_L2_mode"] = mode
+
+        model = cp_model.CpModel()
+        use = {id(c): model.NewBoolVar("") for c in searched}
+        for c in searched:
+            model.AddHint(use[id(c)], id(c) in greedy_ids)
+        room_of = {}     # (code, typ) -> {room: var} when the model picks the room
+        x = {}           # chunk -> [(var, day, slots)]
+        cover = {}       # (day, slot bit) -> vars of windows using it
+        per_day = {}     # (course, day, "P" / "LT" / "LT-long") -> vars
+        penalty = []
+        for k, ch in enumerate(chunks):
+            cid, key = id(ch["course"]), (ch["code"], ch["typ"])
+            if not ch["elec"] and not ch["basket_num"] and key not in rm and key not in room_of:
+                lab = ch["typ"] == "P"
+                prefix = None if lab else room_prefix
+                lab_pref = lab_prefix_for_class_prefix.get(room_prefix, None) if lab else None
+                cands = (room_candidates(lab=lab, prefix=prefix, lab_prefix=lab_pref, min_capacity=ch["student_count"])
+                         or room_candidates(lab=lab, prefix=prefix, lab_prefix=lab_pref, min_capacity=None))
+                room_of[key] = {r: model.NewBoolVar("") for r in cands}
+                model.Add(sum(room_of[key].values()) == use[cid])
+                for r, z in room_of[key].items():
+                    model.AddHint(z, hint_rooms.get(key) == r)
+            if ch["typ"] == "P":
+                kinds = [] if ch["elec"] else ["P"]
+            else:
+                kinds = ["LT"] if ch["typ"] == "L" and ch["a"] <= 60 else ["LT", "LT-long"]
+            x[k] = []
+            for d in days:
+                for slots, mask in chunk_windows(ch, d):
+                    free = None
+                    if key in room_of:
+                        free = [z for r, z in room_of[key].items() if not ch["rooms"].mask(d, r) & mask]
+                        if not free:
+                            continue
+                    v = model.NewBoolVar("")
+                    if free is not None:
+                        model.AddBoolOr(free).OnlyEnforceIf(v)
+                    model.AddHint(v, (ch["code"], ch["typ"], d, tuple(slots)) in hint_runs)
+                    x[k].append((v, d, slots))
+                    m = mask
+                    while m:
+                        bit = m & -m
+                        cover.setdefault((d, bit), []).append(v)
+                        m ^= bit
+                    for kind in kinds:
+                        per_day.setdefault((cid, d, kind), []).append(v)
+                    if mask & tt.forbidden_mask:
+                        penalty.append(v)
+            model.Add(sum(v for v, _d, _s in x[k]) == use[cid])
+        for vs in cover.values():
+            model.AddAtMostOne(vs)
+        for (_cid, _d, kind), vs in per_day.items():
+            # like alloc_specific(): one lab a day, one L/T a day plus a short lecture
+            model.Add(sum(vs) <= (2 if kind == "LT" else 1))
+        model.Maximize(1000 * sum(use.values()) - sum(penalty))
+
+        solver = cp_model.CpSolver()
+        # a deterministic limit, so a solve cut short by it still gives
+        # the same result for a seed whatever the machine load
+        solver.parameters.max_deterministic_time = CPSAT_TIME_LIMIT
+        solver.parameters.num_workers = 1
+        solved = solver.Solve(model) in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+
+        undo = UndoLog()
+        dropped = set()
+        for c in searched:
+            if not (solved and solver.Value(use[id(c)])):
+                dropped.add(id(c))
+                continue
+            mark = undo.checkpoint()
+            # long blocks first: a short lecture may join them on a day, not the other way round
+            mine = sorted((k for k, ch in enumerate(chunks) if ch["course"] is c),
+                          key=lambda k: chunks[k]["typ"] == "L" and chunks[k]["a"] <= 60)
+            for k in mine:
+                ch = chunks[k]
+                key = (ch["code"], ch["typ"])
+                if key in room_of and key not in rm:
+                    undo.setitem(rm, key, next(r for r, z in room_of[key].items() if solver.Value(z)))
+                v, d, slots = next(w for w in x[k] if solver.Value(w[0]))
+                if not place_chunk(ch, d, slots, undo):
+                    undo.rollback(mark)
+                    dropped.add(id(c))
+                    break
+            else:
+                placed_ids.add(id(c))
+                for k in mine:
+                    if c.get("_sync_name"):
+                        note_elective_sync(chunks[k]["code"], c["_sync_name"], chunks[k]["a"], undo)
+        retry = [c for c in course_list if id(c) in dropped]
+        placed_ids.update(id(c) for c in place_course_list(retry, start_idx_ref))
+        return [c for c in course_list if id(c) in placed_ids]
+
+    def unplace_course(c, undo):
+        """Clear every cell of course c and release what it booked, through undo."""
+        code = s(c.get("Course_Code",""))
+        rooms = full_room_busy if s(c.get("Semester_Half","")) == "0" else room_busy
+        for d in days:
+            for s_ in tt.course_slots(code.strip().upper(), d):
+                v = tt.get(d, s_)
+                if not isinstance(v, Placement) or v.code != code:
+                    continue
+                m = tt.slot_bit[s_]
+                undo.set_cell(tt, d, s_, "")
+                for fac in v.faculty:
+                    undo.release(busy, d, fac, m)
+                    if faculty_busy_global is not None:
+                        undo.release(faculty_busy_global, d, fac, m)
+                    if faculty_tt is not None and semester_half in (1, 2):
+                        undo.delitem(faculty_tt.get(semester_half, {}).get(fac, {}).get(d, {}), s_)
+                for r in v.rooms:
+                    undo.release(rooms.own, d, r, m)
+            if code in course_usage[d]:
+                undo.setitem(course_usage[d], code, {"L":0,"T":0,"P":0})
+        for typ in ("L", "T", "P"):
+            undo.delitem(rm, (code, typ))
+
+    def reroute_unscheduled(course_list, placed_list, start_idx_ref):
+        # Rip-up and reroute: for each course the engine left out, unplace
+        # a few placed courses that block it (shared faculty, the rooms it
+        # holds in rm or could take, or the busiest courses of one day),
+        # re-solve them together with a BacktrackSearch, and keep the
+        # result only if every one of them fits.
+        # Second-half runs of full-semester courses mirror the first half
+        # and stay where they are.
+        placed_ids = {id(c) for c in placed_list}
+        movable = [c for c in placed_list if c.get("_sync_name") not in elective_sync
+                   and not (semester_half == 2 and s(c.get("Semester_Half","")) == "0")]
+        undo = UndoLog()
+        for c in course_list:
+            if id(c) in placed_ids:
+                continue
+            facs = set(split_faculty_names(s(c.get("Faculty",""))))
+            sharing = [o for o in movable if facs & set(split_faculty_names(s(o.get("Faculty",""))))]
+            neighbourhoods = [sharing[:REROUTE_NEIGHBOURHOOD]] if sharing else []
+            code = s(c.get("Course_Code",""))
+            rooms = {rm[(code, typ)] for typ in ("L", "T", "P") if (code, typ) in rm} - {"C004"}
+            if not rooms:
+                count = to_int_or_none(c.get("total_students"))
+                L, T, P, S, Cc = ltp(c.get("L-T-P-S-C","0-0-0-0-0"))
+                if L or T:
+                    rooms.update(room_candidates(prefix=room_prefix, min_capacity=count)
+                                 or room_candidates(prefix=room_prefix))
+                if P:
+                    lab_pref = lab_prefix_for_class_prefix.get(room_prefix, None)
+                    rooms.update(room_candidates(lab=True, lab_prefix=lab_pref, min_capacity=count)
+                                 or room_candidates(lab=True, lab_prefix=lab_pref))
+            holding = []
+            for i, o in enumerate(movable):
+                counts = tt.code_values.get(s(o.get("Course_Code","")).upper(), {})
+                n = sum(k for vid, k in counts.items()
+                        if isinstance(tt.values[vid], Placement) and rooms & set(tt.values[vid].rooms))
+                if n:
+                    holding.append((-n, i))
+            if holding:
+                neighbourhoods.append([movable[i] for _n, i in sorted(holding)[:REROUTE_NEIGHBOURHOOD]])
+            for d in days:
+                on_day = [(len(tt.course_slots(s(o.get("Course_Code","")).upper(), d)), i)
+                          for i, o in enumerate(movable)]
+                busiest = sorted((-n, i) for n, i in on_day if n)[:REROUTE_NEIGHBOURHOOD]
+                neighbourhoods.append([movable[i] for _n, i in busiest])
+            for group in neighbourhoods:
+                mark = undo.checkpoint()
+                for o in group:
+                    unplace_course(o, undo)
+                chunks = []
+                for o in [c] + group:
+                    chunks.extend(course_chunks(o, start_idx_ref))
+                if chunk_search(chunks, list(range(len(chunks))), undo, REROUTE_BUDGET).run() is None:
+                    undo.commit(mark)
+                    placed_ids.add(id(c))
+                    movable.append(c)
+                    break
+                undo.rollback(mark)
+        return [c for c in course_list if id(c) in placed_ids]
+
+    def anneal_placed(placed_list):
+        # Optional quality pass (see BlockAnnealer): the blocks of the regular
+        # courses of this half are annealed, then the ones that ended up
+        # elsewhere are unbooked and booked again at their new slots.
+        blocks = []
+        for c in placed_list:
+            if c.get("_sync_name") in elective_sync or s(c.get("Semester_Half","")) == "0":
+                continue
+            code = s(c.get("Course_Code",""))
+            for d, slots, _typ in tt.course_runs(code.strip().upper(), by_typ=True):
+                v = tt.get(d, slots[0])
+                if not isinstance(v, Placement) or v.code != code or tt.row(d, slots).count(v) != len(slots):
+                    continue
+                blocks.append({
+                    "key": code.strip().upper(), "value": v, "facs": v.faculty, "rooms": v.rooms,
+                    "minutes": sum(DATA.slot_minutes[s_] for s_ in slots),
+                    "day": d, "slots": tuple(slots), "mask": tt.mask_of(slots), "from": (d, tuple(slots)),
+                })
+        if not blocks:
+            return
+
+        def faculty_mask(d, fac):
+            m = busy.mask(d, fac)
+            return m | faculty_busy_global.mask(d, fac) if faculty_busy_global is not None else m
+
+        BlockAnnealer(tt, blocks, faculty_mask, room_busy.mask, quality).run(quality["anneal_moves"], rng)
+        moved = [b for b in blocks if (b["day"], b["slots"]) != b["from"]]
+        log = _UNLOGGED
+        for b in moved:
+            d, slots = b["from"]
+            m = tt.mask_of(slots)
+            for s_ in slots:
+                log.set_cell(tt, d, s_, "")
+                for fac in b["facs"]:
+                    if faculty_tt is not None and semester_half in (1, 2):
+                        log.delitem(faculty_tt.get(semester_half, {}).get(fac, {}).get(d, {}), s_)
+            for fac in b["facs"]:
+                log.release(busy, d, fac, m)
+                if faculty_busy_global is not None:
+                    log.release(faculty_busy_global, d, fac, m)
+            for r in b["rooms"]:
+                log.release(room_busy.own, d, r, m)
+        for b in moved:
+            d, slots, m = b["day"], b["slots"], b["mask"]
+            for s_ in slots:
+                log.set_cell(tt, d, s_, b["value"])
+                for fac in b["facs"]:
+                    if faculty_tt is not None and semester_half in (1, 2):
+                        record_faculty_slot(log, faculty_tt, semester_half, fac, d, s_, b["value"])
+            for fac in b["facs"]:
+                log.occupy(busy, d, fac, m)
+                if faculty_busy_global is not None:
+                    log.occupy(faculty_busy_global, d, fac, m)
+            for r in b["rooms"]:
+                log.occupy(room_busy, d, r, m)
+        # course_usage follows the blocks (it counts runs per day and component)
+        for code in {b["value"].code for b in moved}:
+            for d in days:
+                usage = {"L": 0, "T": 0, "P": 0}
+                for _d, _slots, typ in tt.course_runs(code.strip().upper(), by_typ=True):
+                    if _d == d and typ in usage:
+                        usage[typ] += 1
+                course_usage[d][code] = usage
+
+    start_idx_ref = [rng.randrange(len(days))]
     elec_final.sort(key=lambda x: 0 if x.get("_sync_name") in elective_sync else 1)
     
-    priority_placed = place_course_list(elec_final, start_idx_ref)
+    place_courses = {
+        "greedy": place_course_list,
+        "backtrack": place_course_list_backtrack,
+        "cpsat": place_course_list_cpsat,
+    }[engine]
+    priority_placed = place_courses(elec_final, start_idx_ref)
     # Assign rooms for each elective course in baskets (for legend + basket display)
     if year_tag is not None:
         # Ensure basket sync exists even if earlier capture missed it
@@ -2358,33 +4132,35 @@ def generate(courses, ws, label, seed, elective_sync,
         rr_state=None, hide_c004=hide_c004,  combined_sync=combined_sync, year_tag=year_tag,semester_half=semester_half, faculty_tt=faculty_tt,
         faculty_busy_global=faculty_busy_global
     )
-    regular_placed = place_course_list(regular_core, start_idx_ref)
+    regular_placed = place_courses(regular_core, start_idx_ref)
+    regular_placed = reroute_unscheduled(regular_core, regular_placed, start_idx_ref)
+    if quality is not None and quality["anneal_moves"] > 0:
+        anneal_placed(regular_placed)
 
     # Label minor slots for semesters 3 and 5
     if year_tag in (3, 5):
         for d in days:
             for s_ in MINOR_SLOTS:
-                if s_ in tt.columns and tt.at[d, s_] == "":
-                    tt.at[d, s_] = "Minor slot"
+                if s_ in tt.slot_idx and tt.is_free(d, s_):
+                    tt.set(d, s_, "Minor slot")
     # Label break slots across all semesters
     for d in days:
         for s_ in BREAK_SLOTS:
-            if s_ in tt.columns and tt.at[d, s_] == "":
-                tt.at[d, s_] = "Break"
+            if s_ in tt.slot_idx and tt.is_free(d, s_):
+                tt.set(d, s_, "Break")
 
     if display_slot_keys is None:
-        display_slot_keys = slot_keys
+        display_slot_keys = DATA.slot_keys
     # For first-half runs, record full-sem course slots after allocation
     if full_sem_sync is not None and semester_half == 1:
         build_full_sem_sync_from_tt(tt, courses, year_tag, full_sem_sync)
 
     # capture room mapping for legend (per block label)
     legend_room_map[label] = build_room_map_from_tt(tt)
+    timetable_grids[label] = (tt, semester_half)
 
-    ws.append(["Day"] + display_slot_keys)
-    for d in days:
-        ws.append([d] + [tt.at[d, s] for s in display_slot_keys])
-    ws.append([""])
+    if ws is not None:
+        write_group_block(ws, label, tt, display_slot_keys)
     # Keep only the combined courses that were actually allocated.
     from collections import Counter
     placed_counts = Counter(combined_placed)
@@ -2400,212 +4176,611 @@ def split(c):
     s2 = [x for x in c if s(x.get("Semester_Half","")) in ["2","0"]]
     return f, s2
 
-if __name__ == "__main__":
-    wb = Workbook()
-    seed = random.randint(0, 999999)
-
-    elective_room_map = {}
-    global_room_busy = {d: {} for d in days}
-    basket_used_global = {}
-    faculty_tt = {1: {}, 2: {}}
-    faculty_busy_global = {
-        1: {d: {} for d in days},
-        2: {d: {} for d in days}
+def _new_sheet(wb, title, first=False):
+    if wb is None:
+        return None
+    if first and wb.active is not None:
+        ws = wb.active
+        ws.title = title
+        return ws
+    return wb.create_sheet(title)
+
+def _fresh(courses):
+    # generate() annotates course dicts; give every run its own copies
+    return [dict(c) for c in courses]
+
+def new_run_state():
+    """
+    Occupancy and sync state shared by all groups of one timetable run.
+    Room bookings are kept per semester half (see RoomLayerView), so a room
+    used only in the first half is free in the second. "occupancy" mirrors the room and faculty indexes as an OccupancyTensor
+    for vectorized queries; room picking reads it.
+    """
+    state = {
+        "elective_room_map": {},
+        "room_busy": new_room_layers(),
+        "basket_used": OccupancyIndex(),
+        "faculty_tt": {1: {}, 2: {}},
+        "faculty_busy": {1: OccupancyIndex(), 2: OccupancyIndex()},
+        "sync": {},
     }
+    occupancy = OccupancyTensor(rooms=DATA.rooms.order)
+    for layer, index in state["room_busy"].items():
+        occupancy.attach(index, "room", (1, 2) if layer == 0 else (layer,))
+    for half in (1, 2):
+        occupancy.attach(state["faculty_busy"][half], "faculty", (half,))
+    state["occupancy"] = occupancy
+    return state
+
+def sync_domain(state, kind, name):
+    if name is None:
+        return None
+    return state["sync"].setdefault((kind, name), {})
 
-    sync_sem1 = {}
-    sync_sem3 = {}
-    sync_sem5_cse = {}
-    sync_sem5_de = {}
-    sync_sem7 = {}
-    combined_sync_cse_sem1 = {}
-    combined_sync_cse_sem3 = {}
-    combined_sync_cse_sem5 = {}
-    combined_sync_de_sem1 = {}
-    combined_sync_de_sem3 = {}
-    combined_sync_de_sem5 = {}
-    full_sem_sync_sem1 = {}
-    full_sem_sync_sem3 = {}
-    full_sem_sync_sem5 = {}
-    full_sem_sync_sem7 = {}
+def group_display_slots(g):
+    if g.get("hide_minor_slots"):
+        return [s for s in DATA.slot_keys if s not in ABSOLUTELY_FORBIDDEN_SLOTS]
+    return None
 
-    # Expose for legend elective-room assignment
-    GLOBAL_ROOM_BUSY = global_room_busy
-    ELECTIVE_SYNC_BY_YEAR = {1: sync_sem1, 3: sync_sem3, 5: sync_sem5_cse, 7: sync_sem7}
+def group_legends(g):
+    """[(title, rows)] for both halves; books basket rooms, so call in config order."""
+    return [
+        (f"{g['legend']} - {HALF_NAMES[half]}",
+         legend_rows(DATA.course_groups[g["key"]], half=half,
+                     room_map_key=f"{g['label']} {HALF_NAMES[half]}"))
+        for half in (1, 2)
+    ]
+
+def group_engine(engine, g):
+    """
+    The placement engine for group g: engine itself, or, when engine maps
+    group labels to engines (see --group-engine), g's entry, else the "*" one.
+    """
+    if isinstance(engine, str):
+        return engine
+    return engine.get(g["label"], engine.get("*", "greedy"))
 
-    sem1_display_slots = [s for s in slot_keys if s not in ABSOLUTELY_FORBIDDEN_SLOTS]
+def run_generators(config, seed):
+    """
+    The generators of one run: the run-level random.Random(seed) draws, in
+    config order, one seed per generate() call (group_runs()), plus the
+    group's "seeds" offset for the half. Returns {run label: random.Random}.
+    Every call returns fresh generators, so serial and concurrent builds,
+    and groups scheduled again, draw the same numbers.
+    """
+    run_rng = random.Random(seed)
+    return {label: random.Random(run_rng.getrandbits(32) + g["seeds"][half - 1])
+            for g, half, label in group_runs(config)}
 
+def schedule_group(g, rngs, state, legends=True, engine="greedy"):
+    """
+    Schedule both halves of one group into timetable_grids with the given
+    placement engine (see ENGINES and group_engine()), drawing from the
+    generators rngs of run_generators().
+    Returns {"placed": course blocks of both halves, "unscheduled": [...],
+    "legends": group_legends() or None}.
+    """
+    year = g["semester"]
+    elective_sync = sync_domain(state, "elective_sync", g["elective_sync"])
+    combined_sync = sync_domain(state, "combined_sync", g.get("combined_sync"))
+    full_sem_sync = sync_domain(state, "full_sem_sync", g.get("full_sem_sync"))
+    # legends look electives up by year; later groups of a year take over
+    ELECTIVE_SYNC_BY_YEAR[year] = elective_sync
+    display = group_display_slots(g)
+    courses = DATA.course_groups[g["key"]]
+    halves = dict(zip((1, 2), split(_fresh(courses))))
+
+    blocks = {}
+    for half in (1, 2):
+        blocks[half] = generate(
+            halves[half], None, f"{g['label']} {HALF_NAMES[half]}", rngs[f"{g['label']} {HALF_NAMES[half]}"],
+            elective_sync, room_prefix=g.get("room_prefix"),
+            elective_room_map=state["elective_room_map"], room_busy_global=state["room_busy"],
+            hide_c004=g.get("hide_c004", False), year_tag=year, combined_sync=combined_sync,
+            semester_half=half, basket_used_global=state["basket_used"],
+            faculty_tt=state["faculty_tt"], full_sem_sync=full_sem_sync,
+            faculty_busy_global=state["faculty_busy"][half], display_slot_keys=display,
+            engine=group_engine(engine, g), quality=state.get("quality"))
+    report = g.get("report_label", g["label"])
     unscheduled = []
+    for half in (1, 2):
+        unscheduled += collect_unscheduled(halves[half], blocks[half], f"{report} {HALF_NAMES[half]}",
+                                           year_tag=year, elective_sync=elective_sync)
+    return {
+        "placed": (blocks[1] or []) + (blocks[2] or []),
+        "unscheduled": unscheduled,
+        "legends": group_legends(g) if legends else None,
+    }
 
-    ws1 = wb.active
-    ws1.title = "CSE-I Timetable"
-    cAf, cAs = split(coursesAI)
-    cBf, cBs = split(coursesBI)
-    
-    csea_block = generate(cAf, ws1, "CSEA I First Half", seed+0, sync_sem1, room_prefix='C1', elective_room_map=elective_room_map, room_busy_global=global_room_busy,hide_c004=True,year_tag=1,combined_sync=combined_sync_cse_sem1,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem1, faculty_busy_global=faculty_busy_global[1], display_slot_keys=sem1_display_slots)
-    csea_block2 = generate(cAs, ws1, "CSEA I Second Half", seed+1, sync_sem1, room_prefix='C1', elective_room_map=elective_room_map, room_busy_global=global_room_busy,hide_c004=True,year_tag=1,combined_sync=combined_sync_cse_sem1,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem1, faculty_busy_global=faculty_busy_global[2], display_slot_keys=sem1_display_slots)
-    unscheduled += collect_unscheduled(cAf, csea_block, "CSEA I First Half", year_tag=1, elective_sync=sync_sem1)
-    unscheduled += collect_unscheduled(cAs, csea_block2, "CSEA I Second Half", year_tag=1, elective_sync=sync_sem1)
-    add_csv_legend_block(ws1, coursesCSEA_I, "CSEA I - First Half", half=1, room_map_key="CSEA I First Half")
-    add_csv_legend_block(ws1, coursesCSEA_I, "CSEA I - Second Half", half=2, room_map_key="CSEA I Second Half")
-    
-    cseb_block = generate(cBf, ws1, "CSEB I First Half", seed+2, sync_sem1, room_prefix='C1', elective_room_map=elective_room_map, room_busy_global=global_room_busy,hide_c004=True,year_tag=1,combined_sync=combined_sync_cse_sem1,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem1, faculty_busy_global=faculty_busy_global[1], display_slot_keys=sem1_display_slots)
-    cseb_block2 = generate(cBs, ws1, "CSEB I Second Half", seed+3, sync_sem1, room_prefix='C1', elective_room_map=elective_room_map, room_busy_global=global_room_busy,hide_c004=True,year_tag=1,combined_sync=combined_sync_cse_sem1,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem1, faculty_busy_global=faculty_busy_global[2], display_slot_keys=sem1_display_slots)
-    unscheduled += collect_unscheduled(cBf, cseb_block, "CSEB I First Half", year_tag=1, elective_sync=sync_sem1)
-    unscheduled += collect_unscheduled(cBs, cseb_block2, "CSEB I Second Half", year_tag=1, elective_sync=sync_sem1)
-    add_csv_legend_block(ws1, coursesCSEB_I, "CSEB I - First Half", half=1, room_map_key="CSEB I First Half")
-    add_csv_legend_block(ws1, coursesCSEB_I, "CSEB I - Second Half", half=2, room_map_key="CSEB I Second Half")
+def render_timetables(wb, config, results):
+    """
+    Lay out the scheduled groups as one SheetModel per config sheet: each
+    group's two blocks from timetable_grids, then its legends, styled by
+    merge_and_color(). The models are written into wb when one is given
+    (it may be a write-only workbook) and returned either way.
+    """
+    sheets = []
+    for sheet in config["sheets"]:
+        model = SheetModel(sheet["sheet"])
+        placed = []
+        for g in sheet["groups"]:
+            res = results[g["label"]]
+            display = group_display_slots(g) or DATA.slot_keys
+            for half in (1, 2):
+                label = f"{g['label']} {HALF_NAMES[half]}"
+                if label in timetable_grids:
+                    write_group_block(model, label, timetable_grids[label][0], display)
+            for title, rows in res["legends"]:
+                write_legend_block(model, title, rows)
+            placed += res["placed"]
+        if sheet.get("reset_palette"):
+            reset_color_palette()
+        merge_and_color(model, placed)
+        sheets.append(model)
+    if wb is not None:
+        style_cache = {}
+        for n, model in enumerate(sheets):
+            write_sheet(wb, model, style_cache, first=(n == 0))
+    return sheets
+
+def build_timetables(seed, wb=None, config=None, jobs=1, sheets=False, engine="greedy"):
+    """
+    Schedule every group of the config (default: data/groups.json) for one seed.
+    Sheets are written into wb; with sheets=True their SheetModels are also
+    returned (as "sheets", see save_workbook). With neither only the schedule
+    is built, which is what the multi-seed search scores.
+    jobs > 1 schedules independent groups concurrently (see build_timetables_parallel).
+    engine picks how each course list is placed: "greedy" (the default),
+    "backtrack" (BacktrackSearch) or "cpsat" (an OR-Tools CP-SAT model); a
+    mapping picks one per group (see group_engine()).
+    """
+    global GLOBAL_ROOM_BUSY, ELECTIVE_SYNC_BY_YEAR
+    if jobs > 1:
+        return build_timetables_parallel(seed, wb, config, jobs, sheets, engine)
+    reset_run_state()
+    if config is None:
+        config = DATA.group_config
+    state = new_run_state()
+    state["quality"] = quality_settings(config.get("quality"))
 
-    
-    combined_i_courses = (csea_block or []) + (csea_block2 or []) + (cseb_block or []) + (cseb_block2 or [])
-    reset_color_palette()
-    merge_and_color(ws1, combined_i_courses)
-
-    # --- DSAI-I ---
-    ws7 = wb.create_sheet("DSAI-I Timetable")
-    d1f_i, d1s_i = split(coursesDSAI_I)
-    dsai1_block1 = generate(d1f_i, ws7, "DSAI-I First Half", seed+16, sync_sem1, room_prefix='C1', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=1,combined_sync=combined_sync_de_sem1,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem1, faculty_busy_global=faculty_busy_global[1], display_slot_keys=sem1_display_slots)
-    dsai1_block2 = generate(d1s_i, ws7, "DSAI-I Second Half", seed+17, sync_sem1, room_prefix='C1', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=1,combined_sync=combined_sync_de_sem1,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem1, faculty_busy_global=faculty_busy_global[2], display_slot_keys=sem1_display_slots)
-    unscheduled += collect_unscheduled(d1f_i, dsai1_block1, "DSAI-I First Half", year_tag=1, elective_sync=sync_sem1)
-    unscheduled += collect_unscheduled(d1s_i, dsai1_block2, "DSAI-I Second Half", year_tag=1, elective_sync=sync_sem1)
-    add_csv_legend_block(ws7, coursesDSAI_I, "DSAI I - First Half", half=1, room_map_key="DSAI-I First Half")
-    add_csv_legend_block(ws7, coursesDSAI_I, "DSAI I - Second Half", half=2, room_map_key="DSAI-I Second Half")
-
-    combined_dsai1_courses = (dsai1_block1 or []) + (dsai1_block2 or [])
-    merge_and_color(ws7, combined_dsai1_courses)
-
-    # --- ECE-I ---
-    ws9 = wb.create_sheet("ECE-I Timetable")
-    e1f_i, e1s_i = split(coursesECE_I)
-    ece1_block1 = generate(e1f_i, ws9, "ECE-I First Half", seed+20, sync_sem1, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=1,combined_sync=combined_sync_de_sem1,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem1, faculty_busy_global=faculty_busy_global[1], display_slot_keys=sem1_display_slots)
-    ece1_block2 = generate(e1s_i, ws9, "ECE-I Second Half", seed+21, sync_sem1, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=1,combined_sync=combined_sync_de_sem1,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem1, faculty_busy_global=faculty_busy_global[2], display_slot_keys=sem1_display_slots)
-    unscheduled += collect_unscheduled(e1f_i, ece1_block1, "ECE-I First Half", year_tag=1, elective_sync=sync_sem1)
-    unscheduled += collect_unscheduled(e1s_i, ece1_block2, "ECE-I Second Half", year_tag=1, elective_sync=sync_sem1)
-    add_csv_legend_block(ws9, coursesECE_I, "ECE I - First Half", half=1, room_map_key="ECE-I First Half")
-    add_csv_legend_block(ws9, coursesECE_I, "ECE I - Second Half", half=2, room_map_key="ECE-I Second Half")
-
-    combined_ece1_courses = (ece1_block1 or []) + (ece1_block2 or [])
-    merge_and_color(ws9, combined_ece1_courses)
-    # --- CSE-III (Sections A & B) ---
-    ws2 = wb.create_sheet("CSE-III Timetable")
-    c1f, c1s = split(coursesA); c2f, c2s = split(coursesB)
-    
-    csea3_block1 = generate(c1f, ws2, "CSEA III First Half", seed+4, sync_sem3, room_prefix='C2', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=3,combined_sync=combined_sync_cse_sem3,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem3, faculty_busy_global=faculty_busy_global[1])
-    csea3_block2 = generate(c1s, ws2, "CSEA III Second Half", seed+5, sync_sem3, room_prefix='C2', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=3,combined_sync=combined_sync_cse_sem3,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem3, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(c1f, csea3_block1, "CSEA III First Half", year_tag=3, elective_sync=sync_sem3)
-    unscheduled += collect_unscheduled(c1s, csea3_block2, "CSEA III Second Half", year_tag=3, elective_sync=sync_sem3)
-    add_csv_legend_block(ws2, coursesCSEA_III, "CSEA III - First Half", half=1, room_map_key="CSEA III First Half")
-    add_csv_legend_block(ws2, coursesCSEA_III, "CSEA III - Second Half", half=2, room_map_key="CSEA III Second Half")
+    # Expose for legend elective-room assignment
+    GLOBAL_ROOM_BUSY = RoomLayerView(state["room_busy"], 0)
+    ELECTIVE_SYNC_BY_YEAR = {}
+    for g in iter_groups(config):
+        ELECTIVE_SYNC_BY_YEAR.setdefault(g["semester"], sync_domain(state, "elective_sync", g["elective_sync"]))
+
+    rngs = run_generators(config, seed)
+    results = {}
+    for g in iter_groups(config):
+        results[g["label"]] = schedule_group(g, rngs, state, engine=engine)
+
+    moved = repair_faculty_clashes(config, state, build_course_faculty_map())
+    rooms_moved = reassign_rooms(config, state, results) if state["quality"]["room_reassign"] else 0
+    models = render_timetables(wb, config, results) if (wb is not None or sheets) else None
+    unscheduled = []
+    for g in iter_groups(config):
+        unscheduled += results[g["label"]]["unscheduled"]
+    return {
+        "seed": seed,
+        "unscheduled": unscheduled,
+        "faculty_tt": state["faculty_tt"],
+        "moved": moved,
+        "rooms_moved": rooms_moved,
+        "room_shortfalls": dict(basket_room_shortfalls),
+        "groups": results,
+        "sheets": models,
+    }
 
-    
-    cseb3_block1 = generate(c2f, ws2, "CSEB III First Half", seed+6, sync_sem3, room_prefix='C2', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=3,combined_sync=combined_sync_cse_sem3,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem3, faculty_busy_global=faculty_busy_global[1])
-    cseb3_block2 = generate(c2s, ws2, "CSEB III Second Half", seed+7, sync_sem3, room_prefix='C2', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=3,combined_sync=combined_sync_cse_sem3,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem3, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(c2f, cseb3_block1, "CSEB III First Half", year_tag=3, elective_sync=sync_sem3)
-    unscheduled += collect_unscheduled(c2s, cseb3_block2, "CSEB III Second Half", year_tag=3, elective_sync=sync_sem3)
-    add_csv_legend_block(ws2, coursesCSEB_III, "CSEB III - First Half", half=1, room_map_key="CSEB III First Half")
-    add_csv_legend_block(ws2, coursesCSEB_III, "CSEB III - Second Half", half=2, room_map_key="CSEB III Second Half")
+#############################################
+# CONCURRENT GROUP SCHEDULING
+#############################################
 
-    
-    combined_iii_courses = (csea3_block1 or []) + (csea3_block2 or []) + (cseb3_block1 or []) + (cseb3_block2 or [])
-    reset_color_palette()
-    merge_and_color(ws2, combined_iii_courses)
-
-    # --- DSAI-III ---
-    ws4 = wb.create_sheet("DSAI-III Timetable")
-    d1f, d1s = split(coursesDSAI_III)
-    dsa_block1 = generate(d1f, ws4, "DSAI-III First Half", seed+10, sync_sem3, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=3,combined_sync=combined_sync_de_sem3,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem3, faculty_busy_global=faculty_busy_global[1])
-    dsa_block2 = generate(d1s, ws4, "DSAI-III Second Half", seed+11, sync_sem3, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=3,combined_sync=combined_sync_de_sem3,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem3, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(d1f, dsa_block1, "DSAI-III First Half", year_tag=3, elective_sync=sync_sem3)
-    unscheduled += collect_unscheduled(d1s, dsa_block2, "DSAI-III Second Half", year_tag=3, elective_sync=sync_sem3)
-    add_csv_legend_block(ws4, coursesDSAI_III, "DSAI III - First Half", half=1, room_map_key="DSAI-III First Half")
-    add_csv_legend_block(ws4, coursesDSAI_III, "DSAI III - Second Half", half=2, room_map_key="DSAI-III Second Half")
-
-    combined_dsa_courses = (dsa_block1 or []) + (dsa_block2 or [])
-    merge_and_color(ws4, combined_dsa_courses)
-
-    # --- ECE-III ---
-    ws5 = wb.create_sheet("ECE-III Timetable")
-    e1f, e1s = split(coursesECE_III)
-    ece_block1 = generate(e1f, ws5, "ECE-III First Half", seed+12, sync_sem3, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=3,combined_sync=combined_sync_de_sem3,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem3, faculty_busy_global=faculty_busy_global[1])
-    ece_block2 = generate(e1s, ws5, "ECE-III Second Half", seed+13, sync_sem3, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=3,combined_sync=combined_sync_de_sem3,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem3, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(e1f, ece_block1, "ECE-III First Half", year_tag=3, elective_sync=sync_sem3)
-    unscheduled += collect_unscheduled(e1s, ece_block2, "ECE-III Second Half", year_tag=3, elective_sync=sync_sem3)
-    add_csv_legend_block(ws5, coursesECE_III, "ECE III - First Half", half=1, room_map_key="ECE-III First Half")
-    add_csv_legend_block(ws5, coursesECE_III, "ECE III - Second Half", half=2, room_map_key="ECE-III Second Half")
-
-    combined_ece_courses = (ece_block1 or []) + (ece_block2 or [])
-    merge_and_color(ws5, combined_ece_courses)
-
-    # --- CSE-V ---
-    ws3 = wb.create_sheet("CSE-V Timetable")
-    c5af, c5as = split(coursesCSEA_V)
-    c5bf, c5bs = split(coursesCSEB_V)
-    c5a_block1 = generate(c5af, ws3, "CSEA V First Half", seed+8, sync_sem5_cse, room_prefix='C3', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=5,combined_sync=combined_sync_cse_sem5,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem5, faculty_busy_global=faculty_busy_global[1])
-    c5a_block2 = generate(c5as, ws3, "CSEA V Second Half", seed+9, sync_sem5_cse, room_prefix='C3', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=5,combined_sync=combined_sync_cse_sem5,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem5, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(c5af, c5a_block1, "CSEA V First Half", year_tag=5, elective_sync=sync_sem5_cse)
-    unscheduled += collect_unscheduled(c5as, c5a_block2, "CSEA V Second Half", year_tag=5, elective_sync=sync_sem5_cse)
-    add_csv_legend_block(ws3, coursesCSEA_V, "CSEA V - First Half", half=1, room_map_key="CSEA V First Half")
-    add_csv_legend_block(ws3, coursesCSEA_V, "CSEA V - Second Half", half=2, room_map_key="CSEA V Second Half")
-
-    c5b_block1 = generate(c5bf, ws3, "CSEB V First Half", seed+10, sync_sem5_cse, room_prefix='C3', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=5,combined_sync=combined_sync_cse_sem5,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem5, faculty_busy_global=faculty_busy_global[1])
-    c5b_block2 = generate(c5bs, ws3, "CSEB V Second Half", seed+11, sync_sem5_cse, room_prefix='C3', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=5,combined_sync=combined_sync_cse_sem5,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem5, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(c5bf, c5b_block1, "CSEB V First Half", year_tag=5, elective_sync=sync_sem5_cse)
-    unscheduled += collect_unscheduled(c5bs, c5b_block2, "CSEB V Second Half", year_tag=5, elective_sync=sync_sem5_cse)
-    add_csv_legend_block(ws3, coursesCSEB_V, "CSEB V - First Half", half=1, room_map_key="CSEB V First Half")
-    add_csv_legend_block(ws3, coursesCSEB_V, "CSEB V - Second Half", half=2, room_map_key="CSEB V Second Half")
-
-    combined_v_courses = (c5a_block1 or []) + (c5a_block2 or []) + (c5b_block1 or []) + (c5b_block2 or [])
-    reset_color_palette()
-    merge_and_color(ws3, combined_v_courses)
-
-    ELECTIVE_SYNC_BY_YEAR[5] = sync_sem5_de
-
-    # --- DSAI-V ---
-    ws8 = wb.create_sheet("DSAI-V Timetable")
-    d5f_v, d5s_v = split(coursesDSAI_V)
-    dsai5_block1 = generate(d5f_v, ws8, "DSAI-V First Half", seed+18, sync_sem5_de, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=5,combined_sync=combined_sync_de_sem5,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem5, faculty_busy_global=faculty_busy_global[1])
-    dsai5_block2 = generate(d5s_v, ws8, "DSAI-V Second Half", seed+19, sync_sem5_de, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=5,combined_sync=combined_sync_de_sem5,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem5, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(d5f_v, dsai5_block1, "DSAI-V First Half", year_tag=5, elective_sync=sync_sem5_de)
-    unscheduled += collect_unscheduled(d5s_v, dsai5_block2, "DSAI-V Second Half", year_tag=5, elective_sync=sync_sem5_de)
-    add_csv_legend_block(ws8, coursesDSAI_V, "DSAI V - First Half", half=1, room_map_key="DSAI-V First Half")
-    add_csv_legend_block(ws8, coursesDSAI_V, "DSAI V - Second Half", half=2, room_map_key="DSAI-V Second Half")
-
-    combined_dsai5_courses = (dsai5_block1 or []) + (dsai5_block2 or [])
-    merge_and_color(ws8, combined_dsai5_courses)
-
-    # --- ECE-V ---
-    ws10 = wb.create_sheet("ECE-V Timetable")
-    e5f_v, e5s_v = split(coursesECE_V)
-    ece5_block1 = generate(e5f_v, ws10, "ECE-V First Half", seed+22, sync_sem5_de, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=5,combined_sync=combined_sync_de_sem5,semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem5, faculty_busy_global=faculty_busy_global[1])
-    ece5_block2 = generate(e5s_v, ws10, "ECE-V Second Half", seed+23, sync_sem5_de, room_prefix='C4', elective_room_map=elective_room_map, room_busy_global=global_room_busy,year_tag=5,combined_sync=combined_sync_de_sem5,semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem5, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(e5f_v, ece5_block1, "ECE-V First Half", year_tag=5, elective_sync=sync_sem5_de)
-    unscheduled += collect_unscheduled(e5s_v, ece5_block2, "ECE-V Second Half", year_tag=5, elective_sync=sync_sem5_de)
-    add_csv_legend_block(ws10, coursesECE_V, "ECE V - First Half", half=1, room_map_key="ECE-V First Half")
-    add_csv_legend_block(ws10, coursesECE_V, "ECE V - Second Half", half=2, room_map_key="ECE-V Second Half")
-
-    combined_ece5_courses = (ece5_block1 or []) + (ece5_block2 or [])
-    merge_and_color(ws10, combined_ece5_courses)
-    # --- Common 7th Sem ---
-    ws6 = wb.create_sheet("COMMON 7TH-SEM Timetable")
-    s7f, s7s = split(coursesVII)
-    s7_block1 = generate(s7f, ws6, "COMMON 7TH-SEM First Half", seed+14, sync_sem7, room_prefix='C3', elective_room_map=elective_room_map, room_busy_global=global_room_busy, year_tag=7, semester_half=1, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem7, faculty_busy_global=faculty_busy_global[1])
-    s7_block2 = generate(s7s, ws6, "COMMON 7TH-SEM Second Half", seed+15, sync_sem7, room_prefix='C3', elective_room_map=elective_room_map, room_busy_global=global_room_busy, year_tag=7, semester_half=2, basket_used_global=basket_used_global, faculty_tt=faculty_tt, full_sem_sync=full_sem_sync_sem7, faculty_busy_global=faculty_busy_global[2])
-    unscheduled += collect_unscheduled(s7f, s7_block1, "7TH SEM First Half", year_tag=7, elective_sync=sync_sem7)
-    unscheduled += collect_unscheduled(s7s, s7_block2, "7TH SEM Second Half", year_tag=7, elective_sync=sync_sem7)
-    add_csv_legend_block(ws6, coursesVII, "7TH SEM - First Half", half=1, room_map_key="COMMON 7TH-SEM First Half")
-    add_csv_legend_block(ws6, coursesVII, "7TH SEM - Second Half", half=2, room_map_key="COMMON 7TH-SEM Second Half")
-    combined_7_courses = (s7_block1 or []) + (s7_block2 or [])
-    merge_and_color(ws6, combined_7_courses)
+def group_waves(config):
+    """Group labels in waves: a group only shares sync state with groups of earlier waves."""
+    runs = group_runs(config)
+    deps = group_dependencies(config)
+    owner = {label: g["label"] for g, _half, label in runs}
+    gdeps = {}
+    for g, _half, label in runs:
+        gdeps.setdefault(g["label"], set()).update(
+            owner[d] for d in deps[label] if owner[d] != g["label"])
+    return dependency_waves(gdeps)
+
+def _run_snapshot(state):
+    """Everything a group reads or writes while scheduling, as one picklable object."""
+    return {
+        "state": state,
+        "elective_by_year": ELECTIVE_SYNC_BY_YEAR,
+        "basket_course_room_map": basket_course_room_map,
+        "basket_room_list_map": basket_room_list_map,
+        "basket_room_shortfalls": basket_room_shortfalls,
+        "basket_room_busy": basket_room_busy,
+    }
+
+def _install_snapshot(snap):
+    global GLOBAL_ROOM_BUSY, ELECTIVE_SYNC_BY_YEAR, basket_course_room_map
+    global basket_room_list_map, basket_room_shortfalls, basket_room_busy
+    reset_run_state()
+    GLOBAL_ROOM_BUSY = RoomLayerView(snap["state"]["room_busy"], 0)
+    ELECTIVE_SYNC_BY_YEAR = snap["elective_by_year"]
+    basket_course_room_map = snap["basket_course_room_map"]
+    basket_room_list_map = snap["basket_room_list_map"]
+    basket_room_shortfalls = snap["basket_room_shortfalls"]
+    basket_room_busy = snap["basket_room_busy"]
+
+def _schedule_group_isolated(g, rngs, snap, engine="greedy"):
+    """Worker: schedule one group against a snapshot and return the snapshot as it ends up."""
+    _install_snapshot(snap)
+    res = schedule_group(g, rngs, snap["state"], legends=False, engine=engine)
+    return {
+        "snap": snap,
+        "grids": dict(timetable_grids),
+        "legend_room_map": dict(legend_room_map),
+        "result": res,
+    }
+
+def _flat_faculty_tt(faculty_tt):
+    return {
+        (half, fac, d, s_): v
+        for half, per_fac in faculty_tt.items()
+        for fac, per_day in per_fac.items()
+        for d, per_slot in per_day.items()
+        for s_, v in per_slot.items()
+    }
+
+def _dict_delta(before, after):
+    return {k: v for k, v in after.items() if k not in before or before[k] != v}
+
+def snapshot_delta(before, after):
+    """
+    What one group added on top of before: new occupancy bits per index,
+    new/changed entries of the sync dicts, basket maps and faculty_tt.
+    """
+    b, a = before["state"], after["state"]
+    occ = {
+        "room": [(d, (layer, room), m) for layer in ROOM_LAYERS
+                 for d, room, m in a["room_busy"][layer].added_since(b["room_busy"][layer])],
+        "basket": a["basket_used"].added_since(b["basket_used"]),
+        "faculty1": a["faculty_busy"][1].added_since(b["faculty_busy"][1]),
+        "faculty2": a["faculty_busy"][2].added_since(b["faculty_busy"][2]),
+    }
+    if after["basket_room_busy"] is not None:
+        occ["basket_room"] = after["basket_room_busy"].added_since(
+            before["basket_room_busy"] or OccupancyIndex())
+    return {
+        "occ": occ,
+        "faculty_tt": _dict_delta(_flat_faculty_tt(b["faculty_tt"]), _flat_faculty_tt(a["faculty_tt"])),
+        "sync": {k: _dict_delta(b["sync"].get(k, {}), v) for k, v in a["sync"].items()},
+        "basket_course_room_map": _dict_delta(before["basket_course_room_map"], after["basket_course_room_map"]),
+        "basket_room_list_map": _dict_delta(before["basket_room_list_map"], after["basket_room_list_map"]),
+        "basket_room_shortfalls": _dict_delta(before["basket_room_shortfalls"], after["basket_room_shortfalls"]),
+    }
+
+# delta entries that are plain dicts: a key set by two groups of a wave is a conflict
+DICT_DELTA_KEYS = ("faculty_tt", "basket_course_room_map", "basket_room_list_map", "basket_room_shortfalls")
+
+def _claim_key(index_name, key):
+    # basket_clash() compares a basket across years, so claims ignore the year
+    return key[0] if index_name == "basket" else key
+
+def _clashing_claims(index_name, key):
+    """
+    Claim keys a booking of key collides with; room layer 0 spans both
+    halves. C004 collides with nothing: the combined-class hall is shared
+    by design, and alloc_specific() does not check it either.
+    """
+    if index_name == "room":
+        layer, room = key
+        if room == "C004":
+            return []
+        return [(other, room) for other in (ROOM_LAYERS if layer == 0 else (0, layer))]
+    return [_claim_key(index_name, key)]
+
+def delta_conflicts(delta, claimed):
+    """True if delta books anything already claimed by a group merged earlier in the wave."""
+    for name, items in delta["occ"].items():
+        taken = claimed["occ"].get(name, {})
+        for d, key, m in items:
+            if any(taken.get((d, k), 0) & m for k in _clashing_claims(name, key)):
+                return True
+    for name in DICT_DELTA_KEYS:
+        if claimed[name] & delta[name].keys():
+            return True
+    for dom, entries in delta["sync"].items():
+        if claimed["sync"].get(dom, set()) & entries.keys():
+            return True
+    return False
+
+def claim_delta(delta, claimed):
+    for name, items in delta["occ"].items():
+        taken = claimed["occ"].setdefault(name, {})
+        for d, key, m in items:
+            k = (d, _claim_key(name, key))
+            taken[k] = taken.get(k, 0) | m
+    for name in DICT_DELTA_KEYS:
+        claimed[name] |= delta[name].keys()
+    for dom, entries in delta["sync"].items():
+        claimed["sync"].setdefault(dom, set()).update(entries)
+
+def apply_delta(delta, state):
+    """Merge a group's delta into the run state and the module-level basket maps."""
+    global basket_room_busy
+    occ = delta["occ"]
+    for d, (layer, room), m in occ["room"]:
+        state["room_busy"][layer].occupy(d, room, m)
+    for name, index in (("basket", state["basket_used"]),
+                        ("faculty1", state["faculty_busy"][1]), ("faculty2", state["faculty_busy"][2])):
+        for d, key, m in occ[name]:
+            index.occupy(d, key, m)
+    if "basket_room" in occ:
+        if basket_room_busy is None:
+            basket_room_busy = OccupancyIndex()
+        for d, key, m in occ["basket_room"]:
+            basket_room_busy.occupy(d, key, m)
+    for (half, fac, d, s_), v in delta["faculty_tt"].items():
+        state["faculty_tt"].setdefault(half, {}).setdefault(fac, {}).setdefault(d, {})[s_] = v
+    for dom, entries in delta["sync"].items():
+        state["sync"].setdefault(dom, {}).update(entries)
+    basket_course_room_map.update(delta["basket_course_room_map"])
+    basket_room_list_map.update(delta["basket_room_list_map"])
+    basket_room_shortfalls.update(delta["basket_room_shortfalls"])
+
+def build_timetables_parallel(seed, wb=None, config=None, jobs=None, sheets=False, engine="greedy"):
+    """
+    build_timetables() with the groups of each dependency wave scheduled
+    concurrently in worker processes, each against a snapshot of the run
+    state taken when the wave starts. Results are merged in config order;
+    a group whose new room, faculty or basket bookings collide with a group
+    merged before it in the same wave is rescheduled serially against the
+    merged state. The outcome is deterministic for a seed, but may differ
+    from the serial build because groups of a wave do not see each other.
+
+    Workers get the whole, unpartitioned room pool and pick rooms first
+    fit, so groups of a wave often collide (on rooms, shared faculty and
+    baskets) and are rescheduled. On the shipped data 4-7 of 13 groups
+    are, and a build takes about 3x as long as the serial one; scheduling
+    a group is cheaper than the worker round trip.
+    """
+    global GLOBAL_ROOM_BUSY, ELECTIVE_SYNC_BY_YEAR
+    from concurrent.futures import ProcessPoolExecutor
+    import pickle
+
+    reset_run_state()
+    if config is None:
+        config = DATA.group_config
+    by_label = {g["label"]: g for g in iter_groups(config)}
+    state = new_run_state()
+    state["quality"] = quality_settings(config.get("quality"))
+    GLOBAL_ROOM_BUSY = RoomLayerView(state["room_busy"], 0)
+    ELECTIVE_SYNC_BY_YEAR = {}
+    for g in iter_groups(config):
+        ELECTIVE_SYNC_BY_YEAR.setdefault(g["semester"], sync_domain(state, "elective_sync", g["elective_sync"]))
+    # Basket rooms are booked on a copy of the room state taken on first
+    # use; take it up front so every worker starts from the same copy.
+    _ensure_basket_room_busy()
+    # Load the inputs before forking so workers inherit them.
+    for name in ("course_groups", "slot_bit", "rooms"):
+        getattr(DATA, name)
+
+    results = {}
+    rerun = []
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        for wave in group_waves(config):
+            # one pickle of the whole snapshot keeps the shared dicts shared
+            blob = pickle.dumps(_run_snapshot(state))
+            before = pickle.loads(blob)
+            futures = [
+                ex.submit(_schedule_group_isolated, by_label[label], run_generators(config, seed),
+                          pickle.loads(blob), engine)
+                for label in wave
+            ]
+            claimed = {"occ": {}, "sync": {}, **{name: set() for name in DICT_DELTA_KEYS}}
+            losers = []
+            for label, fut in zip(wave, futures):
+                res = fut.result()
+                delta = snapshot_delta(before, res["snap"])
+                if delta_conflicts(delta, claimed):
+                    losers.append(label)
+                    continue
+                claim_delta(delta, claimed)
+                apply_delta(delta, state)
+                timetable_grids.update(res["grids"])
+                legend_room_map.update(res["legend_room_map"])
+                results[label] = res["result"]
+            for label in wave:
+                g = by_label[label]
+                ELECTIVE_SYNC_BY_YEAR[g["semester"]] = sync_domain(state, "elective_sync", g["elective_sync"])
+            for label in losers:
+                results[label] = schedule_group(by_label[label], run_generators(config, seed), state,
+                                                legends=False, engine=engine)
+            rerun += losers
+
+    # Legends book basket rooms: build them in config order, as the serial build does.
+    all_unscheduled = []
+    for g in iter_groups(config):
+        ELECTIVE_SYNC_BY_YEAR[g["semester"]] = sync_domain(state, "elective_sync", g["elective_sync"])
+        results[g["label"]]["legends"] = group_legends(g)
+        all_unscheduled += results[g["label"]]["unscheduled"]
+    moved = repair_faculty_clashes(config, state, build_course_faculty_map())
+    rooms_moved = reassign_rooms(config, state, results) if state["quality"]["room_reassign"] else 0
+    models = render_timetables(wb, config, results) if (wb is not None or sheets) else None
+
+    return {
+        "seed": seed,
+        "unscheduled": all_unscheduled,
+        "faculty_tt": state["faculty_tt"],
+        "moved": moved,
+        "rooms_moved": rooms_moved,
+        "rerun": rerun,
+        "room_shortfalls": dict(basket_room_shortfalls),
+        "groups": results,
+        "sheets": models,
+    }
+
+def _unscheduled_rows(unscheduled):
+    cols = ["Department","Semester","Section","Course_Code","Course_Title",
+            "Faculty","L-T-P-S-C","Elective","ElectiveBasket","Semester_Half"]
+    seen = set()
+    for u in unscheduled:
+        seen.add(tuple(u.get(c, "") for c in cols))
+    return seen
+
+def count_faculty_clashes(course_faculty_map=None):
+    """
+    Number of (half, day, slot, faculty) cells holding more than one course,
+    with each cell's faculty from cell_faculty(); course_faculty_map is
+    only read for plain-text cells.
+    """
+    usage = {}
+    for tt, half in timetable_grids.values():
+        for d in tt.days:
+            for s_, val in zip(tt.slots, tt.row(d)):
+                code = extract_course_code(val)
+                if not code:
+                    continue
+                if course_faculty_map is None and not isinstance(val, Placement):
+                    course_faculty_map = build_course_faculty_map()
+                for fac in cell_faculty(val, course_faculty_map):
+                    usage.setdefault((half, d, s_, fac), set()).add(code)
+    return sum(1 for codes in usage.values() if len(codes) > 1)
+
+def run_placements(result):
+    """
+    The compact, picklable form of the run build_timetables() just built:
+    every grid as rows of cell values, each group's legends and placed
+    course codes, and the run's reports (faculty_tt, unscheduled courses,
+    repair counts). render_placements() renders it.
+    """
+    report = ("seed", "unscheduled", "faculty_tt", "moved", "rooms_moved", "room_shortfalls", "rerun")
+    return {
+        "grids": {label: (half, [tt.row(d) for d in tt.days])
+                  for label, (tt, half) in timetable_grids.items()},
+        "groups": {label: {"placed": [{"Course_Code": s(c.get("Course_Code", ""))} for c in res["placed"]],
+                           "legends": res["legends"]}
+                   for label, res in result["groups"].items()},
+        "report": {k: result[k] for k in report if k in result},
+    }
+
+def render_placements(placements, wb=None, config=None):
+    """
+    Install the grids of run_placements() and render them as
+    build_timetables(sheets=True) would; returns the same result dict.
+    """
+    reset_run_state()
+    if config is None:
+        config = DATA.group_config
+    for label, (half, rows) in placements["grids"].items():
+        tt = TimetableGrid()
+        for d, row in zip(tt.days, rows):
+            for s_, v in zip(tt.slots, row):
+                if v:
+                    tt.set(d, s_, v)
+        timetable_grids[label] = (tt, half)
+    models = render_timetables(wb, config, placements["groups"])
+    return dict(placements["report"], groups=placements["groups"], sheets=models)
+
+def score_seed(seed, engine="greedy"):
+    """
+    Build (but do not render) the timetable for seed and summarise it,
+    with its placements (run_placements()) for rendering the winner.
+    Clashes are counted from the faculty each cell's Placement names
+    (count_faculty_clashes()), not from the code-keyed course map.
+    """
+    result = build_timetables(seed, engine=engine)
+    return {
+        "seed": seed,
+        "unscheduled": len(_unscheduled_rows(result["unscheduled"])),
+        "clashes": count_faculty_clashes(),
+        "placements": run_placements(result),
+    }
+
+def search_seeds(seeds, jobs=None, engine="greedy"):
+    """
+    Score every seed (in parallel worker processes when jobs > 1) and
+    return the summaries ordered best first: fewest unscheduled courses,
+    then fewest faculty clashes, then the order seeds were given in.
+    """
+    seeds = list(seeds)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(seeds)))
+    if jobs == 1:
+        results = [score_seed(sd, engine) for sd in seeds]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            results = list(ex.map(functools.partial(score_seed, engine=engine), seeds))
+    order = {sd: i for i, sd in enumerate(seeds)}
+    return sorted(results, key=lambda r: (r["unscheduled"], r["clashes"], order[r["seed"]]))
+
+if __name__ == "__main__":
+    import argparse
+    import pandas as pd
+    parser = argparse.ArgumentParser(description="Generate the department timetables.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for a reproducible run (default: pick one at random)")
+    parser.add_argument("--seeds", type=int, default=1,
+                        help="try this many random seeds and keep the best timetable")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="worker processes for --seeds and for writing the output "
+                             "workbooks (default: all cores)")
+    parser.add_argument("--group-jobs", type=int, default=1,
+                        help="schedule independent groups in this many worker processes")
+    parser.add_argument("--faculty-dir", default=None,
+                        help="also write one workbook per faculty into this directory")
+    parser.add_argument("--engine", choices=ENGINES, default="greedy",
+                        help="course placement: greedy retries (default), backtracking search "
+                             "or a CP-SAT model (needs ortools)")
+    parser.add_argument("--group-engine", action="append", default=[], metavar="LABEL=ENGINE",
+                        help="use ENGINE for the group with this label in groups.json "
+                             "instead of --engine; repeatable")
+    args = parser.parse_args()
+    engine = args.engine
+    if args.group_engine:
+        engine = {"*": args.engine}
+        labels = {g["label"] for g in iter_groups(DATA.group_config)}
+        for item in args.group_engine:
+            label, _, name = item.rpartition("=")
+            if label not in labels or name not in ENGINES:
+                parser.error(f"--group-engine {item}: expected LABEL=ENGINE with a group label "
+                             f"from groups.json and one of {', '.join(ENGINES)}")
+            engine[label] = name
+    print("Generating Timetable...")
+
+    seed = args.seed if args.seed is not None else random.randint(0, 999999)
+    print(f"Seed: {seed}")
+    if args.seeds > 1:
+        rng = random.Random(seed)
+        candidates = [seed] + [rng.randint(0, 999999) for _ in range(args.seeds - 1)]
+        ranked = search_seeds(candidates, jobs=args.jobs, engine=engine)
+        best = ranked[0]
+        seed = best["seed"]
+        print(f"Best of {len(candidates)} seeds: {seed} "
+              f"({best['unscheduled']} unscheduled, {best['clashes']} faculty clashes)")
+        result = render_placements(best["placements"])
+    else:
+        result = build_timetables(seed, jobs=args.group_jobs, sheets=True, engine=engine)
+    if result.get("rerun"):
+        print(f"Rescheduled after merge conflicts: {', '.join(result['rerun'])}")
+    unscheduled = result["unscheduled"]
+    faculty_tt = result["faculty_tt"]
 
     name = f"Final_Timetable.xlsx"
     course_index = build_course_index()
-    course_faculty_map = build_course_faculty_map()
-    moved = repair_faculty_clashes(wb, faculty_tt, course_faculty_map)
-    if moved:
-        print(f"Clash repair moved {moved} entries to 17:30-18:30")
-    wb.save(name)
-    write_faculty_workbook(faculty_tt.get(1, {}), "Faculty_Timetable_First_Half.xlsx", course_index=course_index)
-    write_faculty_workbook(faculty_tt.get(2, {}), "Faculty_Timetable_Second_Half.xlsx", course_index=course_index)
+    if result["moved"]:
+        print(f"Clash repair moved {result['moved']} entries")
+    if result["rooms_moved"]:
+        print(f"Room reassignment moved {result['rooms_moved']} course components")
+    for (year, basket), blocks in sorted(result["room_shortfalls"].items()):
+        for b in blocks:
+            span = f"{b['slots'][0].split('-')[0]}-{b['slots'][-1].split('-')[-1]}"
+            print(f"Basket {basket} (year {year}) {b['day']} {span}: {len(b['courses'])} course(s) "
+                  f"({', '.join(b['courses'])}) but {len(b['rooms'])} free room(s) "
+                  f"({', '.join(b['rooms']) or 'none'})")
+    # The main and faculty workbooks are independent: write them in parallel.
+    tasks = [(save_workbook, (result["sheets"], name))]
+    tasks += faculty_export_tasks(faculty_tt, course_index, DATA.slot_keys, faculty_dir=args.faculty_dir)
+    run_exports(tasks, jobs=args.jobs)
 
     # Export unscheduled courses report
     if unscheduled:
@@ -2620,6 +4795,7 @@ if __name__ == "__main__":
             "Group","Department","Semester","Section","Course_Code","Course_Title",
             "Faculty","L-T-P-S-C","Elective","ElectiveBasket","Semester_Half"
         ]).to_excel("Unscheduled_Courses.xlsx", index=False)
+    pin_xlsx_timestamps("Unscheduled_Courses.xlsx")
     print("Evenly balanced timetable saved in", name)
 
 
@@ -1,13 +1,18 @@
+import importlib.util
+import os
+import random
+import subprocess
+import sys
+import tempfile
 import unittest
-import pandas as pd
+from unittest import mock
 
 import TT_gen
 
 
 class TestTTGen(unittest.TestCase):
     def _empty_tt(self):
-        data = {slot: [""] * len(TT_gen.days) for slot in TT_gen.slot_keys}
-        return pd.DataFrame(data, index=TT_gen.days)
+        return TT_gen.TimetableGrid()
 
     def test_normalize_time_and_t2m(self):
         self.assertEqual(TT_gen.normalize_time("7:5"), "07:05")
@@ -51,6 +56,65 @@ class TestTTGen(unittest.TestCase):
         self.assertIn(("Monday", [s0, s1]), blocks)
         self.assertIn(("Monday", [s3]), blocks)
 
+    def test_timetable_grid_occupancy(self):
+        tt = self._empty_tt()
+        s0, s1, s2 = TT_gen.slot_keys[:3]
+        tt.place("Monday", [s0, s2], "CS101 (C3)")
+        self.assertEqual(tt.occ[0], 0b101)
+        self.assertTrue(tt.is_free("Monday", s1))
+        self.assertFalse(tt.all_free("Monday", [s1, s2]))
+        tt.set("Monday", s2, "")
+        self.assertEqual(tt.occ[0], 0b1)
+        frame = tt.to_frame()
+        self.assertEqual(frame.at["Monday", s0], "CS101 (C3)")
+        self.assertEqual(frame.at["Tuesday", s0], "")
+
+    def test_exact_free_blocks_uses_window_catalog(self):
+        tt = self._empty_tt()
+        blocks = TT_gen.exact_free_blocks(tt, "Monday", 1.0)
+        self.assertIn(["09:00-10:00"], blocks)
+        self.assertIn(["14:30-15:30"], blocks)
+        for blk in blocks:
+            self.assertAlmostEqual(sum(TT_gen.slot_dur[s] for s in blk), 1.0)
+            self.assertFalse(set(blk) & TT_gen.FORBIDDEN_SLOTS)
+        tt.set("Monday", "09:00-10:00", "CS101")
+        self.assertNotIn(["09:00-10:00"], TT_gen.exact_free_blocks(tt, "Monday", 1.0))
+        self.assertIn(["09:00-10:00"], TT_gen.exact_free_blocks(tt, "Tuesday", 1.0))
+
+    def test_room_catalog_candidates(self):
+        cat = TT_gen.RoomCatalog([
+            {"Room_ID": "C301", "Capacity": 96, "Type": "Classroom"},
+            {"Room_ID": "C004", "Capacity": 240, "Type": "240-Seater Hall"},
+            {"Room_ID": "C302", "Capacity": 60, "Type": "Classroom"},
+            {"Room_ID": "L306", "Capacity": 48, "Type": "Lab"},
+        ])
+        self.assertEqual(cat.candidates(prefix="C3"), ("C301", "C302"))
+        self.assertEqual(cat.candidates(prefix="C3", min_capacity=80), ("C301",))
+        # no room with the prefix is big enough -> fall back to any classroom
+        self.assertEqual(cat.candidates(prefix="C3", min_capacity=100), ("C004",))
+        self.assertEqual(cat.candidates(lab=True, lab_prefix="L4"), ("L306",))
+        self.assertTrue(cat.meets_capacity("c004", 200))
+        self.assertFalse(cat.meets_capacity("C302", 61))
+        self.assertTrue(cat.meets_capacity("X999", 500))
+        self.assertEqual(cat.rooms_of_type("lab"), ("L306",))
+
+    def test_occupancy_index_masks(self):
+        idx = TT_gen.OccupancyIndex()
+        s0, s1, s2 = TT_gen.slot_keys[:3]
+        idx.occupy("Monday", "C101", TT_gen.slots_mask([s0, s1]))
+        self.assertFalse(idx.is_free("Monday", "C101", TT_gen.slots_mask([s1])))
+        self.assertTrue(idx.is_free("Tuesday", "C101", TT_gen.slots_mask([s1])))
+        self.assertEqual(idx.free_keys("Monday", ["C101", "C102"], TT_gen.slots_mask([s1, s2])), ["C102"])
+        snap = idx.copy()
+        idx.release("Monday", "C101", TT_gen.slots_mask([s0, s1]))
+        self.assertEqual(idx.keys_on("Monday"), [])
+        self.assertEqual(snap.slots_of("Monday", "C101"), [s0, s1])
+
+        baskets = TT_gen.OccupancyIndex()
+        baskets.occupy("Monday", ("B1", 3), TT_gen.slots_mask([s1]))
+        self.assertTrue(TT_gen.basket_clash(baskets, "B1", 5, "Monday", TT_gen.slots_mask([s1])))
+        self.assertFalse(TT_gen.basket_clash(baskets, "B1", 3, "Monday", TT_gen.slots_mask([s1])))
+
     def test_collect_unscheduled(self):
         courses = [
             {
@@ -95,6 +159,556 @@ class TestTTGen(unittest.TestCase):
         uns = TT_gen.collect_unscheduled(courses, placed, "TestGroup", year_tag=1, elective_sync=elective_sync)
         self.assertEqual([u["Course_Code"] for u in uns], ["CS103"])
 
+    def test_search_seeds_ranks_by_score(self):
+        ranked = TT_gen.search_seeds([3, 1, 0], jobs=1)
+        self.assertEqual(sorted(r["seed"] for r in ranked), [0, 1, 3])
+        keys = [(r["unscheduled"], r["clashes"]) for r in ranked]
+        self.assertEqual(keys, sorted(keys))
+        # clashes follow each cell's own faculty, not the code-keyed course map
+        for r in ranked:
+            usage = {}
+            for half, rows in r["placements"]["grids"].values():
+                for d, row in enumerate(rows):
+                    for si, v in enumerate(row):
+                        for fac in (v.faculty if isinstance(v, TT_gen.Placement) else ()):
+                            usage.setdefault((half, d, si, fac), set()).add(v.code)
+            self.assertEqual(r["clashes"], sum(1 for codes in usage.values() if len(codes) > 1))
+        # scoring leaves no state behind: the same seed scores the same again
+        again = TT_gen.score_seed(ranked[0]["seed"])
+        self.assertEqual((again["unscheduled"], again["clashes"]), keys[0])
+        # the winner renders from its placements, as building it again would
+        built = TT_gen.build_timetables(ranked[0]["seed"], sheets=True)
+        rendered = TT_gen.render_placements(ranked[0]["placements"])
+        self.assertEqual([m.rows for m in rendered["sheets"]], [m.rows for m in built["sheets"]])
+        self.assertEqual([m.merges for m in rendered["sheets"]], [m.merges for m in built["sheets"]])
+        self.assertEqual(rendered["faculty_tt"], built["faculty_tt"])
+
+    def test_same_seed_reproduces_timetable(self):
+        def snapshot(seed):
+            TT_gen.build_timetables(seed)
+            return {
+                label: [tt.row(d) for d in tt.days]
+                for label, (tt, _half) in TT_gen.timetable_grids.items()
+            }
+        first = snapshot(11)
+        self.assertEqual(snapshot(11), first)
+        self.assertTrue(first)
+        # one generator per generate() call, drawn from the run's generator
+        config = TT_gen.DATA.group_config
+        rngs = TT_gen.run_generators(config, 11)
+        self.assertEqual(list(rngs), [label for _g, _half, label in TT_gen.group_runs(config)])
+        draws = {label: rng.random() for label, rng in rngs.items()}
+        self.assertEqual({label: rng.random() for label, rng in TT_gen.run_generators(config, 11).items()}, draws)
+        self.assertEqual(len(set(draws.values())), len(draws))
+
+    def test_dataset_loads_on_first_use(self):
+        data = TT_gen.Dataset("data")
+        self.assertNotIn("courses", data.__dict__)
+        self.assertEqual(data.slot_keys, TT_gen.slot_keys)
+        self.assertNotIn("courses", data.__dict__)
+        self.assertIn("CSEA_I", data.course_groups)
+        out = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, TT_gen; print('pandas' in sys.modules, 'openpyxl' in sys.modules)"],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        self.assertEqual(out.strip(), "False False")
+
+    def test_group_dependencies_follow_shared_sync(self):
+        def group(label, elective, full_sem):
+            return {"key": label, "department": "CSE", "semester": 1, "label": label,
+                    "seeds": [0, 1], "elective_sync": elective, "full_sem_sync": full_sem}
+        config = {"departments": ["CSE"], "sheets": [
+            {"sheet": "S1", "groups": [group("A", "sem1", "sem1"), group("B", "sem1", "sem1")]},
+            {"sheet": "S3", "groups": [group("C", "sem3", "sem3")]},
+        ]}
+        deps = TT_gen.group_dependencies(config)
+        self.assertEqual(deps["A Second Half"], {"A First Half"})
+        self.assertEqual(deps["B First Half"], {"A First Half", "A Second Half"})
+        self.assertEqual(deps["C First Half"], set())
+        waves = TT_gen.dependency_waves(deps)
+        self.assertEqual(waves[0], ["A First Half", "C First Half"])
+        self.assertEqual(waves[-1], ["B Second Half"])
+
+    def test_parallel_build_merges_every_group(self):
+        def snapshot():
+            return {label: [tt.row(d) for d in tt.days]
+                    for label, (tt, _half) in TT_gen.timetable_grids.items()}
+        def double_bookings():
+            # C004 is shared by design; basket rooms are matched on their own
+            # copy of the room state, in serial builds too
+            rooms, faculty = {}, {}
+            for tt, half in TT_gen.timetable_grids.values():
+                for d in tt.days:
+                    for s, v in zip(tt.slots, tt.row(d)):
+                        if not isinstance(v, TT_gen.Placement):
+                            continue
+                        for r in (() if v.basket else v.rooms):
+                            if r != "C004":
+                                rooms.setdefault((half, d, s, r), set()).add(v.code)
+                        for fac in v.faculty:
+                            faculty.setdefault((half, d, s, fac), set()).add(v.code)
+            self.assertTrue(rooms and faculty)
+            return ({k: c for k, c in rooms.items() if len(c) > 1},
+                    {k: c for k, c in faculty.items() if len(c) > 1})
+        repair = TT_gen.repair_faculty_clashes
+        merged = []
+        def checked(*args, **kwargs):
+            merged.append(double_bookings())
+            return repair(*args, **kwargs)
+        TT_gen.build_timetables(5)
+        serial_labels = set(TT_gen.timetable_grids)
+        with mock.patch.object(TT_gen, "repair_faculty_clashes", checked):
+            first = TT_gen.build_timetables(5, jobs=2)
+        grids = snapshot()
+        self.assertEqual(set(grids), serial_labels)
+        self.assertTrue(set(first["rerun"]) <= {g["label"] for g in TT_gen.iter_groups(TT_gen.DATA.group_config)})
+        # the merged grids, before the repair passes could hide a collision
+        self.assertEqual(merged, [({}, {})])
+        self.assertEqual(double_bookings(), ({}, {}))
+        again = TT_gen.build_timetables(5, jobs=2)
+        self.assertEqual(snapshot(), grids)
+        self.assertEqual(again["rerun"], first["rerun"])
+
+    def test_repair_faculty_clashes_moves_later_run(self):
+        def group(label):
+            return {"key": label, "department": "CSE", "semester": 1, "label": label,
+                    "seeds": [0, 1], "elective_sync": "sem1"}
+        config = {"departments": ["CSE"], "sheets": [{"sheet": "S", "groups": [group("A"), group("B")]}]}
+        slot = "09:00-10:00"
+        a, b = self._empty_tt(), self._empty_tt()
+        a.set("Monday", slot, "CS101 (C101)")
+        b.set("Monday", slot, "CS201 (C102)")
+        TT_gen.reset_run_state()
+        TT_gen.timetable_grids["A First Half"] = (a, 1)
+        TT_gen.timetable_grids["B First Half"] = (b, 1)
+        state = TT_gen.new_run_state()
+        fmap = {"CS101": ["Dr. A"], "CS201": ["Dr. A"]}
+        moved = TT_gen.repair_faculty_clashes(config, state, fmap)
+        self.assertEqual(moved, 1)
+        self.assertEqual(a.get("Monday", slot), "CS101 (C101)")
+        self.assertEqual(b.get("Monday", slot), "")
+        new_slots = [s for s in b.slots if b.get("Monday", s) == "CS201 (C102)"]
+        self.assertEqual(len(new_slots), 1)
+        self.assertNotIn(new_slots[0], TT_gen.FORBIDDEN_SLOTS)
+        self.assertIn(new_slots[0], state["faculty_tt"][1]["Dr. A"]["Monday"])
+        self.assertEqual(TT_gen.count_faculty_clashes(fmap), 0)
+
+    def _repair_config(self):
+        def group(label):
+            return {"key": label, "department": "CSE", "semester": 1, "label": label,
+                    "seeds": [0, 1], "elective_sync": "sem1"}
+        return {"departments": ["CSE"], "sheets": [{"sheet": "S", "groups": [group("A"), group("B")]}]}
+
+    def test_repair_faculty_clashes_keeps_course_minutes(self):
+        def minutes(tt, value):
+            return sum(TT_gen.DATA.slot_minutes[s] for d in tt.days
+                       for s, v in zip(tt.slots, tt.row(d)) if v == value)
+        lec = TT_gen.Placement("CS201", "L", ("C102",), ("Dr. A",), False, False, False, None)
+        tut = TT_gen.Placement("CS201", "T", ("C102",), ("Dr. A",), False, False, False, None)
+        other = TT_gen.Placement("CS101", "L", ("C101",), ("Dr. A",), False, False, False, None)
+        a, b = self._empty_tt(), self._empty_tt()
+        a.set("Monday", "14:30-15:30", other)
+        b.place("Monday", ["14:00-14:30", "14:30-15:30"], lec)
+        b.place("Monday", ["15:40-16:00", "16:00-16:30", "16:30-17:10"], tut)
+        TT_gen.reset_run_state()
+        TT_gen.timetable_grids["A First Half"] = (a, 1)
+        TT_gen.timetable_grids["B First Half"] = (b, 1)
+        state = TT_gen.new_run_state()
+        self.assertEqual(TT_gen.repair_faculty_clashes(self._repair_config(), state, {}), 1)
+        self.assertEqual(minutes(b, lec), 90)
+        self.assertEqual(minutes(b, tut), 90)
+        self.assertEqual(minutes(a, other), 60)
+        self.assertEqual(TT_gen.count_faculty_clashes(), 0)
+
+    def test_repair_faculty_clashes_reads_faculty_from_placements(self):
+        # the course map names one teacher per code; this CS161 section has another
+        fmap = {"CS161": ["Dr. Y"], "CS262": ["Dr. X"]}
+        cs262 = TT_gen.Placement("CS262", "L", ("C101",), ("Dr. X",), False, False, False, None)
+        cs161 = TT_gen.Placement("CS161", "L", ("C102",), ("Dr. X",), False, False, False, None)
+        slot = "09:00-10:00"
+        a, b = self._empty_tt(), self._empty_tt()
+        a.set("Monday", slot, cs262)
+        b.set("Monday", slot, cs161)
+        TT_gen.reset_run_state()
+        TT_gen.timetable_grids["A First Half"] = (a, 1)
+        TT_gen.timetable_grids["B First Half"] = (b, 1)
+        state = TT_gen.new_run_state()
+        self.assertEqual(TT_gen.count_faculty_clashes(fmap), 1)
+        self.assertEqual(TT_gen.repair_faculty_clashes(self._repair_config(), state, fmap), 1)
+        self.assertEqual(TT_gen.count_faculty_clashes(fmap), 0)
+        new_slots = [s for s in b.slots if b.get("Monday", s) == cs161]
+        self.assertEqual(state["faculty_tt"][1]["Dr. X"]["Monday"], {s: cs161 for s in new_slots})
+        self.assertNotIn("Dr. Y", state["faculty_tt"][1])
+
+    def test_write_sheet_streams_merged_model(self):
+        from openpyxl import Workbook, load_workbook
+        model = TT_gen.SheetModel("S")
+        model.append([""])
+        model.append(["Block"])
+        model.append(["Day", "09:00-10:00", "10:00-11:00", "11:00-12:00"])
+        model.append(["Monday", "CS101 (C101)", "CS101 (C101)", ""])
+        TT_gen.reset_color_palette()
+        TT_gen.merge_and_color(model, [{"Course_Code": "CS101"}])
+        self.assertEqual(model.merges, [(4, 2, 3)])
+        self.assertEqual(model.rows[3][2], None)
+        self.assertEqual(model.widths[2], len("CS101 (C101)") + 2)
+        self.assertEqual(model.styles[4][2]["fill"], model.styles[4][3]["fill"])
+        wb = Workbook(write_only=True)
+        TT_gen.write_sheet(wb, model, {}, first=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.xlsx")
+            wb.save(path)
+            ws = load_workbook(path)["S"]
+            self.assertEqual([str(r) for r in ws.merged_cells.ranges], ["B4:C4"])
+            self.assertEqual(ws["B4"].value, "CS101 (C101)")
+            self.assertTrue(ws["B4"].font.b)
+            self.assertEqual(ws["B4"].fill.fill_type, "solid")
+            self.assertEqual(ws["D4"].border.left.style, "thin")
+            self.assertEqual(ws.column_dimensions["B"].width, len("CS101 (C101)") + 2)
+
+    def test_faculty_exports_write_workbooks(self):
+        from openpyxl import load_workbook
+        slots = ["09:00-10:00", "10:00-11:00"]
+        faculty_tt = {1: {"Dr. A": {"Monday": {slots[0]: "CS101 (C101)"}}},
+                      2: {"Dr. B": {"Tuesday": {slots[1]: "CS201 (C102)"}}}}
+        index = {"CS101": [("Intro", "CSE", "Dr. A")]}
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                tasks = TT_gen.faculty_export_tasks(faculty_tt, index, slots, faculty_dir="per_faculty")
+                TT_gen.run_exports(tasks, jobs=1)
+                first = load_workbook("Faculty_Timetable_First_Half.xlsx")
+                self.assertEqual(first.sheetnames, ["Dr. A"])
+                ws = first["Dr. A"]
+                self.assertEqual(ws["B2"].value, "CS101 (C101)")
+                self.assertEqual(ws["B2"].fill.fill_type, "solid")
+                self.assertEqual([c.value for c in ws[10]], ["CS101", "Intro", "CSE"])
+                self.assertEqual(sorted(os.listdir("per_faculty")), ["Dr. A.xlsx", "Dr. B.xlsx"])
+                own = load_workbook(os.path.join("per_faculty", "Dr. B.xlsx"))
+                self.assertEqual(own.sheetnames, ["First Half", "Second Half"])
+                self.assertEqual(own["Second Half"]["C3"].value, "CS201 (C102)")
+            finally:
+                os.chdir(cwd)
+
+    def test_placement_renders_only_at_export(self):
+        tt = self._empty_tt()
+        s0, s1 = TT_gen.slot_keys[1:3]
+        # a lecture in a room whose id contains "LAB" stays a lecture
+        lec = TT_gen.Placement("CS101", "L", ("LAB3",), ("Dr. A",), False, False, False, None)
+        tut = TT_gen.Placement("CS101", "T", ("C3",), ("Dr. A",), False, False, False, None)
+        tt.set("Monday", s0, lec)
+        tt.set("Monday", s1, tut)
+        self.assertEqual(str(lec), "CS101 (LAB3)")
+        self.assertEqual(str(tut), "CS101 TUT (C3)")
+        self.assertEqual(TT_gen._classify_slot_val("CS101", lec), "L")
+        self.assertEqual(TT_gen.extract_course_code(tut), "CS101")
+        self.assertEqual(TT_gen.collect_code_slot_blocks(tt, "CS101"), [("Monday", [s0, s1])])
+        self.assertEqual(TT_gen.build_room_map_from_tt(tt), {"CS101": {"LAB3", "C3"}})
+        hidden = TT_gen.Placement("MA101", "T", ("C004",), (), False, True, True, None)
+        self.assertEqual(str(hidden), "MA101 TUT")
+
+    def test_course_index_follows_writes(self):
+        tt = self._empty_tt()
+        s0, s1, s2 = TT_gen.slot_keys[1:4]
+        lec = TT_gen.Placement("CS101", "L", ("C3",), (), False, False, False, None)
+        lab = TT_gen.Placement("CS101", "P", ("L105",), (), False, False, False, None)
+        tt.place("Tuesday", [s0, s1], lec)
+        tt.set("Tuesday", s2, lab)
+        self.assertEqual(tt.course_runs("CS101", by_typ=True),
+                         [("Tuesday", [s0, s1], "L"), ("Tuesday", [s2], "P")])
+        tt.set("Tuesday", s1, "")
+        self.assertEqual(tt.course_slots("CS101", "Tuesday"), [s0, s2])
+        self.assertEqual(TT_gen.build_room_map_from_tt(tt), {"CS101": {"C3", "Lab-L105"}})
+        tt.set("Tuesday", s0, "")
+        self.assertEqual(TT_gen.build_room_map_from_tt(tt), {"CS101": {"Lab-L105"}})
+
+    def test_free_runs_and_exact_fit(self):
+        tt = self._empty_tt()
+        idx = tt.slot_idx
+        runs = tt.free_runs("Monday")
+        self.assertTrue(all(tt.slots[i] not in TT_gen.FORBIDDEN_SLOTS
+                            for start, end in runs for i in range(start, end)))
+        afternoon = next(r for r in runs if r[0] == idx["14:00-14:30"])
+        # 14:00-14:30 + 14:30-15:30 is the first exact 90-minute slice
+        self.assertEqual(tt.windows.fit(*afternoon, 90, exact=True),
+                         (idx["14:00-14:30"], idx["15:30-15:40"]))
+        self.assertEqual(tt.windows.fit(*afternoon, 60, exact=True),
+                         (idx["14:30-15:30"], idx["15:30-15:40"]))
+        tt.set("Monday", "14:30-15:30", "CS101 (C3)")
+        runs = tt.free_runs("Monday")
+        self.assertIn((idx["14:00-14:30"], idx["14:30-15:30"]), runs)
+        self.assertIn((idx["15:30-15:40"], afternoon[1]), runs)
+        tt.set("Monday", "14:30-15:30", "")
+        self.assertIn(afternoon, tt.free_runs("Monday"))
+
+    def test_window_catalog_uses_exact_minutes(self):
+        # a 10-minute grid: thirds of an hour would not add up exactly in float hours
+        slots = ["09:00-09:10", "09:10-09:30", "09:30-10:00", "10:00-10:40"]
+        minutes = {"09:00-09:10": 10, "09:10-09:30": 20, "09:30-10:00": 30, "10:00-10:40": 40}
+        cat = TT_gen.WindowCatalog(slots, minutes)
+        self.assertEqual(cat.prefix, [0, 10, 30, 60, 100])
+        self.assertEqual([w for w, _m in cat.windows(60)], [tuple(slots[:3])])
+        self.assertEqual(cat.fit(0, 4, 70, exact=True), (2, 4))
+        self.assertEqual(cat.fit(0, 4, 25), (0, 2))
+        self.assertEqual(TT_gen.duration_key(1 / 3), 20)
+
+    def test_occupancy_tensor_mirrors_indexes(self):
+        state = TT_gen.new_run_state()
+        tensor = state["occupancy"]
+        slots = TT_gen.DATA.slot_keys
+        rooms = TT_gen.DATA.rooms.order[:3]
+        mask = TT_gen.slots_mask(slots[:2])
+        state["room_busy"][0].occupy("Tuesday", rooms[0], mask)
+        state["faculty_busy"][2].occupy("Tuesday", "Dr. X", mask)
+        # full-semester room bookings show in both halves, faculty only in its own
+        for half in (1, 2):
+            self.assertEqual(tensor.free_resources(half, "Tuesday", slots[1:3], names=rooms), rooms[1:])
+            self.assertEqual(tensor.first_free(half, "Tuesday", rooms, slots[:1]), rooms[1])
+        self.assertIn("Dr. X", tensor.idle(1, "Tuesday"))
+        self.assertNotIn("Dr. X", tensor.idle(2, "Tuesday"))
+        self.assertGreater(tensor.utilization(2, "faculty")["Dr. X"], 0)
+        self.assertEqual(tensor.utilization(1, "faculty")["Dr. X"], 0)
+        # Monday is still open; booking its first window moves the fit on
+        first = TT_gen.DATA.slot_minutes[slots[0]]
+        opening = list(TT_gen.window_catalog(slots).windows(first)[0][0])
+        self.assertEqual(tensor.first_fit(2, "Dr. X", first, kind="faculty"), ("Monday", opening))
+        state["faculty_busy"][2].occupy("Monday", "Dr. X", TT_gen.slots_mask(opening))
+        self.assertNotEqual(tensor.first_fit(2, "Dr. X", first, kind="faculty"), ("Monday", opening))
+        state["room_busy"][0].release("Tuesday", rooms[0], mask)
+        self.assertEqual(tensor.first_free(1, "Tuesday", rooms, slots[:1]), rooms[0])
+
+    def test_occupancy_tensor_release_keeps_other_layers(self):
+        state = TT_gen.new_run_state()
+        layers = state["room_busy"]
+        first = TT_gen.RoomLayerView(layers, 1)
+        rooms = ["C101", "C102"]
+        mask = TT_gen.slots_mask(TT_gen.DATA.slot_keys[1:3])
+        # C004 style: the same room booked in layer 0 and layer 1, then released from layer 1
+        layers[0].occupy("Monday", "C101", mask)
+        layers[1].occupy("Monday", "C101", mask)
+        layers[1].release("Monday", "C101", mask)
+        slots = TT_gen.DATA.slot_keys[1:3]
+        self.assertEqual(first.first_free("Monday", rooms, mask), "C102")
+        self.assertEqual(first.tensor_feed.first_free("Monday", rooms, slots), "C102")
+        self.assertEqual(state["occupancy"].first_free(2, "Monday", rooms, slots), "C102")
+        layers[0].release("Monday", "C101", mask)
+        self.assertEqual(first.tensor_feed.first_free("Monday", rooms, slots), "C101")
+
+    def test_occupancy_tensor_picks_same_room_as_bitmasks(self):
+        config = dict(TT_gen.DATA.group_config, quality={"anneal_moves": 2000})
+        TT_gen.build_timetables(0, config=config)
+        layers = dict(zip(TT_gen.ROOM_LAYERS, TT_gen.GLOBAL_ROOM_BUSY.seen))
+        rooms = list(TT_gen.DATA.rooms.order)
+        slots = TT_gen.DATA.slot_keys
+        windows = TT_gen.window_catalog(slots).windows(60)
+
+        def check():
+            for half in TT_gen.ROOM_LAYERS:
+                view = TT_gen.RoomLayerView(layers, half)
+                for d in TT_gen.days:
+                    for w, mask in windows:
+                        for k in range(0, len(rooms), 7):
+                            order = rooms[k:] + rooms[:k]
+                            self.assertEqual(view.tensor_feed.first_free(d, order, w),
+                                             view.first_free(d, order, mask), (half, d, w, k))
+
+        # the run released rooms (clash repair, reroute, annealing, room reassignment)
+        check()
+        log = TT_gen.UndoLog()
+        mark = log.checkpoint()
+        w, mask = windows[0]
+        for r in rooms[1:]:
+            log.occupy(layers[1], "Monday", r, mask)
+        # a room held in both layer 0 and layer 1, released from layer 1
+        log.occupy(layers[0], "Monday", rooms[0], mask)
+        log.occupy(layers[1], "Monday", rooms[0], mask)
+        log.release(layers[1], "Monday", rooms[0], mask)
+        check()
+        log.rollback(mark)
+        check()
+
+    def test_room_layers_free_rooms_of_the_other_half(self):
+        layers = TT_gen.new_room_layers()
+        first, second, full = (TT_gen.RoomLayerView(layers, half) for half in (1, 2, 0))
+        rooms = ["C101", "C102", "C103"]
+        mask = TT_gen.slots_mask(TT_gen.DATA.slot_keys[1:3])
+        first.occupy("Monday", "C101", mask)
+        full.occupy("Monday", "C102", mask)
+        self.assertEqual(first.first_free("Monday", rooms, mask), "C103")
+        # a first-half booking leaves the room free in the second half
+        self.assertEqual(second.first_free("Monday", rooms, mask), "C101")
+        self.assertFalse(second.is_free("Monday", "C102", mask))
+        self.assertEqual(full.first_free("Monday", rooms, mask), "C103")
+        self.assertEqual(set(full.copy().keys_on("Monday")), {"C101", "C102"})
+        second.occupy("Monday", "C103", mask)
+        self.assertIsNone(full.first_free("Monday", rooms, mask))
+        self.assertEqual(layers[2].keys_on("Monday"), ["C103"])
+
+    def test_undo_log_rolls_back_allocations(self):
+        tt = self._empty_tt()
+        busy, faculty_busy = TT_gen.OccupancyIndex(), TT_gen.OccupancyIndex()
+        layers = TT_gen.new_room_layers()
+        room_busy = TT_gen.RoomLayerView(layers, 1)
+        rm, labsd, faculty_tt = {}, set(), {}
+        course_usage = {d: {} for d in TT_gen.days}
+        slots = ["09:00-10:00", "10:00-10:30"]
+        kwargs = dict(faculty_tt=faculty_tt, semester_half=1, faculty_busy_global=faculty_busy)
+        self.assertTrue(TT_gen.alloc_specific(tt, busy, rm, room_busy, "Monday", slots, "Dr. A", "CS101", "L",
+                                              False, labsd, course_usage, **kwargs))
+        before = (list(map(list, tt.cells)), list(tt.occ), dict(rm), set(labsd), repr(course_usage),
+                  repr(faculty_tt), repr(busy._by_day), repr(faculty_busy._by_day), repr(layers[1]._by_day))
+        log = TT_gen.UndoLog()
+        mark = log.checkpoint()
+        self.assertTrue(TT_gen.alloc_specific(tt, busy, rm, room_busy, "Tuesday", ["14:30-15:30"], "Dr. A, Dr. B",
+                                              "CS102", "P", False, labsd, course_usage, undo=log, **kwargs))
+        self.assertTrue(TT_gen.alloc(tt, busy, rm, room_busy, "Monday", "Dr. B", "CS102", 60, "T", labsd=labsd,
+                                     course_usage=course_usage, undo=log, **kwargs))
+        self.assertIn("Tuesday", labsd)
+        self.assertTrue(tt.course_slots("CS102", "Monday"))
+        log.rollback(mark)
+        after = (list(map(list, tt.cells)), list(tt.occ), dict(rm), set(labsd), repr(course_usage),
+                 repr(faculty_tt), repr(busy._by_day), repr(faculty_busy._by_day), repr(layers[1]._by_day))
+        self.assertEqual(after, before)
+        self.assertEqual(tt.course_runs("CS102"), [])
+        self.assertEqual(log.entries, [])
+
+    def test_backtrack_search_orders_by_mrv_and_reports_culprit(self):
+        # toy problem on one day: chunk 1 fits only window "a", chunk 0 fits "a" or "b"
+        used = {}
+        log = TT_gen.UndoLog()
+        allowed = {0: ["a", "b"], 1: ["a"], 2: ["a"]}
+
+        def windows_on(k, day, among=None):
+            if day != "Monday":
+                return []
+            return [(w, 0) for w in allowed[k] if w not in used]
+
+        def place(k, day, slots):
+            log.setitem(used, slots, k)
+            return True
+
+        search = TT_gen.BacktrackSearch([0, 1], windows_on, place, lambda k: TT_gen.days, log)
+        self.assertIsNone(search.run())
+        self.assertEqual(used, {"a": 1, "b": 0})
+        # chunks 1 and 2 both need "a": placing 1 empties 2's domain, so 1 is
+        # undone and, with nothing else to try, named as the chunk to drop
+        used.clear()
+        search = TT_gen.BacktrackSearch([0, 1, 2], windows_on, place, lambda k: TT_gen.days, log)
+        self.assertEqual(search.run(), 1)
+        self.assertLess(search.budget, TT_gen.BACKTRACK_BUDGET)
+        self.assertEqual(TT_gen.component_blocks("L", 120), [90, 30])
+        self.assertEqual(TT_gen.component_blocks("P", 180), [120, 60])
+
+    def test_backtrack_engine_places_every_course_hour(self):
+        def snapshot():
+            result = TT_gen.build_timetables(3, engine="backtrack")
+            grids = {label: [tt.row(d) for d in tt.days]
+                     for label, (tt, _half) in TT_gen.timetable_grids.items()}
+            return result["unscheduled"], grids
+        unscheduled, grids = snapshot()
+        self.assertEqual(unscheduled, [])
+        self.assertEqual(snapshot()[1], grids)
+
+    def test_reroute_places_course_the_greedy_engine_left_out(self):
+        # seed 0: the greedy pass cannot fit CS307 (3-2-0) in DSAI-III; the
+        # rip-up and reroute pass moves a few courses out of its way
+        result = TT_gen.build_timetables(0)
+        self.assertEqual(result["unscheduled"], [])
+        tt, _half = TT_gen.timetable_grids["DSAI-III First Half"]
+        minutes = sum(TT_gen.DATA.slot_minutes[s_] for d, slots, _t in tt.course_runs("CS307") for s_ in slots)
+        self.assertEqual(minutes, 300)
+        # the releases it unplaces with are journaled like every other write
+        index, log, rm = TT_gen.OccupancyIndex(), TT_gen.UndoLog(), {("CS307", "L"): "C101"}
+        index.occupy("Monday", "Dr. A", 0b110)
+        mark = log.checkpoint()
+        log.release(index, "Monday", "Dr. A", 0b011)
+        log.delitem(rm, ("CS307", "L"))
+        self.assertEqual((index.mask("Monday", "Dr. A"), rm), (0b100, {}))
+        log.rollback(mark)
+        self.assertEqual((index.mask("Monday", "Dr. A"), rm), (0b110, {("CS307", "L"): "C101"}))
+
+    def test_block_annealer_closes_gaps_without_clashes(self):
+        tt = self._empty_tt()
+        blocks = []
+        for code, fac, slots in (("CS101", "Dr. A", ["09:00-10:00"]), ("CS102", "Dr. B", ["14:30-15:30"])):
+            v = TT_gen.make_placement(code, "L", "C101", False, None, False, None, [fac])
+            tt.place("Monday", slots, v)
+            blocks.append({"key": code, "value": v, "facs": (fac,), "rooms": ("C101",), "minutes": 60,
+                           "day": "Monday", "slots": tuple(slots), "mask": tt.mask_of(slots)})
+        # Dr. B is booked elsewhere all week except Monday
+        full = (1 << len(tt.slots)) - 1
+        faculty_mask = lambda d, fac: full if (fac == "Dr. B" and d != "Monday") else 0
+        quality = TT_gen.quality_settings({"weights": {"gap": 1, "day_load": 0, "faculty_run": 0}})
+        self.assertEqual(quality["max_run_minutes"], TT_gen.QUALITY_DEFAULTS["max_run_minutes"])
+        annealer = TT_gen.BlockAnnealer(tt, blocks, faculty_mask, lambda d, r: 0, quality)
+        start, best = annealer.run(2000, random.Random(0))
+        self.assertGreater(start, 0)
+        self.assertEqual(best, 0)
+        a, b = blocks
+        self.assertEqual(b["day"], "Monday")
+        self.assertFalse(a["day"] == b["day"] and a["mask"] & b["mask"])
+        self.assertEqual(a["mask"], tt.mask_of(a["slots"]))
+        with self.assertRaises(Exception):
+            TT_gen.quality_settings({"weights": {"gaps": 1}})
+
+    @unittest.skipUnless(importlib.util.find_spec("ortools"), "needs ortools")
+    def test_cpsat_engine_for_one_group(self):
+        engine = {"*": "greedy", "DSAI-III": "cpsat"}
+        self.assertEqual(TT_gen.group_engine(engine, {"label": "DSAI-III"}), "cpsat")
+        self.assertEqual(TT_gen.group_engine(engine, {"label": "CSEA I"}), "greedy")
+        self.assertEqual(TT_gen.group_engine("backtrack", {"label": "CSEA I"}), "backtrack")
+        result = TT_gen.build_timetables(0, engine=engine)
+        self.assertEqual(result["unscheduled"], [])
+        tt, _half = TT_gen.timetable_grids["DSAI-III First Half"]
+        minutes = sum(TT_gen.DATA.slot_minutes[s_] for d, slots, _t in tt.course_runs("CS307") for s_ in slots)
+        self.assertEqual(minutes, 300)
+
+    def test_match_rooms_minimises_empty_seats_and_certifies_shortfalls(self):
+        # C101 seats 96, C002 136, C004 240
+        got, cert = TT_gen.match_rooms([("B", 90), ("A", 130)], {"B": ["C002", "C101"], "A": ["C004", "C002"]})
+        self.assertEqual((got, cert), ({"B": "C101", "A": "C002"}, None))
+        # a room large enough beats a closer one that is too small
+        got, _cert = TT_gen.match_rooms([("A", 100)], {"A": ["C101", "C004"]})
+        self.assertEqual(got, {"A": "C004"})
+        items = [("X", 40), ("Y", 40), ("Z", 40)]
+        got, cert = TT_gen.match_rooms(items, {"X": ["C101"], "Y": ["C101"], "Z": ["C101", "C102"]})
+        self.assertEqual(len(got), 2)
+        self.assertEqual(got["Z"], "C102")
+        self.assertEqual(cert, (["X", "Y"], ["C101"]))
+        self.assertEqual(TT_gen.min_cost_assignment([[3, 1], [1, 3]]), [1, 0])
+
+    def test_reassign_rooms_moves_component_to_smallest_free_room(self):
+        def group(label):
+            return {"key": "CSEA_I", "department": "CSE", "semester": 1, "label": label,
+                    "seeds": [0, 1], "elective_sync": "sem1", "room_prefix": "C1"}
+        config = {"departments": ["CSE"], "sheets": [{"sheet": "S", "groups": [group("A"), group("B")]}]}
+        slot = "09:00-10:00"
+        a, b = self._empty_tt(), self._empty_tt()
+        # CS161 (85 students, full semester) sits in the 240-seat hall; C101 is taken
+        v = TT_gen.make_placement("CS161", "L", "C004", False, None, False, 1, ["Dr. A"])
+        a.set("Monday", slot, v)
+        b.set("Monday", slot, "EC161 (C101)")
+        TT_gen.reset_run_state()
+        TT_gen.timetable_grids["A First Half"] = (a, 1)
+        TT_gen.timetable_grids["B First Half"] = (b, 1)
+        state = TT_gen.new_run_state()
+        bit = a.slot_bit[slot]
+        state["room_busy"][0].occupy("Monday", "C004", bit)
+        state["faculty_tt"][1]["Dr. A"] = {"Monday": {slot: v}}
+        results = {"A": {"legends": [("A - First Half", [["CS161", "", "", "", "No", "No", "C004"]]),
+                                     ("A - Second Half", [])]}}
+        self.assertEqual(TT_gen.reassign_rooms(config, state, results), 1)
+        room = a.get("Monday", slot).rooms[0]
+        self.assertIn(room, ("C102", "C104"))
+        self.assertEqual(state["faculty_tt"][1]["Dr. A"]["Monday"][slot].rooms, (room,))
+        self.assertTrue(state["room_busy"][0].is_free("Monday", "C004", bit))
+        self.assertFalse(state["room_busy"][0].is_free("Monday", room, bit))
+        self.assertEqual(results["A"]["legends"][0][1][0][6], room)
+        # nothing better is left, so a second pass keeps every room
+        self.assertEqual(TT_gen.reassign_rooms(config, state, results), 0)
+
 
 if __name__ == "__main__":
-    unittest.main()
+    unittest.main()